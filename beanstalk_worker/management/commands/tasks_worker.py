@@ -1,3 +1,6 @@
+import select
+import threading
+
 from logging import getLogger
 
 from django.core.management.base import BaseCommand
@@ -10,26 +13,45 @@ LISTEN_TIMEOUT = 30
 
 logger = getLogger(__name__)
 
-import select
-
 
 class Command(BaseCommand):
     help = """Permanently listen for new background task and execute them
-    
-    For local and dev, don't run more than one as it is not designed for concurrency"""
 
-    def handle(self, *args, **kwargs):
+    Tasks are claimed with `SELECT ... FOR UPDATE SKIP LOCKED`, so several workers can run at the same time, in this
+    process with `--workers` or in other processes or nodes. See `TASK_WORKER_CONCURRENCY_LIMITS` and
+    `TASK_WORKER_PRIORITIES` in the settings to limit or favour some tasks."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=1, help="number of tasks run concurrently by this process")
+
+    def handle(self, *args, workers, **kwargs):
+        if workers <= 1:
+            self.work()
+            return
+
+        threads = [threading.Thread(target=self.work, name=f"tasks_worker_{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def work(self):
         # see `Worker connection` in services.py
+        # Django connections are per thread, so each worker has its own connection and LISTEN
         connection = connections["worker"]
 
         cur = connection.cursor()
         cur.execute("LISTEN new_task;")
         pg_conn = cur.connection  # psycopg connection instead of the django wrapper
 
-        print(f"Listening for task on {pg_conn.dsn} .... Press ^C to stop")
+        print(f"{threading.current_thread().name} listening for task on {pg_conn.dsn} .... Press ^C to stop")
 
         while True:
-            task_service.run_all()
+            try:
+                task_service.run_all()
+            except Exception:
+                # the task itself reports its failures, this is an error of the worker, don't let it die
+                logger.exception("Error while running the queued tasks")
             # queue is empty, wait till we receive a new notification
             if select.select([pg_conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
                 print("Listen Timeout, check if there is a task anyway")
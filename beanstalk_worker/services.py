@@ -2,18 +2,20 @@ import decimal
 import importlib
 import json
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from logging import getLogger
 
 import boto3
 import dateparser
 
 from django.conf import settings
-from django.db import connection
+from django.db import connection, connections, transaction
+from django.db.models import Case, Count, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Greatest
 from django.utils import timezone
 
 from iaso.models.base import KILLED, QUEUED, RUNNING
-from iaso.models.task import Task
+from iaso.models.task import Task, TaskLog
 
 
 logger = getLogger(__name__)
@@ -30,6 +32,11 @@ logger = getLogger(__name__)
 #  so the work around we found was to make a new database configuration in the django system, which is a copy of the original one.
 
 
+# Key of the advisory lock taken while claiming a task when concurrency limits are configured, so two workers cannot
+# both see the same free slot.
+TASK_CLAIM_LOCK_ID = 8_513_771
+
+
 def json_dump(obj):
     if isinstance(obj, datetime):
         return {"__type__": "datetime", "value": obj.isoformat()}
@@ -61,22 +68,33 @@ class _TaskServiceBase:
 
     def run(self, module_name, method_name, task_id, args, kwargs):
         """run a task, called by the view that receives them from the queue"""
-        kwargs["_immediate"] = True
         #  for the using() see Worker connection above
         task = self.get_queryset().get(id=task_id)
-        if task.status == QUEUED:  # ensure a task is only run once
+        if task.status == QUEUED and self.claim(task):  # ensure a task is only run once
+            self.execute(task, module_name, method_name, args, kwargs)
+
+    def claim(self, task):
+        """Mark a queued task as running, return False if another worker was faster"""
+        started_at = timezone.now()
+        claimed = self.get_queryset().filter(id=task.id, status=QUEUED).update(status=RUNNING, started_at=started_at)
+        if claimed:
             task.status = RUNNING
-            task.started_at = timezone.now()
-            task.save()
-            module = importlib.import_module(module_name)
-            method = getattr(module, method_name)
-            assert method._is_task
+            task.started_at = started_at
+        return bool(claimed)
+
+    def execute(self, task, module_name, method_name, args, kwargs):
+        """Run a task already claimed (in status RUNNING)"""
+        kwargs["_immediate"] = True
+        module = importlib.import_module(module_name)
+        method = getattr(module, method_name)
+        assert method._is_task
 
-            method(*args, task=task, **kwargs)
+        method(*args, task=task, **kwargs)
 
-            task.refresh_from_db()
-            if task.status == RUNNING:
-                logger.warning(f"Task {task} still in status RUNNING after execution")
+        task.flush_progress()
+        task.refresh_from_db()
+        if task.status == RUNNING:
+            logger.warning(f"Task {task} still in status RUNNING after execution")
 
     def enqueue(self, module_name, method_name, args, kwargs, task_id):
         body = json.dumps(
@@ -93,6 +111,7 @@ class PostgresTaskService(_TaskServiceBase):
         return {"result": "recorded into DB"}
 
     def run_task(self, task):
+        """Run a task claimed by `claim_next`"""
         params = task.params
 
         if not (params and "module" in params and "method" in params):
@@ -101,7 +120,57 @@ class PostgresTaskService(_TaskServiceBase):
             task.status = KILLED
             task.save()
             return
-        self.run(params["module"], params["method"], task.id, params["args"], params["kwargs"])
+        self.execute(task, params["module"], params["method"], params["args"], params["kwargs"])
+        if task.name in settings.TASK_WORKER_CONCURRENCY_LIMITS:
+            # a slot is free again, wake up the workers waiting for it
+            self._enqueue("")
+
+    def claim_next(self):
+        """Atomically take the next queued task and mark it as running, or return None if there is none.
+
+        Queued rows locked by another worker are skipped (`SELECT ... FOR UPDATE SKIP LOCKED`), so any number of
+        workers, on one or several nodes, can claim tasks concurrently without running a task twice.
+
+        Tasks are taken by priority (`TASK_WORKER_PRIORITIES`, highest first) then in creation order. A task name
+        which has reached its limit in `TASK_WORKER_CONCURRENCY_LIMITS` is not taken until one of its tasks ends, or
+        hasn't reported any progress for more than `TASK_WORKER_STALE_RUNNING_TIMEOUT` seconds.
+        """
+        queryset = self.get_queryset()
+        limits = settings.TASK_WORKER_CONCURRENCY_LIMITS
+        priorities = settings.TASK_WORKER_PRIORITIES
+
+        with transaction.atomic(using=queryset.db):
+            queued = queryset.filter(status=QUEUED)
+            if limits:
+                with connections[queryset.db].cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [TASK_CLAIM_LOCK_ID])
+                # a task left running by a crashed worker would hold its slot forever. Long tasks still report their
+                # progress, which is logged: the last log is their heartbeat.
+                stale_cutoff = timezone.now() - timedelta(seconds=settings.TASK_WORKER_STALE_RUNNING_TIMEOUT)
+                last_log = TaskLog.objects.filter(task=OuterRef("pk")).order_by("-created_at").values("created_at")
+                running_counts = dict(
+                    queryset.filter(status=RUNNING, name__in=limits)
+                    .annotate(last_heartbeat=Greatest("started_at", Subquery(last_log[:1])))
+                    .exclude(last_heartbeat__lt=stale_cutoff)
+                    .order_by()
+                    .values_list("name")
+                    .annotate(count=Count("id"))
+                )
+                full_names = [name for name, limit in limits.items() if running_counts.get(name, 0) >= limit]
+                queued = queued.exclude(name__in=full_names)
+            if priorities:
+                whens = [When(name=name, then=Value(priority)) for name, priority in priorities.items()]
+                queued = queued.annotate(priority=Case(*whens, default=Value(0), output_field=IntegerField()))
+                queued = queued.order_by("-priority", "created_at", "id")
+            else:
+                queued = queued.order_by("created_at", "id")
+
+            task = queued.select_for_update(skip_locked=True).first()
+            if task:
+                task.status = RUNNING
+                task.started_at = timezone.now()
+                task.save(update_fields=["status", "started_at"])
+        return task
 
     def run_all(self):
         """run everything in the queue"""
@@ -112,12 +181,12 @@ class PostgresTaskService(_TaskServiceBase):
                 sids, func = connection.run_on_commit.pop(0)
                 func()
         count = 0
-        task = self.get_queryset().filter(status=QUEUED).first()
+        task = self.claim_next()
         while task:
             self.run_task(task)
             logger.info("=" * 20 + " End task exec " + "=" * 20)
             # Fetch next task
-            task = self.get_queryset().filter(status=QUEUED).first()
+            task = self.claim_next()
             count += 1
         return count
 
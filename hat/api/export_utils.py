@@ -1,5 +1,7 @@
 import csv
 import io
+import os
+import tempfile
 
 from datetime import datetime
 
@@ -13,7 +15,7 @@ from xlsxwriter.utility import xl_rowcol_to_cell  # type: ignore
 from hat.common.utils import queryset_iterator
 
 
-def write_sheet(wb, sheet_name, col_descs, queryset, get_row, sub_columns=None):
+def write_sheet(wb, sheet_name, col_descs, queryset, get_row, sub_columns=None, chunked=False):
     ws = wb.add_worksheet(sheet_name)
 
     bold = wb.add_format({"bold": True})
@@ -39,6 +41,9 @@ def write_sheet(wb, sheet_name, col_descs, queryset, get_row, sub_columns=None):
         row_num += 1
         ws.write_row("A" + str(row_num), sub_columns)
 
+    if chunked and isinstance(queryset, QuerySet):
+        queryset = queryset_iterator(queryset)
+
     for item in queryset:
         row_num += 1
         if row_num % 1000 == 0 and settings.DEBUG:
@@ -82,20 +87,44 @@ def generate_xlsx(sheet_name, columns, queryset, get_row, sub_columns=None):
     :return: the XLSX result to be included in the response. This is always using a temporary file.
     """
     output = io.BytesIO()
+    write_workbook(output, sheet_name, columns, queryset, get_row, sub_columns)
+    output.seek(0)
+    return output
+
+
+def generate_xlsx_file(sheet_name, columns, queryset, get_row, sub_columns=None):
+    """
+    Generate an XLSX file on disk, with the same parameters as `generate_xlsx`.
+
+    Rows are written incrementally (querysets are iterated by chunks) and the workbook is assembled in a temporary
+    file instead of in memory, so the memory used doesn't depend on the number of rows. This is the one to use for
+    large exports, typically with `iaso.exports.CleaningFileResponse` which removes the file once it has been sent.
+
+    :return: the path of the temporary XLSX file. The caller is responsible for removing it.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as output:
+        path = output.name
+    try:
+        write_workbook(path, sheet_name, columns, queryset, get_row, sub_columns, chunked=True)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def write_workbook(output, sheet_name, columns, queryset, get_row, sub_columns=None, chunked=False):
+    """With `chunked`, the querysets are iterated by chunks instead of being loaded at once."""
     wb = xlsxwriter.Workbook(output, {"constant_memory": True, "remove_timezone": True})
     if isinstance(sheet_name, list):
         i = 0
         for sheet in sheet_name:
-            write_sheet(wb, sheet[:31], columns[i], queryset[i], get_row[i])
+            write_sheet(wb, sheet[:31], columns[i], queryset[i], get_row[i], chunked=chunked)
             i += 1
     else:
-        write_sheet(wb, sheet_name[:31], columns, queryset, get_row, sub_columns)
+        write_sheet(wb, sheet_name[:31], columns, queryset, get_row, sub_columns, chunked=chunked)
 
     wb.close()
 
-    output.seek(0)
-    return output
-
 
 class Echo:
     def write(self, value):
@@ -2,15 +2,19 @@ import json
 import logging
 import uuid
 
-from typing import Any, Optional, TypeVar, Union
+from typing import Any, Iterable, Optional, TypeVar, Union
 
+from django.apps import apps
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
 from django.core import serializers
 from django.db import models
 
 from hat.audit.modifications import get_values_serializer
+from iaso.utils.gis import simplify_geom
 
 
 logger = logging.getLogger(__name__)
@@ -187,6 +191,39 @@ def log_modification(
     user: User = None,
     org_unit_change_request_id: int = None,
 ) -> Modification:
+    modification = build_modification(v1, v2, source, user, org_unit_change_request_id)
+    modification.save()
+    return modification
+
+
+def log_modifications_in_bulk(
+    modifications: Iterable[tuple[Optional[AnyModelInstance], Optional[AnyModelInstance]]],
+    source: Optional[str],
+    user: User = None,
+    batch_size: int = 1000,
+    **options,
+) -> int:
+    """
+    Same as `log_modification` for many `(v1, v2)` pairs, the `Modification` are inserted `batch_size` at a time.
+    The `options` (`diff_only`, `simplify_geometries`) are the ones of `ModificationWriter`.
+
+    Returns the number of `Modification` created.
+    """
+    writer = ModificationWriter(source, user=user, batch_size=batch_size, **options)
+    for v1, v2 in modifications:
+        writer.add(v1, v2)
+    writer.flush()
+    return writer.count
+
+
+def build_modification(
+    v1: Optional[Union[AnyModelInstance, list[dict[str, Any]]]],
+    v2: Optional[AnyModelInstance],
+    source: Optional[str],
+    user: User = None,
+    org_unit_change_request_id: int = None,
+) -> Modification:
+    """Build the `Modification` of `log_modification`, without saving it."""
     modification = Modification()
     modification.past_value = []
     modification.new_value = []
@@ -231,5 +268,84 @@ def log_modification(
         if not any([added, removed]) and len(modified.keys()) == 1 and "updated_at" in modified:
             logger.warning("log_modification() called with only `updated_at`.", extra={"modification": modification})
 
-    modification.save()
     return modification
+
+
+class ModificationWriter:
+    """
+    Buffers the `Modification` of a bulk operation and inserts them with `bulk_create`, `batch_size` at a time.
+
+    To keep the `Modification` table small:
+    - with `diff_only`, the past and new values of a change only keep the fields which changed, instead of two full
+      snapshots of the instance. `field_diffs()` and the history endpoints are unchanged.
+    - with `simplify_geometries`, the polygons are stored simplified (see `simplify_geom`), the history can still
+      display them on a map.
+
+    Use it as a context manager, the remaining `Modification` are inserted at the end of the block:
+
+        with ModificationWriter(GPKG_IMPORT, user=user, diff_only=True) as writer:
+            for original, org_unit in changes:
+                writer.add(original, org_unit)
+    """
+
+    def __init__(
+        self,
+        source: Optional[str],
+        user: User = None,
+        batch_size: int = 1000,
+        diff_only: bool = False,
+        simplify_geometries: bool = False,
+    ):
+        self.source = source
+        self.user = user
+        self.batch_size = batch_size
+        self.diff_only = diff_only
+        self.simplify_geometries = simplify_geometries
+        self.count = 0
+        self._buffer: list[Modification] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(
+        self,
+        # `v1` should be either a deepcopy or a serialized instance, see `log_modification`.
+        v1: Optional[Union[AnyModelInstance, list[dict[str, Any]]]],
+        v2: Optional[AnyModelInstance],
+        org_unit_change_request_id: int = None,
+    ) -> Modification:
+        modification = build_modification(v1, v2, self.source, self.user, org_unit_change_request_id)
+        if self.diff_only and modification.past_value and modification.new_value:
+            diffs = modification.field_diffs()
+            changed_fields = diffs["added"].keys() | diffs["removed"].keys() | diffs["modified"].keys()
+            for value in modification.past_value + modification.new_value:
+                value["fields"] = {name: field for name, field in value["fields"].items() if name in changed_fields}
+        if self.simplify_geometries:
+            for value in modification.past_value + modification.new_value:
+                simplify_serialized_geometries(value)
+
+        self._buffer.append(modification)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+        return modification
+
+    def flush(self) -> None:
+        if self._buffer:
+            Modification.objects.bulk_create(self._buffer)
+            self.count += len(self._buffer)
+            self._buffer = []
+
+
+def simplify_serialized_geometries(value: dict[str, Any]) -> None:
+    """Replace the polygons of a serialized instance (EWKT strings) by their simplified version."""
+    model = apps.get_model(value["model"])
+    fields = value["fields"]
+    for field in model._meta.concrete_fields:
+        if isinstance(field, GeometryField) and fields.get(field.name):
+            geometry = GEOSGeometry(fields[field.name])
+            if isinstance(geometry, MultiPolygon):
+                fields[field.name] = simplify_geom(geometry).ewkt
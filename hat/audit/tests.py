@@ -4,6 +4,7 @@ import logging
 import time_machine
 
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Polygon
 
 from hat.audit import models as audit_models
 from iaso import models as m
@@ -176,6 +177,56 @@ class AuditMethodsTestCase(TestCase):
         self.assertIn("name", diffs["modified"].keys())
         self.assertIn("updated_at", diffs["modified"].keys())
 
+    def test_log_modifications_in_bulk(self):
+        original_copy = m.OrgUnit.objects.get(pk=self.org_unit.pk)
+        self.org_unit.name = "Foo"
+        self.org_unit.save()
+        new_org_unit = m.OrgUnit.objects.create(org_unit_type=self.org_unit_type, name="New")
+
+        count = audit_models.log_modifications_in_bulk(
+            [(original_copy, self.org_unit), (None, new_org_unit)],
+            source=audit_models.GPKG_IMPORT,
+            user=self.user,
+            batch_size=1,
+        )
+
+        self.assertEqual(count, 2)
+        modification = audit_models.Modification.objects.get(object_id=self.org_unit.pk)
+        self.assertEqual(modification.source, audit_models.GPKG_IMPORT)
+        self.assertEqual(modification.user, self.user)
+        self.assertIn("name", modification.field_diffs()["modified"])
+        modification = audit_models.Modification.objects.get(object_id=new_org_unit.pk)
+        self.assertEqual(modification.past_value, [])
+        self.assertEqual(modification.new_value[0]["fields"]["name"], "New")
+
+    def test_modification_writer(self):
+        polygon = Polygon([(x / 100, (x % 2) / 2000) for x in range(100)] + [(0, 1), (0, 0)])
+        self.org_unit.geom = MultiPolygon(polygon, srid=4326)
+        self.org_unit.save()
+        original_copy = m.OrgUnit.objects.get(pk=self.org_unit.pk)
+        self.org_unit.name = "Foo"
+        self.org_unit.save()
+
+        with audit_models.ModificationWriter(
+            audit_models.ORG_UNIT_API_BULK, user=self.user, batch_size=10, diff_only=True
+        ) as writer:
+            writer.add(original_copy, self.org_unit)
+            self.assertEqual(audit_models.Modification.objects.count(), 0)
+        self.assertEqual(writer.count, 1)
+
+        modification = audit_models.Modification.objects.get()
+        self.assertEqual(modification.past_value[0]["fields"].keys(), {"name", "updated_at"})
+        self.assertEqual(modification.new_value[0]["fields"]["name"], "Foo")
+        self.assertEqual(modification.field_diffs()["modified"].keys(), {"name", "updated_at"})
+
+        writer = audit_models.ModificationWriter(audit_models.GPKG_IMPORT, simplify_geometries=True)
+        modification = writer.add(None, self.org_unit)
+        writer.flush()
+        geom = GEOSGeometry(modification.new_value[0]["fields"]["geom"])
+        self.assertEqual(geom.geom_type, "MultiPolygon")
+        self.assertLess(geom.num_coords, self.org_unit.geom.num_coords)
+        self.assertEqual(modification.new_value[0]["fields"]["name"], "Foo")
+
     def test_log_modification_for_m2m_field_with_original_as_serialized_copy(self):
         """
         Test that calling `log_modification()` when there are foreign keys
@@ -147,6 +147,16 @@ CACHE_LOCATION = env.str("CACHE_LOCATION", default="django_cache_table")
 CACHE_MAX_ENTRIES = env.int("CACHE_MAX_ENTRIES", default=300)
 ENABLE_ANALYTICS = env.bool("ENABLE_ANALYTICS", default=False)
 
+# DuckDB settings for the parquet exports of org units and submissions
+PARQUET_EXPORT_MEMORY_LIMIT = env.str("PARQUET_EXPORT_MEMORY_LIMIT", default="1500MB")
+PARQUET_EXPORT_THREADS = env.int("PARQUET_EXPORT_THREADS", default=0)  # 0: let DuckDB use all the cores
+PARQUET_EXPORT_ROW_GROUP_SIZE = env.int("PARQUET_EXPORT_ROW_GROUP_SIZE", default=10000)
+PARQUET_EXPORT_TEMP_DIRECTORY = env.str("PARQUET_EXPORT_TEMP_DIRECTORY", default="/tmp/duckdb_tmp")
+
+# Serve the full org unit downloads of the mobile app from gzipped snapshots rebuilt in the background when the
+# pyramid changes, see `OrgUnitPyramidSnapshot`
+MOBILE_ORG_UNITS_SNAPSHOTS = env.bool("MOBILE_ORG_UNITS_SNAPSHOTS", default=False)
+
 ALLOWED_HOSTS = ["*"]
 
 # Tell django to view requests as secure(ssl) that have this header set
@@ -782,6 +792,30 @@ elif BACKGROUND_BACKEND == "SQS":
 else:
     raise Exception("BACKGROUND_TASK_SERVICE needs to one of: POSTGRES, SQS")
 
+# Postgres task workers (see `tasks_worker`), both in the form "task_name=value,other_task_name=value".
+# Maximum number of tasks with a given name running at the same time, across all the workers.
+TASK_WORKER_CONCURRENCY_LIMITS = env.dict("TASK_WORKER_CONCURRENCY_LIMITS", subcast_values=int, default={})
+# Running tasks which haven't started or reported any progress (see `TaskLog`) for this number of seconds are
+# considered abandoned by a crashed worker: they don't count against the concurrency limits anymore.
+TASK_WORKER_STALE_RUNNING_TIMEOUT = env.int("TASK_WORKER_STALE_RUNNING_TIMEOUT", default=6 * 60 * 60)
+# Tasks with a higher priority are run first, the default priority is 0.
+TASK_WORKER_PRIORITIES = env.dict("TASK_WORKER_PRIORITIES", subcast_values=int, default={})
+# Minimum number of seconds between two writes of the progress of a running task. Progress reported in between is
+# only kept in memory until the next write.
+TASK_PROGRESS_MIN_INTERVAL = env.float("TASK_PROGRESS_MIN_INTERVAL", default=0 if IN_TESTS else 2.0)
+
+# Number of pages of submissions sent concurrently to DHIS2 by the submission exporter.
+# With more than 1, the DHIS2 calls run in worker threads, each with its own database connection.
+DHIS2_EXPORT_MAX_WORKERS = env.int("DHIS2_EXPORT_MAX_WORKERS", default=1)
+
+# Number of resources fetched at the same time by the export of the mobile app setup, each in a worker thread with its
+# own database connection. 1 fetches them one after the other without threads.
+MOBILE_APP_EXPORT_MAX_WORKERS = env.int("MOBILE_APP_EXPORT_MAX_WORKERS", default=4)
+
+# Number of chunks of entities processed at the same time by the WFP ETL, each in a worker thread with its own database
+# connection. 1 processes them one after the other without threads.
+WFP_ETL_MAX_WORKERS = env.int("WFP_ETL_MAX_WORKERS", default=1)
+
 DISABLE_SSL_REDIRECT = env.bool("DISABLE_SSL_REDIRECT", default=False)
 SSL_ON = not (DEBUG or BEANSTALK_WORKER or DISABLE_SSL_REDIRECT)
 if SSL_ON:
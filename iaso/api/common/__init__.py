@@ -4,7 +4,7 @@ from .exceptions import Custom403Exception
 from .filter_backends import DeletionFilterBackend
 from .filters import CharInFilter, NumberInFilter
 from .mixin import CSVExportMixin
-from .pagination import EtlPaginator, Paginator
+from .pagination import EtlPaginator, KeysetCursorPagination, Paginator
 from .permissions import GenericReadWritePerm, HasPermission, IsAdminOrSuperUser, ReadOnlyOrHasPermission
 from .serializer import (
     DropdownOptionsSerializer,
@@ -32,6 +32,7 @@ __all__ = [
     "EXPORTS_DATETIME_FORMAT",
     "EtlModelViewset",
     "EtlPaginator",
+    "KeysetCursorPagination",
     "FileFormatEnum",
     "GenericReadWritePerm",
     "HasPermission",
@@ -33,7 +33,14 @@ def create_entity_duplicates(task: Task, potential_duplicates: List[PotentialDup
         if not batch:
             break
         task.report_progress_and_stop_if_killed(progress_message=f"Bulk creating {batch_size} entity duplicates")
-        EntityDuplicate.objects.bulk_create(batch, batch_size, ignore_conflicts=True)
+        # the pairs found by a previous run keep their analyze and validation status, only their score is updated
+        EntityDuplicate.objects.bulk_create(
+            batch,
+            batch_size,
+            update_conflicts=True,
+            unique_fields=["entity1", "entity2"],
+            update_fields=["similarity_score", "updated_at"],
+        )
 
     eda.finished_at = now()
     eda.save()
@@ -12,11 +12,46 @@ from .finalize import create_entity_duplicates
 LEVENSHTEIN_MAX_DISTANCE = 3
 ABOVE_SCORE_DISPLAY = 50
 
+# Candidate generation, see `_create_blocking_keys`
+BLOCKING_KEYS_TABLE = "deduplication_blocking_keys"
+BLOCKING_MAX_BLOCK_SIZE = 1000
+BLOCKING_BATCH_SIZE = 5000
+NUMBER_REGEX = r"^-?[0-9]+(\.[0-9]+)?$"
+NUMBER_BAND_RATIO = 1.2
+
 # We need to make sure the extension is loaded in the database
 # CREATE EXTENSION fuzzystrmatch;
 
 
-def _build_query(params, start_id, end_id):
+def _calculate_cast_type(f_name):
+    """Type of a `calculate` field, from the suffix of its name (None when it's compared as text)"""
+    if f_name.endswith(("__int__", "__integer__")):
+        return "integer"
+    if f_name.endswith("__long__"):
+        return "bigint"
+    if f_name.endswith(("__decimal__", "__double__")):
+        return "double precision"
+    if f_name.endswith(("__bool__", "__boolean__")):
+        return "boolean"
+    if f_name.endswith("__date__"):
+        return "date"
+    if f_name.endswith("__time__"):
+        return "time"
+    if f_name.endswith(("__date_time__", "__datetime__")):
+        return "timestamp"
+    return None
+
+
+def _build_query(params, start_id, end_id, blocking=False, changed_ids=None):
+    """Query scoring the pairs of entities with an id between `start_id` and `end_id` and any lower id.
+
+    With `blocking`, only the pairs sharing a key in the blocking keys table (see `_create_blocking_keys`) are scored
+    instead of all the pairs.
+
+    With `changed_ids` (incremental runs), the pairs of these entities with any other entity are scored instead of the
+    id range. A pair of two changed entities can then be returned by two batches. The pairs already found by a previous
+    run are scored again, and returned even below the threshold, so their scores can be updated.
+    """
     reference_form_fields = params.get("fields", [])
 
     custom_params = params.get("parameters", {})
@@ -56,21 +91,8 @@ def _build_query(params, start_id, end_id):
 
         elif f_type == "calculate":
             # Handle type casting based on field name suffix
-            if f_name.endswith(("__int__", "__integer__")):
-                cast_type = "integer"
-            elif f_name.endswith("__long__"):
-                cast_type = "bigint"
-            elif f_name.endswith(("__decimal__", "__double__")):
-                cast_type = "double precision"
-            elif f_name.endswith(("__bool__", "__boolean__")):
-                cast_type = "boolean"
-            elif f_name.endswith("__date__"):
-                cast_type = "date"
-            elif f_name.endswith("__time__"):
-                cast_type = "time"
-            elif f_name.endswith(("__date_time__", "__datetime__")):
-                cast_type = "timestamp"
-            else:
+            cast_type = _calculate_cast_type(f_name)
+            if cast_type is None:
                 # Default to text comparison if no type suffix is found.
                 # Returns NULL when either field is empty/NULL instead of calculating Levenshtein distance.
                 fc_arr.append(
@@ -146,12 +168,42 @@ def _build_query(params, start_id, end_id):
                 query_params.extend([f_name, f_name, f_name, f_name])
 
     fields_comparison = ", ".join(fc_arr)
-    query_params = [params.get("entity_type_id"), start_id, end_id] + query_params + [above_score_display]
 
-    return (
-        query_params,
-        f"""
-    WITH filtered_entities AS (
+    if changed_ids is not None and blocking:
+        pairs_params = [list(changed_ids)]
+        candidate_pairs = f"""
+    candidate_pairs AS (
+        SELECT DISTINCT
+            GREATEST(key1.entity_id, key2.entity_id) AS entity_id1,
+            LEAST(key1.entity_id, key2.entity_id) AS entity_id2
+        FROM {BLOCKING_KEYS_TABLE} AS key1
+        JOIN {BLOCKING_KEYS_TABLE} AS key2 ON key1.key = key2.key AND key1.entity_id != key2.entity_id
+        WHERE key1.entity_id = ANY(%s)
+    ),"""
+    elif changed_ids is not None:
+        pairs_params = [list(changed_ids), params.get("entity_type_id")]
+        candidate_pairs = """
+    candidate_pairs AS (
+        SELECT DISTINCT
+            GREATEST(changed.id, other.id) AS entity_id1,
+            LEAST(changed.id, other.id) AS entity_id2
+        FROM unnest(%s::integer[]) AS changed(id)
+        JOIN iaso_entity AS other
+            ON other.entity_type_id = %s AND other.deleted_at IS NULL AND other.id != changed.id
+    ),"""
+    elif blocking:
+        pairs_params = [start_id, end_id]
+        candidate_pairs = f"""
+    candidate_pairs AS (
+        SELECT DISTINCT key1.entity_id AS entity_id1, key2.entity_id AS entity_id2
+        FROM {BLOCKING_KEYS_TABLE} AS key1
+        JOIN {BLOCKING_KEYS_TABLE} AS key2 ON key1.key = key2.key AND key1.entity_id > key2.entity_id
+        WHERE key1.entity_id BETWEEN %s AND %s
+    ),"""
+    else:
+        pairs_params = [params.get("entity_type_id"), start_id, end_id]
+        candidate_pairs = """
+    filtered_entities AS (
         SELECT id, attributes_id
         FROM iaso_entity
         WHERE entity_type_id = %s AND deleted_at IS NULL
@@ -161,7 +213,35 @@ def _build_query(params, start_id, end_id):
         SELECT id, attributes_id
         FROM filtered_entities
         WHERE id BETWEEN %s AND %s
-    ),
+    ),"""
+
+    if blocking or changed_ids is not None:
+        pairs_source = """candidate_pairs
+        JOIN iaso_entity AS entity1 ON entity1.id = candidate_pairs.entity_id1
+        JOIN iaso_entity AS entity2 ON entity2.id = candidate_pairs.entity_id2"""
+    else:
+        pairs_source = """entity1_batch AS entity1
+        JOIN filtered_entities AS entity2 ON entity1.id > entity2.id"""
+
+    existing_pair = """EXISTS (
+            SELECT 1
+            FROM iaso_entityduplicate AS d
+            WHERE d.entity1_id = entity1.id
+              AND d.entity2_id = entity2.id
+        )"""
+    if changed_ids is not None:
+        existing_column = existing_pair
+        pairs_filter = ""
+    else:
+        existing_column = "FALSE"
+        pairs_filter = f"WHERE NOT {existing_pair}"
+
+    query_params = pairs_params + query_params + [above_score_display]
+
+    return (
+        query_params,
+        f"""
+    WITH {candidate_pairs}
     entity_pairs AS (
         SELECT
             entity1.id AS entity_id1,
@@ -170,17 +250,12 @@ def _build_query(params, start_id, end_id):
                 SELECT AVG(field_score) * 100  -- AVG() automatically ignores NULL values.
                 FROM (VALUES {fields_comparison}) AS t(field_score) 
                 WHERE field_score IS NOT NULL
-            ) AS raw_score
-        FROM entity1_batch AS entity1
-        JOIN filtered_entities AS entity2 ON entity1.id > entity2.id
+            ) AS raw_score,
+            {existing_column} AS existing
+        FROM {pairs_source}
         JOIN iaso_instance AS instance1 ON entity1.attributes_id = instance1.id
         JOIN iaso_instance AS instance2 ON entity2.attributes_id = instance2.id
-        WHERE NOT EXISTS (
-            SELECT 1
-            FROM iaso_entityduplicate AS d
-            WHERE d.entity1_id = entity1.id
-              AND d.entity2_id = entity2.id
-        )
+        {pairs_filter}
     ),
     scored_pairs AS (
         SELECT
@@ -191,29 +266,163 @@ def _build_query(params, start_id, end_id):
                     LEAST(COALESCE(raw_score, 0), 100),
                     0
                 ) AS SMALLINT
-            ) AS score
+            ) AS score,
+            existing
         FROM entity_pairs
     )
-    SELECT *
+    SELECT entity_id1, entity_id2, score
     FROM scored_pairs
-    WHERE score > %s;
+    WHERE score > %s OR existing;
     """,
     )
 
 
+def _blocking_key_expressions(reference_form_fields):
+    """SQL expressions (and their params) of the blocking keys of an entity, evaluated on `entity.json`.
+
+    Two entities are only compared when they share at least one key:
+    - text fields: double metaphone codes, and the first and last 3 letters to catch typos changing the sound
+    - number fields: logarithmic bands, two shifted grids so close values always share a band
+    - date fields: two years bands (birth-year bands), shifted the same way
+    Booleans and times are too unselective to be keys. A NULL key is ignored.
+    """
+    expressions = []
+    expressions_params = []
+    for index, field in enumerate(reference_form_fields):
+        f_name = field.get("name")
+        f_type = field.get("type")
+        cast_type = _calculate_cast_type(f_name) if f_type == "calculate" else None
+        prefix = f"{index}:"
+
+        if f_type in ["number", "integer", "decimal"] or cast_type in ["integer", "bigint", "double precision"]:
+            number = f"(CASE WHEN (entity.json->>%s) ~ '{NUMBER_REGEX}' THEN ln(abs((entity.json->>%s)::double precision) + 1) / ln({NUMBER_BAND_RATIO}) END)"
+            for shift in ["0", "0.5"]:
+                expressions.append(f"'{prefix}n{shift}:' || floor({number} + {shift})::bigint")
+                expressions_params.extend([f_name, f_name])
+
+        elif cast_type in ["date", "timestamp"]:
+            year = "substring(entity.json->>%s from '^([0-9]{4})-')::integer"
+            for shift in [0, 1]:
+                expressions.append(f"'{prefix}y{shift}:' || (({year} + {shift}) / 2)")
+                expressions_params.append(f_name)
+
+        elif f_type == "text" or f_type is None or (f_type == "calculate" and cast_type is None):
+            text = "lower(btrim(entity.json->>%s))"
+            for code, expression in [
+                ("m", f"dmetaphone({text})"),
+                ("a", f"dmetaphone_alt({text})"),
+                ("p", f"left({text}, 3)"),
+                ("s", f"right({text}, 3)"),
+            ]:
+                expressions.append(f"'{prefix}{code}:' || NULLIF({expression}, '')")
+                expressions_params.append(f_name)
+
+    return expressions, expressions_params
+
+
+def _find_changed_entities(cursor, entity_type_id, changed_since):
+    """Ids of the entities of the type created, or whose reference instance changed, after `changed_since`"""
+    cursor.execute(
+        """
+        SELECT e.id
+        FROM iaso_entity AS e
+        LEFT JOIN iaso_instance AS i ON i.id = e.attributes_id
+        WHERE e.entity_type_id = %s AND e.deleted_at IS NULL AND (e.updated_at > %s OR i.updated_at > %s)
+        ORDER BY e.id
+        """,
+        [entity_type_id, changed_since, changed_since],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _create_blocking_keys(cursor, params):
+    """Compute the blocking keys of the entities of the type in a temporary table, indexed for the candidate pairs.
+
+    Keys shared by more than `blocking_max_block_size` entities are dropped as they would bring back a quadratic
+    number of pairs, keys of a single entity are dropped as they bring no pair at all. With `blocking_org_unit_depth`,
+    entities are only compared when their org units have the same ancestor at that depth.
+
+    :return: the number of keys kept
+    """
+    custom_params = params.get("parameters", {})
+    max_block_size = int(custom_params.get("blocking_max_block_size", BLOCKING_MAX_BLOCK_SIZE))
+    org_unit_depth = custom_params.get("blocking_org_unit_depth")
+
+    expressions, expressions_params = _blocking_key_expressions(params.get("fields", []))
+    if not expressions:
+        expressions, expressions_params = ["'*'"], []
+
+    if org_unit_depth:
+        ancestor = (
+            "COALESCE(CASE WHEN nlevel(ou.path) > 0 THEN subpath(ou.path, 0, LEAST(%s, nlevel(ou.path)))::text END, '')"
+        )
+        ancestor_params = [int(org_unit_depth)]
+    else:
+        ancestor = "''"
+        ancestor_params = []
+
+    keys_values = ", ".join(f"({expression})" for expression in expressions)
+    cursor.execute(f"DROP TABLE IF EXISTS {BLOCKING_KEYS_TABLE}")
+    cursor.execute(
+        f"""
+        CREATE TEMPORARY TABLE {BLOCKING_KEYS_TABLE} AS
+        SELECT DISTINCT entity.id AS entity_id, entity.ancestor || '|' || keys.key AS key
+        FROM (
+            SELECT e.id, i.json, {ancestor} AS ancestor
+            FROM iaso_entity AS e
+            JOIN iaso_instance AS i ON i.id = e.attributes_id
+            LEFT JOIN iaso_orgunit AS ou ON ou.id = i.org_unit_id
+            WHERE e.entity_type_id = %s AND e.deleted_at IS NULL
+        ) AS entity
+        CROSS JOIN LATERAL (VALUES {keys_values}) AS keys(key)
+        WHERE keys.key IS NOT NULL
+        """,
+        ancestor_params + [params.get("entity_type_id")] + expressions_params,
+    )
+    cursor.execute(
+        f"""
+        DELETE FROM {BLOCKING_KEYS_TABLE}
+        WHERE key IN (
+            SELECT key FROM {BLOCKING_KEYS_TABLE} GROUP BY key HAVING COUNT(*) = 1 OR COUNT(*) > %s
+        )
+        """,
+        [max_block_size],
+    )
+    cursor.execute(f"CREATE INDEX ON {BLOCKING_KEYS_TABLE} (key, entity_id)")
+    cursor.execute(f"CREATE INDEX ON {BLOCKING_KEYS_TABLE} (entity_id)")
+    cursor.execute(f"ANALYZE {BLOCKING_KEYS_TABLE}")
+    cursor.execute(f"SELECT COUNT(*) FROM {BLOCKING_KEYS_TABLE}")
+    return cursor.fetchone()[0]
+
+
 class LevenshteinAlgorithm(DeduplicationAlgorithm):
     """
     This algorithm has the following custom parameters:
     levenshtein_max_distance: the maximum distance for the levenshtein algorithm (defaults to LEVENSHTEIN_MAX_DISTANCE)
     above_score_display: the minimum score to display (defaults to ABOVE_SCORE_DISPLAY)
+    blocking: only score the pairs of entities sharing a blocking key instead of all the pairs (defaults to False),
+        see `_create_blocking_keys`
+    blocking_max_block_size: with blocking, ignore the keys shared by more entities (defaults to BLOCKING_MAX_BLOCK_SIZE)
+    blocking_org_unit_depth: with blocking, only compare entities with the same org unit ancestor at this depth
+
+    When `params` has a `changed_since` datetime (incremental runs, see `run_deduplication_algo`), only the pairs with
+    an entity created or changed since then are scored, including the pairs found by previous runs.
     """
 
     def run(self, params: dict, task: Task) -> List[PotentialDuplicate]:
+        potential_duplicates = self.find_potential_duplicates(params, task)
+
+        create_entity_duplicates(task, potential_duplicates)
+
+        return potential_duplicates
+
+    def find_potential_duplicates(self, params: dict, task: Task) -> List[PotentialDuplicate]:
         task.report_progress_and_stop_if_killed(progress_message="Started Levenshtein Algorithm")
 
+        blocking = bool(params.get("parameters", {}).get("blocking", False))
         cursor = connection.cursor()
         potential_duplicates = []
-        batch_size = 100
+        batch_size = BLOCKING_BATCH_SIZE if blocking else 100
 
         try:
             cursor.execute(
@@ -231,14 +440,38 @@ class LevenshteinAlgorithm(DeduplicationAlgorithm):
                 task.report_progress_and_stop_if_killed(progress_message="No entities found")
                 return potential_duplicates
 
-            batch_num = 0
-            current_id = min_id
-
-            while current_id <= max_id:
-                batch_num += 1
-                batch_end_id = min(current_id + batch_size - 1, max_id)
-
-                the_params, the_query = _build_query(params, current_id, batch_end_id)
+            changed_since = params.get("changed_since")
+            changed_ids = None
+            if changed_since:
+                changed_ids = _find_changed_entities(cursor, params.get("entity_type_id"), changed_since)
+                task.report_progress_and_stop_if_killed(
+                    progress_message=f"Incremental run: {len(changed_ids)} entities created or changed since "
+                    f"{changed_since.isoformat()}"
+                )
+                if not changed_ids:
+                    return potential_duplicates
+
+            if blocking:
+                keys_count = _create_blocking_keys(cursor, params)
+                task.report_progress_and_stop_if_killed(progress_message=f"Computed {keys_count} blocking keys")
+
+            if changed_ids is not None:
+                batches = [
+                    (batch[0], batch[-1], batch)
+                    for batch in (changed_ids[i : i + batch_size] for i in range(0, len(changed_ids), batch_size))
+                ]
+            else:
+                batches = [
+                    (current_id, min(current_id + batch_size - 1, max_id), None)
+                    for current_id in range(min_id, max_id + 1, batch_size)
+                ]
+            # in incremental runs, a pair of two changed entities is found from both sides
+            found_pairs = set()
+
+            for batch_num, (current_id, batch_end_id, batch_ids) in enumerate(batches, 1):
+                the_params, the_query = _build_query(
+                    params, current_id, batch_end_id, blocking=blocking, changed_ids=batch_ids
+                )
 
                 msg = (
                     f"Total entities: {total_entities}\n"
@@ -254,15 +487,16 @@ class LevenshteinAlgorithm(DeduplicationAlgorithm):
                 cursor.execute(the_query, the_params)
 
                 for record in cursor.fetchall():
-                    potential_duplicates.append(PotentialDuplicate(record[0], record[1], record[2]))
+                    if (record[0], record[1]) not in found_pairs:
+                        found_pairs.add((record[0], record[1]))
+                        potential_duplicates.append(PotentialDuplicate(record[0], record[1], record[2]))
 
-                current_id = batch_end_id + 1  # Move to the next batch.
+            if blocking:
+                cursor.execute(f"DROP TABLE IF EXISTS {BLOCKING_KEYS_TABLE}")
 
         finally:
             cursor.close()
 
         task.report_progress_and_stop_if_killed(progress_message="Ended Levenshtein Algorithm")
 
-        create_entity_duplicates(task, potential_duplicates)
-
         return potential_duplicates
@@ -24,7 +24,7 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from typing_extensions import Annotated, TypedDict
 
-from hat.api.export_utils import Echo, generate_xlsx, iter_items, timestamp_to_utc_datetime
+from hat.api.export_utils import Echo, generate_xlsx_file, iter_items, timestamp_to_utc_datetime
 from hat.audit.models import INSTANCE_API, Modification, log_modification
 from hat.common.utils import queryset_iterator
 from iaso.api import common
@@ -74,6 +74,9 @@ from iaso.utils.models.common import check_instance_bulk_gps_push, check_instanc
 
 logger = logging.getLogger(__name__)
 
+# `partition_by` values accepted by the parquet export and the matching column of the export
+PARQUET_PARTITION_COLUMNS = {"org_unit": "iaso_subm_org_unit_id", "period": "iaso_subm_period"}
+
 
 class LockAnnotation(TypedDict):
     count_lock_applying_to_user: int
@@ -391,8 +394,8 @@ class InstancesViewSet(viewsets.ViewSet):
 
         if file_format == FileFormatEnum.XLSX:
             filename = filename + ".xlsx"
-            response = HttpResponse(
-                generate_xlsx("Forms", columns, queryset_iterator(queryset, 100), get_row, sub_columns),
+            response = CleaningFileResponse(
+                generate_xlsx_file("Forms", columns, queryset_iterator(queryset, 100), get_row, sub_columns),
                 content_type=CONTENT_TYPE_XLSX,
             )
         elif file_format == FileFormatEnum.CSV:
@@ -537,6 +540,7 @@ class InstancesViewSet(viewsets.ViewSet):
             "planningIds",
             "userIds",
             "referenceInstances",
+            "partition_by",  # org_unit, period: one parquet file per value, returned in a zip file
         }
         received_params = set(request.GET.keys())
 
@@ -549,11 +553,27 @@ class InstancesViewSet(viewsets.ViewSet):
                 status=status.HTTP_409_CONFLICT,
             )
 
+        partition_by = request.GET.get("partition_by", None)
+        if partition_by and partition_by not in PARQUET_PARTITION_COLUMNS:
+            return JsonResponse(
+                {
+                    "error": f"Unknown partition_by for parquet exports: {partition_by}, only supported {', '.join(PARQUET_PARTITION_COLUMNS)}."
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
         # actually return parquet file
         form_ids = filters["form_ids"]
         form = Form.objects.get(pk=form_ids)
         export_queryset, mapping = parquet.build_submissions_queryset(queryset, form.id)
 
+        if partition_by:
+            tmp = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+            parquet.export_django_query_to_partitioned_parquet_zip(
+                export_queryset, tmp.name, [PARQUET_PARTITION_COLUMNS[partition_by]], mapping
+            )
+            return CleaningFileResponse(tmp.name, as_attachment=True, filename="submissions.zip")
+
         tmp = tempfile.NamedTemporaryFile(suffix=".parquet", delete=False)
 
         parquet.export_django_query_to_parquet_via_duckdb(export_queryset, tmp.name, mapping)
@@ -8,8 +8,15 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
 from iaso.api.common.serializer_fields import JSONSchemaField
-from iaso.api.metrics.utils import REQUIRED_METRIC_VALUES_HEADERS, get_missing_headers, get_org_unit_row
-from iaso.models import MetricType, MetricValue
+from iaso.api.metrics.utils import (
+    REQUIRED_METRIC_VALUES_HEADERS,
+    get_missing_headers,
+    get_org_unit_row,
+    melt_metric_values,
+    upsert_metric_values,
+)
+from iaso.models import MetricType, MetricValue, MetricValueAggregate
+from iaso.models.metric import refresh_metric_value_aggregates
 from iaso.models.org_unit import OrgUnit
 from iaso.utils.org_units import get_valid_org_units_with_geography
 
@@ -136,6 +143,24 @@ class MetricValueSerializer(serializers.ModelSerializer):
             self.fields["org_unit"].queryset = get_valid_org_units_with_geography(account)
 
 
+class MetricValueAggregateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MetricValueAggregate
+        fields = [
+            "id",
+            "metric_type",
+            "org_unit",
+            "level",
+            "year",
+            "values_count",
+            "value_sum",
+            "value_avg",
+            "value_min",
+            "value_max",
+        ]
+        read_only_fields = fields
+
+
 class ImportMetricValuesSerializer(serializers.Serializer):
     file = serializers.FileField(required=True)
     year = serializers.IntegerField(required=False, allow_null=True)
@@ -205,33 +230,15 @@ class ImportMetricValuesSerializer(serializers.Serializer):
         df = self.context["metric_values_df"]
         existing_metric_types_map = self.context["existing_metric_types_map"]
         year = self.validated_data.get("year", None)
-        metric_values = []
-        for index, row in df.iterrows():
-            org_unit_id = row["ADM2_ID"]
-            for code in existing_metric_types_map.keys():
-                value = row.get(code)
-                if pd.isna(value):
-                    continue
-                mv = MetricValue(org_unit_id=org_unit_id, metric_type_id=existing_metric_types_map[code])
-                try:
-                    # Parse the value as a float
-                    mv.value = float(value)
-                except ValueError:
-                    mv.value = None
-                    mv.string_value = value
-
-                mv.year = year
-                metric_values.append(mv)
+        values = melt_metric_values(df, existing_metric_types_map)
 
         with transaction.atomic():
-            # Clear existing metric values to avoid duplicates
-            metric_type_ids = set(mv.metric_type_id for mv in metric_values)
-            org_unit_ids = set(mv.org_unit_id for mv in metric_values)
-            MetricValue.objects.filter(
-                Q(metric_type_id__in=metric_type_ids, org_unit_id__in=org_unit_ids), Q(year=year) | Q(year__isnull=True)
-            ).delete()
-
-            return MetricValue.objects.bulk_create(metric_values)
+            metric_values = upsert_metric_values(values, year)
+            # the values without year of these metric types and org units may have been deleted
+            refresh_metric_value_aggregates(
+                values["metric_type_id"].unique().tolist(), {year, None}, values["org_unit_id"].unique().tolist()
+            )
+            return metric_values
 
 
 class ExportMetricValuesSerializer(serializers.Serializer):
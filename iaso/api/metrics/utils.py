@@ -1,5 +1,18 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from django.db import connection
+
+from iaso.models import MetricValue
+
+
 REQUIRED_METRIC_VALUES_HEADERS = ["ADM1_NAME", "ADM2_NAME", "ADM2_ID"]
 
+METRIC_VALUES_STAGING_TABLE = "iaso_metricvalue_import"
+METRIC_VALUE_FIELDS = ["id", "metric_type_id", "org_unit_id", "year", "value", "string_value"]
+
 
 def get_missing_headers(df, expected_headers):
     file_headers = df.columns.values.tolist()
@@ -9,3 +22,81 @@ def get_missing_headers(df, expected_headers):
 def get_org_unit_row(org_unit):
     """Returns the ADM1_NAME/ADM2_NAME/ADM2_ID columns shared by the CSV template and export."""
     return [org_unit.parent.name if org_unit.parent else "", org_unit.name, org_unit.id]
+
+
+def melt_metric_values(df, metric_type_ids_by_code):
+    """Reshape the imported CSV to one row per org unit and metric type, in the order of the file.
+
+    The values are parsed column by column: a value which isn't a number is kept as `string_value`. Empty cells are
+    dropped and, for a same org unit and metric type, the last row of the file wins.
+    """
+    codes = list(metric_type_ids_by_code)
+    raw_values = df[codes]
+    numeric_values = raw_values.apply(pd.to_numeric, errors="coerce")
+    string_values = raw_values.where(numeric_values.isna() & raw_values.notna()).astype(object)
+
+    rows_count, codes_count = raw_values.shape
+    values = pd.DataFrame(
+        {
+            "line": np.arange(rows_count * codes_count),
+            "org_unit_id": np.repeat(df["ADM2_ID"].to_numpy().astype(int), codes_count),
+            "metric_type_id": np.tile([metric_type_ids_by_code[code] for code in codes], rows_count),
+            "value": numeric_values.to_numpy(dtype=float).ravel(),
+            "string_value": string_values.to_numpy().ravel(),
+        }
+    )
+    values = values[raw_values.notna().to_numpy().ravel()]
+    return values.drop_duplicates(["org_unit_id", "metric_type_id"], keep="last")
+
+
+def upsert_metric_values(values, year):
+    """Load the values of `melt_metric_values` with `COPY` in a staging table, then upsert them in `MetricValue`.
+
+    As before, the values of the same metric types and org units without a year are replaced, and so are the ones of
+    `year`. Must be called in a transaction. Returns the saved `MetricValue`, in the order of `values`.
+    """
+    table = MetricValue._meta.db_table
+    csv_values = io.StringIO()
+    values.to_csv(csv_values, index=False, header=False)
+    csv_values.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {METRIC_VALUES_STAGING_TABLE} "
+            "(line integer, org_unit_id integer, metric_type_id integer, value double precision, string_value text)"
+        )
+        cursor.copy_expert(
+            f"COPY {METRIC_VALUES_STAGING_TABLE} (line, org_unit_id, metric_type_id, value, string_value) "
+            "FROM STDIN WITH (FORMAT csv)",
+            csv_values,
+        )
+        cursor.execute(
+            f"""
+            DELETE FROM {table} mv
+            WHERE mv.metric_type_id IN (SELECT DISTINCT metric_type_id FROM {METRIC_VALUES_STAGING_TABLE})
+            AND mv.org_unit_id IN (SELECT DISTINCT org_unit_id FROM {METRIC_VALUES_STAGING_TABLE})
+            AND (mv.year IS NULL OR mv.year = %(year)s)
+            AND NOT EXISTS (
+                SELECT 1 FROM {METRIC_VALUES_STAGING_TABLE} s
+                WHERE s.metric_type_id = mv.metric_type_id AND s.org_unit_id = mv.org_unit_id AND mv.year = %(year)s
+            )
+            """,
+            {"year": year},
+        )
+        # Like `bulk_create`, rely on the rows being returned in the order they are inserted
+        cursor.execute(
+            f"""
+            INSERT INTO {table} (metric_type_id, org_unit_id, year, value, string_value)
+            SELECT metric_type_id, org_unit_id, %(year)s::integer, value, COALESCE(string_value, '')
+            FROM {METRIC_VALUES_STAGING_TABLE}
+            ORDER BY line
+            ON CONFLICT (metric_type_id, org_unit_id, year)
+            DO UPDATE SET value = EXCLUDED.value, string_value = EXCLUDED.string_value
+            RETURNING {", ".join(METRIC_VALUE_FIELDS)}
+            """,
+            {"year": year},
+        )
+        rows = cursor.fetchall()
+        cursor.execute(f"DROP TABLE {METRIC_VALUES_STAGING_TABLE}")
+
+    return [MetricValue(**dict(zip(METRIC_VALUE_FIELDS, row))) for row in rows]
@@ -14,7 +14,7 @@ from rest_framework.response import Response
 from iaso.api.common import CONTENT_TYPE_CSV, DropdownOptionsWithRepresentationSerializer
 from iaso.api.metrics.filters import ValueAndTypeFilterBackend, ValueFilterBackend
 from iaso.api.metrics.utils import REQUIRED_METRIC_VALUES_HEADERS, get_org_unit_row
-from iaso.models import MetricType, MetricValue
+from iaso.models import MetricType, MetricValue, MetricValueAggregate
 from iaso.plugins import is_snt_malaria_plugin_active
 from iaso.utils.org_units import get_valid_org_units_with_geography
 
@@ -25,6 +25,7 @@ from .serializers import (
     MetricTypeCreateSerializer,
     MetricTypeSerializer,
     MetricTypeWriteSerializer,
+    MetricValueAggregateSerializer,
     MetricValueSerializer,
     OrgUnitIdSerializer,
 )
@@ -156,6 +157,21 @@ class MetricValueViewSet(viewsets.ModelViewSet):
         response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
+    @action(detail=False, methods=["get"], serializer_class=MetricValueAggregateSerializer)
+    def aggregates(self, request):
+        """Precomputed sum/avg/min/max of the values on the descendants of the org units of a level (0 for the roots)"""
+        qs = MetricValueAggregate.objects.filter(metric_type__account=request.user.iaso_profile.account)
+        try:
+            for param in ["metric_type_id", "level", "org_unit_id"]:
+                if request.query_params.get(param) is not None:
+                    qs = qs.filter(**{param: int(request.query_params[param])})
+            if request.query_params.get("reference_year") is not None:
+                qs = qs.filter(Q(year=int(request.query_params["reference_year"])) | Q(year__isnull=True))
+        except ValueError:
+            raise serializers.ValidationError("The filters must be integers")
+        serializer = self.get_serializer(qs.order_by("org_unit_id", "year"), many=True)
+        return Response(serializer.data)
+
     @action(detail=False, methods=["post"], serializer_class=ImportMetricValuesSerializer)
     def import_from_csv(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -4,8 +4,15 @@ from rest_framework import filters, permissions, serializers
 from rest_framework.exceptions import AuthenticationFailed, NotFound, ParseError
 from rest_framework.pagination import PageNumberPagination
 
-from iaso.api.common import DeletionFilterBackend, HasPermission, ModelViewSet, Paginator, TimestampField
-from iaso.api.query_params import LIMIT, PAGE
+from iaso.api.common import (
+    DeletionFilterBackend,
+    HasPermission,
+    KeysetCursorPagination,
+    ModelViewSet,
+    Paginator,
+    TimestampField,
+)
+from iaso.api.query_params import CURSOR, LIMIT, PAGE
 from iaso.api.serializers import AppIdSerializer
 from iaso.models import Entity, EntityType, FormVersion, Instance, Project
 from iaso.models.entity import InvalidJsonContentError, InvalidLimitDateError, ProjectNotFoundError, UserNotAuthError
@@ -131,6 +138,16 @@ class MobileEntitiesSetPagination(Paginator):
         return int(request.query_params.get(self.page_query_param, 1))
 
 
+class MobileEntitiesCursorPagination(KeysetCursorPagination):
+    ordering = ("id",)
+    page_size = 1000
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        # The OrderingFilter of the view has no default ordering, the cursor is always on the ids
+        return self.ordering
+
+
 @extend_schema(tags=["Mobile", "Entities"])
 class MobileEntityViewSet(ModelViewSet):
     f"""Entity API for mobile
@@ -145,16 +162,24 @@ class MobileEntityViewSet(ModelViewSet):
 
     sample usage: /api/mobile/entities/?limit_date=2022-12-29&{LIMIT}=1&{PAGE}=1
 
+    cursor pagination: /api/mobile/entities/?{CURSOR}=null&{LIMIT}=1000 then ?{CURSOR}=<next>&{LIMIT}=1000 while
+    has_next is true, each page is read after the last entity id of the previous one instead of with an offset.
+
     """
 
     results_key = "results"
     include_results_key_if_not_paginated = False
     filter_backends = [filters.OrderingFilter, DjangoFilterBackend, DeletionFilterBackend]
     permission_classes = [permissions.IsAuthenticated, HasPermission(CORE_ENTITIES_PERMISSION)]
-    pagination_class = MobileEntitiesSetPagination
 
     lookup_field = "uuid"
 
+    @property
+    def pagination_class(self):
+        if self.request.query_params.get(CURSOR):
+            return MobileEntitiesCursorPagination
+        return MobileEntitiesSetPagination
+
     def get_serializer_class(self):
         return MobileEntitySerializer
 
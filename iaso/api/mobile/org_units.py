@@ -1,31 +1,47 @@
-from typing import Any, Dict, Optional
+import base64
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+
+from typing import Any, Dict, List, Optional, Tuple
 
 import django_filters
 
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db.models import GeometryField
 from django.contrib.gis.db.models.aggregates import Extent
 from django.contrib.gis.db.models.functions import GeomOutputGeoFunc
 from django.core.cache import cache
+from django.db.models import Count, Max, Q
 from django.db.models.expressions import RawSQL
 from django.db.models.functions import Cast
-from django.http import Http404, HttpResponseNotFound
+from django.http import Http404, HttpResponseNotFound, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
 from drf_spectacular.utils import extend_schema
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.fields import SerializerMethodField
 from rest_framework.response import Response
 
-from iaso.api.common import ModelViewSet, Paginator, TimestampField, safe_api_import
+from hat.audit.models import Modification
+from iaso.api.common import KeysetCursorPagination, ModelViewSet, Paginator, TimestampField, safe_api_import
 from iaso.api.instances.serializers import InstanceFileAttachmentSerializer
 from iaso.api.org_units import import_org_units
 from iaso.api.permission_checks import (
     AuthenticationEnforcedPermission,
     IsAuthenticatedWhenAuthenticationRequired,
 )
-from iaso.api.query_params import APP_ID, IDS, LIMIT, PAGE
+from iaso.api.query_params import APP_ID, CURSOR, IDS, LAST_SYNC, LIMIT, PAGE, SYNC_TOKEN
 from iaso.api.serializers import AppIdSerializer
-from iaso.models import FeatureFlag, Instance, OrgUnit, Project
+from iaso.models import FeatureFlag, Instance, OrgUnit, OrgUnitPyramidSnapshot, Project
+from iaso.models.org_unit_pyramid_snapshot import get_roots_key
 from iaso.permissions.core_permissions import (
     CORE_FORMS_PERMISSION,
     CORE_ORG_UNITS_PERMISSION,
@@ -35,6 +51,116 @@ from iaso.permissions.core_permissions import (
 
 
 SHAPE_RESULTS_MAX = 1000
+# `updated_at` is set when the org unit is saved, not when the transaction is committed: the most recent changes are
+# only returned once older than this, so a change committed late is not skipped by a sync token already given out.
+DELTA_SYNC_LAG = datetime.timedelta(seconds=60)
+
+
+def encode_sync_token(updated_at: datetime.datetime, org_unit_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([updated_at.isoformat(), org_unit_id]).encode()).decode()
+
+
+def decode_sync_token(token: str) -> Tuple[datetime.datetime, int]:
+    try:
+        updated_at, org_unit_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.datetime.fromisoformat(updated_at), int(org_unit_id)
+    except (ValueError, TypeError):
+        raise serializers.ValidationError({SYNC_TOKEN: "Invalid sync token."})
+
+
+PYRAMID_VERSION_KEY_CACHE_TIMEOUT = 60
+# A missing or outdated snapshot is scheduled for build at most once in this delay
+PYRAMID_SNAPSHOT_BUILD_LOCK_TIMEOUT = 60 * 10
+
+
+def get_download_root_ids(user, project: Project) -> List[int]:
+    """Ids of the org units the download of the user is limited to, empty when it is not limited"""
+    if not user or user.is_anonymous or not project.has_feature(FeatureFlag.LIMIT_OU_DOWNLOAD_TO_ROOTS):
+        return []
+    if user.is_superuser:
+        return []
+    return list(user.iaso_profile.org_units.order_by("id").values_list("id", flat=True))
+
+
+def get_project_org_units(project: Project, root_ids: List[int]):
+    org_units = OrgUnit.objects.filter_for_user_and_project(None, project)
+    if root_ids:
+        org_units = org_units.hierarchy(OrgUnit.objects.filter(id__in=root_ids))
+    return org_units
+
+
+def get_removed_from_roots(project: Project, root_ids: List[int], org_unit_ids: List[int], since: datetime.datetime):
+    """Among org units changed since `since` which are not downloadable anymore, the ones a device limited to
+    `root_ids` may have: those still under the roots (e.g. rejected) and those moved out of the roots, with their
+    descendants. The moves are read from the audit log of the org units."""
+    in_roots = set(get_project_org_units(project, root_ids).filter(id__in=org_unit_ids).values_list("id", flat=True))
+    paths = dict(OrgUnit.objects.filter(id__in=set(org_unit_ids) - in_roots).values_list("id", "path"))
+    ancestor_ids = {label for path in paths.values() if path for label in path}
+    root_labels = {str(root_id) for root_id in root_ids}
+    moved_out = set()
+    modifications = Modification.objects.filter(
+        content_type=ContentType.objects.get_for_model(OrgUnit), object_id__in=ancestor_ids, created_at__gt=since
+    ).values_list("object_id", "past_value")
+    for object_id, past_value in modifications:
+        past_path = past_value[0]["fields"].get("path") if past_value else None
+        if past_path and root_labels.intersection(past_path.split(".")):
+            moved_out.add(object_id)
+    return [
+        org_unit_id
+        for org_unit_id in org_unit_ids
+        if org_unit_id in in_roots or moved_out.intersection(paths.get(org_unit_id) or [])
+    ]
+
+
+def get_mobile_org_units_queryset(project: Project, root_ids: List[int], include_geo_json: bool):
+    queryset = (
+        get_project_org_units(project, root_ids)
+        .filter(validation_status=OrgUnit.VALIDATION_VALID)
+        .order_by("path")
+        .prefetch_related("parent__org_unit_type__projects", "groups")
+        .select_related("org_unit_type", "parent", "parent__org_unit_type")
+    )
+    if include_geo_json:
+        queryset = queryset.annotate(
+            geo_json=RawSQL("ST_AsGeoJson(COALESCE(iaso_orgunit.simplified_geom, iaso_orgunit.geom))::json", [])
+        )
+    return queryset
+
+
+def get_pyramid_version_key(project: Project, root_ids: List[int], use_cache: bool = True) -> str:
+    """Changes when an org unit of the download or its type is saved, when the default version of the account or the
+    org unit types of the project change. Group memberships are not taken into account."""
+    cache_key = f"mobile-org-units-version-{project.id}-{get_roots_key(root_ids)}"
+    version_key = cache.get(cache_key) if use_cache else None
+    if version_key is None:
+        stats = get_project_org_units(project, root_ids).aggregate(
+            count=Count("id"), last_update=Max("updated_at"), last_type_update=Max("org_unit_type__updated_at")
+        )
+        unit_type_ids = sorted(project.unit_types.values_list("id", flat=True))
+        state = [project.account.default_version_id, unit_type_ids, stats["count"]]
+        state += [str(stats["last_update"]), str(stats["last_type_update"])]
+        version_key = hashlib.md5(json.dumps(state).encode()).hexdigest()
+        cache.set(cache_key, version_key, PYRAMID_VERSION_KEY_CACHE_TIMEOUT)
+    return version_key
+
+
+def get_pyramid_snapshot_lock_key(project_id: int, root_ids: List[int], include_geo_json: bool) -> str:
+    return f"mobile-org-units-snapshot-build-{project_id}-{get_roots_key(root_ids)}-{include_geo_json}"
+
+
+def schedule_pyramid_snapshot_build(project: Project, root_ids: List[int], include_geo_json: bool):
+    # Imported here as the task uses the serializer of this module
+    from iaso.tasks.build_org_unit_pyramid_snapshot import build_org_unit_pyramid_snapshot
+
+    lock_key = get_pyramid_snapshot_lock_key(project.id, root_ids, include_geo_json)
+    if cache.add(lock_key, True, PYRAMID_SNAPSHOT_BUILD_LOCK_TIMEOUT):
+        build_org_unit_pyramid_snapshot(project_id=project.id, root_ids=root_ids, include_geo_json=include_geo_json)
+
+
+def read_chunks(file, chunk_size=64 * 1024):
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
 
 
 class MobileOrgUnitsSetPagination(Paginator):
@@ -54,6 +180,13 @@ class MobileOrgUnitsSetPagination(Paginator):
         return super().get_page_size(request)
 
 
+class MobileOrgUnitsCursorPagination(KeysetCursorPagination):
+    ordering = ("path", "id")
+    nullable_fields = ["path"]
+    page_size = 1000
+    max_page_size = SHAPE_RESULTS_MAX
+
+
 class ReferenceInstancesFilter(django_filters.rest_framework.FilterSet):
     last_sync = django_filters.IsoDateTimeFilter(field_name="updated_at", lookup_expr="gte")
 
@@ -202,6 +335,13 @@ class MobileOrgUnitViewSet(ModelViewSet):
 
     GET /api/mobile/orgunits?{PAGE}=1&{LIMIT}=100
 
+    For large pyramids, prefer the cursor pagination: each page is read after the last org unit of the previous one
+    (ordered by path) instead of skipping all the previous pages. Pass `{CURSOR}=null` for the first page, then the
+    `next` token of the previous response while `has_next` is true:
+
+    GET /api/mobile/orgunits?{CURSOR}=null&{LIMIT}=1000
+    GET /api/mobile/orgunits?{CURSOR}=TOKEN&{LIMIT}=1000
+
     You can also request the Geo Shape by adding the `shapes=1` to your query parameters.
 
     GET /api/mobile/orgunits?shapes=1
@@ -213,11 +353,32 @@ class MobileOrgUnitViewSet(ModelViewSet):
     It is also possible to pass a list of ids to retrieve them regardless of their status:
 
     GET /api/mobile/orgunits/?app_id={APP_ID}&ids=id_1,id_2,id_3
+
+    To only download the changes since a previous sync, pass `{LAST_SYNC}` (ISO datetime) the first time, then the
+    `{SYNC_TOKEN}` of the previous response. The changes are ordered by `updated_at` and paginated with `{LIMIT}`,
+    repeat the call with the new token while `has_more` is true:
+
+    GET /api/mobile/orgunits/?app_id={APP_ID}&{LAST_SYNC}=2024-01-01T00:00:00Z&{LIMIT}=1000
+    GET /api/mobile/orgunits/?app_id={APP_ID}&{SYNC_TOKEN}=TOKEN&{LIMIT}=1000
+
+    The changed org units which are not downloadable anymore (e.g. rejected) are listed in `deleted`. When the download
+    is limited to the roots of the user, the org units moved out of them are listed too, with their descendants. Org
+    units removed from the database are not tracked, and changing the org unit types of the project requires a full
+    sync.
+
+    When `MOBILE_ORG_UNITS_SNAPSHOTS` is enabled, the full downloads (without `{LIMIT}`) are served from a gzipped
+    snapshot built in the background (see `OrgUnitPyramidSnapshot`) with an `ETag`, send it back in `If-None-Match`
+    to get a 304 while the pyramid did not change. Until the snapshot is built, the download is answered as usual.
     """
 
     permission_classes = [AuthenticationEnforcedPermission, HasOrgUnitPermission]
     serializer_class = MobileOrgUnitSerializer
-    pagination_class = MobileOrgUnitsSetPagination
+
+    @property
+    def pagination_class(self):
+        if self.action == "list" and self.request.query_params.get(CURSOR):
+            return MobileOrgUnitsCursorPagination
+        return MobileOrgUnitsSetPagination
 
     @property
     def results_key(self):
@@ -229,33 +390,13 @@ class MobileOrgUnitViewSet(ModelViewSet):
         user = self.request.user
         app_id = self.get_app_id()
 
-        limit_download_to_roots = False
-
         try:
             project = Project.objects.get_for_user_and_app_id(user, app_id)
         except Project.DoesNotExist:
             return OrgUnit.objects.none()
 
-        if user and not user.is_anonymous:
-            limit_download_to_roots = project.has_feature(FeatureFlag.LIMIT_OU_DOWNLOAD_TO_ROOTS)
-
-        if limit_download_to_roots:
-            org_units = OrgUnit.objects.filter_for_user_and_project(self.request.user, project)
-        else:
-            org_units = OrgUnit.objects.filter_for_user_and_project(None, project)
-        queryset = (
-            org_units.filter(validation_status=OrgUnit.VALIDATION_VALID)
-            .order_by("path")
-            .prefetch_related("parent__org_unit_type__projects", "groups")
-            .select_related("org_unit_type", "parent", "parent__org_unit_type")
-        )
-        include_geo_json = self.check_include_geo_json()
-        if include_geo_json:
-            queryset = queryset.annotate(
-                geo_json=RawSQL("ST_AsGeoJson(COALESCE(iaso_orgunit.simplified_geom, iaso_orgunit.geom))::json", [])
-            )
-
-        return queryset
+        root_ids = get_download_root_ids(user, project)
+        return get_mobile_org_units_queryset(project, root_ids, self.check_include_geo_json())
 
     def get_serializer_context(self) -> Dict[str, Any]:
         context = super().get_serializer_context()
@@ -295,11 +436,25 @@ class MobileOrgUnitViewSet(ModelViewSet):
             roots = self.request.user.iaso_profile.org_units.values_list("id", flat=True).order_by("id")
             roots_key = "|".join([str(root) for root in roots])
 
+        if LAST_SYNC in request.query_params or SYNC_TOKEN in request.query_params:
+            return self.list_changes(request, app_id, list(roots))
+
+        if request.query_params.get(CURSOR):
+            # Not cached: the cursor pages are cheap and their tokens make the cache keys unique anyway
+            response = super().list(request, *args, **kwargs)
+            response.data["roots"] = roots
+            return response
+
         page_size = self.paginator.get_page_size(request)
         page_number = self.paginator.get_iaso_page_number(request)
 
         include_geo_json = self.check_include_geo_json()
 
+        if page_size is None and settings.MOBILE_ORG_UNITS_SNAPSHOTS:
+            snapshot_response = self.get_snapshot_response(request, app_id, list(roots), include_geo_json)
+            if snapshot_response is not None:
+                return snapshot_response
+
         cache_key = f"{app_id}-{page_size}-{page_number}-{'geo_json' if include_geo_json else ''}--{roots_key}"
         cached_response = cache.get(cache_key)
         if cached_response is None:
@@ -312,6 +467,105 @@ class MobileOrgUnitViewSet(ModelViewSet):
 
         return Response(cached_response)
 
+    def get_snapshot_response(self, request, app_id, roots, include_geo_json):
+        """Full download read from the pyramid snapshot, `None` when the snapshot is missing or outdated"""
+        try:
+            project = Project.objects.get_for_user_and_app_id(request.user, app_id)
+        except Project.DoesNotExist:
+            return None
+
+        root_ids = get_download_root_ids(request.user, project)
+        version_key = get_pyramid_version_key(project, root_ids)
+        snapshot = OrgUnitPyramidSnapshot.objects.filter(
+            project=project, roots_key=get_roots_key(root_ids), include_geo_json=include_geo_json
+        ).first()
+        if snapshot is None or snapshot.version_key != version_key:
+            schedule_pyramid_snapshot_build(project, root_ids, include_geo_json)
+            return None
+
+        use_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+        # The roots of the user are part of the response but not of the snapshot
+        etag_content = f"{version_key}|{get_roots_key(roots)}|{'gzip' if use_gzip else ''}"
+        etag = quote_etag(hashlib.md5(etag_content.encode()).hexdigest())
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            head = f'{{"{self.results_key}": '.encode()
+            tail = f', "roots": {json.dumps(roots)}}}'.encode()
+            if use_gzip:
+                # Several gzip members one after the other are still a valid gzip stream
+                head, tail = gzip.compress(head), gzip.compress(tail)
+                chunks = read_chunks(snapshot.file.open("rb"))
+            else:
+                chunks = read_chunks(gzip.GzipFile(fileobj=snapshot.file.open("rb")))
+            response = StreamingHttpResponse(itertools.chain([head], chunks, [tail]), content_type="application/json")
+            if use_gzip:
+                response["Content-Encoding"] = "gzip"
+                response["Content-Length"] = len(head) + snapshot.file.size + len(tail)
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def list_changes(self, request, app_id, roots):
+        """Org units of the project changed after the sync token, by (`updated_at`, `id`) so a page never splits
+        the org units saved at the same time."""
+        sync_token = request.query_params.get(SYNC_TOKEN)
+        if sync_token:
+            updated_at, org_unit_id = decode_sync_token(sync_token)
+        else:
+            try:
+                updated_at = parse_datetime(request.query_params[LAST_SYNC])
+            except ValueError:
+                updated_at = None
+            if updated_at is None:
+                raise serializers.ValidationError({LAST_SYNC: "Invalid date, use the ISO 8601 format."})
+            if timezone.is_naive(updated_at):
+                updated_at = timezone.make_aware(updated_at, datetime.timezone.utc)
+            org_unit_id = 0
+        since = updated_at
+
+        try:
+            project = Project.objects.get_for_user_and_app_id(request.user, app_id)
+        except Project.DoesNotExist:
+            raise Http404
+
+        changes = (
+            OrgUnit.objects.filter_for_user_and_project(None, project)
+            .filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=org_unit_id))
+            .filter(updated_at__lte=timezone.now() - DELTA_SYNC_LAG)
+            .order_by("updated_at", "id")
+            .values_list("updated_at", "id")
+        )
+        page_size = self.paginator.get_page_size(request)
+        if page_size:
+            changes = changes[: page_size + 1]
+        changes = list(changes)
+        has_more = bool(page_size) and len(changes) > page_size
+        if has_more:
+            changes = changes[:page_size]
+        if changes:
+            updated_at, org_unit_id = changes[-1]
+
+        changed_ids = [changed_id for _, changed_id in changes]
+        downloadable = {org_unit.id: org_unit for org_unit in self.get_queryset().filter(id__in=changed_ids)}
+        serializer = self.get_serializer(
+            [downloadable[changed_id] for changed_id in changed_ids if changed_id in downloadable], many=True
+        )
+        deleted = [changed_id for changed_id in changed_ids if changed_id not in downloadable]
+        root_ids = get_download_root_ids(request.user, project)
+        if root_ids and deleted:
+            # the changes outside of the roots of the user are only reported when they were moved out of them
+            deleted = get_removed_from_roots(project, root_ids, deleted, since)
+        return Response(
+            {
+                self.results_key: serializer.data,
+                "deleted": deleted,
+                SYNC_TOKEN: encode_sync_token(updated_at, org_unit_id),
+                "has_more": has_more,
+                "roots": roots,
+            }
+        )
+
     @safe_api_import("orgUnit")
     def create(self, _, request):
         data = sorted(request.data, key=lambda ou: float(ou["created_at"]))
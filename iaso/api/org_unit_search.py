@@ -4,11 +4,12 @@ from datetime import datetime
 
 from django.contrib.gis.db.models import MultiPolygonField, PointField
 from django.contrib.gis.geos import GEOSGeometry
-from django.db.models import Case, Count, IntegerField, Q, QuerySet, Sum, When
+from django.db.models import Case, Count, IntegerField, OuterRef, Q, QuerySet, Sum, When
 from django.db.models.functions import Cast
 
-from iaso.models import DataSource, Instance, OrgUnit
+from iaso.models import DataSource, Group, Instance, OrgUnit
 from iaso.utils import search_by_ids_refs
+from iaso.utils.expressions import ArraySubquery
 
 
 def apply_org_unit_search(queryset: QuerySet, value: str, prefix: str = "") -> QuerySet:
@@ -265,7 +266,7 @@ def build_org_units_queryset(queryset, params, profile):
     return queryset
 
 
-def annotate_query(queryset, count_instances, count_per_form, forms):
+def annotate_query(queryset, count_instances, count_per_form, forms, group_ids=False):
     if count_instances:
         queryset = queryset.annotate(
             instances_count=Count(
@@ -294,4 +295,13 @@ def annotate_query(queryset, count_instances, count_per_form, forms):
         }
         queryset = queryset.annotate(**annotations)
 
+    if group_ids:
+        # Group membership is aggregated in the database as an array of group ids per org unit,
+        # so that exports don't have to load the org unit ids of every group in memory.
+        queryset = queryset.annotate(
+            group_ids=ArraySubquery(
+                Group.org_units.through.objects.filter(orgunit_id=OuterRef("pk")).values("group_id")
+            )
+        )
+
     return queryset
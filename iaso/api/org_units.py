@@ -23,7 +23,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from dynamic_fields.filter_backends import DynamicFieldsFilterBackendBackwardCompatible
-from hat.api.export_utils import Echo, generate_xlsx, iter_items
+from hat.api.export_utils import Echo, generate_xlsx_file, iter_items
 from hat.audit import models as audit_models
 from iaso.api.common import CONTENT_TYPE_CSV, CONTENT_TYPE_XLSX, is_field_referenced, safe_api_import
 from iaso.api.org_unit_search import annotate_query, build_org_units_queryset
@@ -41,7 +41,7 @@ from iaso.permissions.core_permissions import (
     CORE_REGISTRY_WRITE_PERMISSION,
     CORE_SUBMISSIONS_PERMISSION,
 )
-from iaso.utils import geojson_queryset
+from iaso.utils import geojson_feature_collection, geojson_features_by_id, geojson_queryset
 from iaso.utils.gis import simplify_geom
 
 from ..plugins import is_polio_plugin_active
@@ -51,6 +51,9 @@ from .serializers import OrgUnitImportSerializer
 
 logger = logging.getLogger(__name__)
 
+# `partition_by` values accepted by the parquet export and the matching column of the export
+PARQUET_PARTITION_COLUMNS = {"org_unit_type": "org_unit_type_id", "level": "org_unit_level"}
+
 # noinspection PyMethodMayBeStatic
 
 
@@ -223,7 +226,7 @@ class OrgUnitViewSet(viewsets.ViewSet):
             count_instances = False
         count_per_form = csv_format or xlsx_format
         # add annotation(s) if needed
-        queryset = annotate_query(queryset, count_instances, count_per_form, forms)
+        queryset = annotate_query(queryset, count_instances, count_per_form, forms, group_ids=count_per_form)
 
         if not request.user.is_anonymous:
             profile = request.user.iaso_profile
@@ -304,37 +307,33 @@ class OrgUnitViewSet(viewsets.ViewSet):
 
                 return Response(res)
             if with_shapes:
-                org_units = []
-                for unit in queryset:
-                    temp_org_unit = unit.as_dict()
-                    temp_org_unit["geo_json"] = None
-                    if temp_org_unit["has_geo_json"] == True:
-                        shape_queryset = queryset.filter(id=temp_org_unit["id"])
-                        temp_org_unit["geo_json"] = geojson_queryset(shape_queryset, geometry_field="simplified_geom")
-                    org_units.append(temp_org_unit)
+                org_units = [unit.as_dict() for unit in queryset]
+                # Fetch all the simplified shapes in a few set-based queries instead of one query per org unit.
+                shapes_by_id = geojson_features_by_id(
+                    OrgUnit.objects.all(),
+                    (org_unit["id"] for org_unit in org_units if org_unit["has_geo_json"]),
+                    geometry_field="simplified_geom",
+                )
+                for org_unit in org_units:
+                    shape = shapes_by_id.get(org_unit["id"])
+                    org_unit["geo_json"] = geojson_feature_collection([shape]) if shape else None
                 return Response({"orgUnits": org_units})
             if as_location:
                 limit = int(limit)
                 paginator = Paginator(queryset, limit)
                 page = paginator.page(1)
+                with_parents = request.GET.get("withParents", None)
                 org_units = []
 
-                org_units_ids = (item.id for item in page.object_list)
-                org_units_for_geojson = OrgUnit.objects.filter(id__in=org_units_ids).only("id", "simplified_geom")
-                geo_json = geojson_queryset(org_units_for_geojson, geometry_field="simplified_geom")
+                # Index the shapes of the page by id so that joining them to the org units is linear in page size.
+                shapes_by_id = geojson_features_by_id(
+                    OrgUnit.objects.all(), (item.id for item in page.object_list), geometry_field="simplified_geom"
+                )
 
                 for unit in page.object_list:
-                    temp_org_unit = unit.as_location(with_parents=request.GET.get("withParents", None))
-                    unit_geo_json = next((item for item in geo_json["features"] if item["id"] == unit.id), None)
-                    temp_org_unit["geo_json"] = (
-                        {
-                            "type": "FeatureCollection",
-                            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
-                            "features": [unit_geo_json],
-                        }
-                        if unit_geo_json
-                        else None
-                    )
+                    temp_org_unit = unit.as_location(with_parents=with_parents)
+                    unit_geo_json = shapes_by_id.get(unit.id)
+                    temp_org_unit["geo_json"] = geojson_feature_collection([unit_geo_json]) if unit_geo_json else None
                     org_units.append(temp_org_unit)
 
                 return Response(org_units)
@@ -350,8 +349,12 @@ class OrgUnitViewSet(viewsets.ViewSet):
         #  In order to get the all groups independently of filters, we should get the groups
         # based on the org_unit FK.
 
-        org_ids = queryset.order_by("pk").values_list("pk", flat=True)
-        groups = Group.objects.filter(org_units__id__in=set(org_ids)).only("id", "name").distinct("id")
+        if queryset.query.combinator:
+            # Combined (multi-search) querysets can't be used as a subquery.
+            org_ids = set(queryset.order_by("pk").values_list("pk", flat=True))
+        else:
+            org_ids = queryset.order_by().values("pk")
+        groups = Group.objects.filter(org_units__id__in=org_ids).only("id", "name").distinct("id")
 
         columns = [
             {"title": "ID", "width": 10},
@@ -384,7 +387,6 @@ class OrgUnitViewSet(viewsets.ViewSet):
         columns.append({"title": "Total de soumissions", "width": 15})
 
         for group in groups:
-            group.org_units__ids = list(group.org_units.values_list("id", flat=True))
             columns.append({"title": group.name, "width": 20})
 
         parent_field_names = ["parent__" * i + "name" for i in range(1, 5)]
@@ -412,6 +414,7 @@ class OrgUnitViewSet(viewsets.ViewSet):
             "opening_date",
             "closed_date",
             "code",
+            "group_ids",
         )
 
         user_account_name = profile.account.name if profile else ""
@@ -435,6 +438,7 @@ class OrgUnitViewSet(viewsets.ViewSet):
             ]
 
             code = org_unit.get("code") if org_unit.get("code") != "" else None
+            group_ids = set(org_unit.get("group_ids") or [])
 
             org_unit_values = [
                 org_unit.get("id"),
@@ -459,14 +463,14 @@ class OrgUnitViewSet(viewsets.ViewSet):
                 *parents_source_ref,
                 *[org_unit.get(count_field_name) for count_field_name in counts_by_forms],
                 org_unit.get("instances_count"),
-                *[int(org_unit.get("id") in group.org_units__ids) for group in groups],
+                *[int(group.id in group_ids) for group in groups],
             ]
             return org_unit_values
 
         if xlsx_format:
             filename = filename + ".xlsx"
-            response = HttpResponse(
-                generate_xlsx("Forms", columns, queryset, get_row),
+            response = CleaningFileResponse(
+                generate_xlsx_file("Forms", columns, queryset, get_row),
                 content_type=CONTENT_TYPE_XLSX,
             )
         if csv_format:
@@ -490,7 +494,7 @@ class OrgUnitViewSet(viewsets.ViewSet):
         filename = "org_units"
         filename = "%s-%s-%s-%s" % (environment, user_account_name, filename, strftime("%Y-%m-%d-%H-%M", gmtime()))
         # validate no unsupported/extra params is passed
-        allowed_params = {"parquet", "order", "searches", "extra_fields"}
+        allowed_params = {"parquet", "order", "searches", "extra_fields", "partition_by"}
         received_params = set(request.GET.keys())
 
         unknown = received_params - allowed_params
@@ -526,11 +530,28 @@ class OrgUnitViewSet(viewsets.ViewSet):
                 status=status.HTTP_409_CONFLICT,
             )
 
+        partition_by = request.GET.get("partition_by", None)
+        if partition_by and partition_by not in PARQUET_PARTITION_COLUMNS:
+            return JsonResponse(
+                {
+                    "error": f"Unknown partition_by for parquet exports: {partition_by}, only supported {', '.join(PARQUET_PARTITION_COLUMNS)}."
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
         try:
             export_queryset = parquet.build_pyramid_queryset(queryset, extra_fields)
         except ValueError as e:
             return JsonResponse({"error": str(e)}, status=status.HTTP_409_CONFLICT)
 
+        if partition_by:
+            # One parquet file per value of the partition column, returned in a zip file
+            tmp = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
+            parquet.export_django_query_to_partitioned_parquet_zip(
+                export_queryset, tmp.name, [PARQUET_PARTITION_COLUMNS[partition_by]]
+            )
+            return CleaningFileResponse(tmp.name, as_attachment=True, filename=filename + ".zip")
+
         tmp = tempfile.NamedTemporaryFile(suffix=".parquet", delete=False)
 
         parquet.export_django_query_to_parquet_via_duckdb(export_queryset, tmp.name)
@@ -5,6 +5,7 @@ from rest_framework import serializers
 
 APP_ID = "app_id"
 APP_VERSION = "app_version"
+CURSOR = "cursor"
 DATE_FROM = "dateFrom"
 DATE_TO = "dateTo"
 DEVICE_ID = "deviceId"
@@ -19,6 +20,7 @@ IDS = "ids"
 IMAGE_ONLY = "image_only"
 INCLUDE_CREATION = "include_creation"
 JSON_CONTENT = "jsonContent"
+LAST_SYNC = "last_sync"
 LIMIT = "limit"
 MODIFICATION_DATE_FROM = "modificationDateFrom"
 MODIFICATION_DATE_TO = "modificationDateTo"
@@ -42,6 +44,7 @@ SHOW_DELETED = "showDeleted"
 SOURCE_VERSION_ID = "source_version_id"
 START_PERIOD = "startPeriod"
 STATUS = "status"
+SYNC_TOKEN = "sync_token"
 TYPE = "type"
 USER_IDS = "userIds"
 WITH_LOCATION = "withLocation"
@@ -97,7 +97,8 @@ class DiffSerializer(serializers.Serializer):
         else:
             ignore_groups = True
 
-        diffs, fields = Differ().diff(
+        # the diffs are written to the file as they are computed
+        diffs, fields = Differ().stream_diff(
             data["ref_version_id"],
             data["source_version_id"],
             ignore_groups=ignore_groups,
@@ -1,10 +1,16 @@
+import collections
+import copy
 import itertools
 import json
 import logging
+import threading
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from timeit import default_timer as timer
 
 from dhis2 import Api, RequestException
+from django import db
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.utils import timezone
 from packaging.version import InvalidVersion, Version
@@ -89,18 +95,86 @@ def uniquify(seq, idfun=None):
     return result
 
 
-class BaseHandler:
-    def __init__(self, *args):
-        self.logger = logger
+def references_orgunit(mapping):
+    if isinstance(mapping, dict):
+        return mapping.get("valueType") == "ORGANISATION_UNIT" or any(map(references_orgunit, mapping.values()))
+    if isinstance(mapping, list):
+        return any(map(references_orgunit, mapping))
+    return False
+
+
+def orgunit_question_keys(mapping_json):
+    """Return the question keys of a form mapping which are mapped to an ORGANISATION_UNIT value."""
+    question_mappings = mapping_json.get("question_mappings", {})
+    return {question_key for question_key, mapping in question_mappings.items() if references_orgunit(mapping)}
+
 
-    def orgunit_resolver(self, orgunit_id):
-        if orgunit_id.isnumeric():
-            # should we enforce accounts ?
-            # if it's a number then look up by id
-            return OrgUnit.objects.filter(id=orgunit_id).first().source_ref
+def collect_answers(answers, question_keys, values):
+    """Add to `values` the answers to `question_keys`, looking into repeat groups too."""
+    if isinstance(answers, dict):
+        for key, value in answers.items():
+            if key in question_keys and isinstance(value, (str, int)):
+                values.add(str(value))
+            else:
+                collect_answers(value, question_keys, values)
+    elif isinstance(answers, list):
+        for value in answers:
+            collect_answers(value, question_keys, values)
+    return values
+
+
+class OrgUnitResolver:
+    """
+    Resolve the org unit ids found in the answers of submissions to their DHIS2 id (`source_ref`).
 
-        # keep old behaviour eg : entity attribute generated based on instance.org_unit
-        return orgunit_id
+    The resolved ids are kept for the whole export, and `prefetch` loads the ids referenced by a page in one query, so
+    that the handlers don't do one query per value. `hits` and `misses` count the lookups served from the cache and
+    the ones needing a query.
+    """
+
+    def __init__(self):
+        self.source_refs = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def prefetch(self, orgunit_ids):
+        with self._lock:
+            missing = {orgunit_id for orgunit_id in orgunit_ids if orgunit_id.isdecimal()} - self.source_refs.keys()
+        if not missing:
+            return
+        source_refs = OrgUnit.objects.filter(id__in=[int(orgunit_id) for orgunit_id in missing]).values_list(
+            "id", "source_ref"
+        )
+        with self._lock:
+            self.source_refs.update({str(orgunit_id): source_ref for orgunit_id, source_ref in source_refs})
+
+    def __call__(self, orgunit_id):
+        if not orgunit_id.isnumeric():
+            # keep old behaviour eg : entity attribute generated based on instance.org_unit
+            return orgunit_id
+
+        with self._lock:
+            if orgunit_id in self.source_refs:
+                self.hits += 1
+                return self.source_refs[orgunit_id]
+            self.misses += 1
+
+        # should we enforce accounts ?
+        # if it's a number then look up by id
+        source_ref = OrgUnit.objects.filter(id=orgunit_id).first().source_ref
+        with self._lock:
+            self.source_refs[orgunit_id] = source_ref
+        return source_ref
+
+    def stats_message(self):
+        return "org unit cache: %d hits, %d misses" % (self.hits, self.misses)
+
+
+class BaseHandler:
+    def __init__(self, orgunit_resolver=None):
+        self.logger = logger
+        self.orgunit_resolver = orgunit_resolver or OrgUnitResolver()
 
 
 class AggregateHandler(BaseHandler):
@@ -181,7 +255,6 @@ class AggregateHandler(BaseHandler):
 
     def export_page(self, prefix, data, export_statuses, stats, api):
         if len(data) == 0:
-            stats["batched_time"] = 0
             return []
 
         export_log = self.export_page_values(prefix, data, export_statuses, stats, api)
@@ -240,7 +313,7 @@ class AggregateHandler(BaseHandler):
 
             batched_end = timer()
             batched_time = batched_end - batched_start
-            stats["batched_time"] = batched_time
+            stats["batched_time"] += batched_time
             self.logger.debug(prefix + str(resp))
 
             export_log = ExportLog()
@@ -360,7 +433,6 @@ class EventHandler(BaseHandler):
 
     def export_page(self, prefix, data, export_statuses, stats, api):
         if len(data) == 0:
-            stats["batched_time"] = 0
             return []
 
         export_logs = []
@@ -585,7 +657,6 @@ class EventTrackerHandler(BaseHandler):
 
     def export_page(self, prefix, data, export_statuses, stats, raw_api):
         if len(data) == 0:
-            stats["batched_time"] = 0
             return []
         api = ApiLogger(raw_api)
 
@@ -612,7 +683,8 @@ class EventTrackerHandler(BaseHandler):
                 for repeat_group in export_status.mapping_version.form_version.repeat_groups():
                     repeat_group_name = repeat_group["name"]
                     if repeat_group_name in question_mappings:
-                        subform_mapping = question_mappings[repeat_group_name][0]
+                        # the form mapping is shared by the pages exported concurrently, work on a copy
+                        subform_mapping = copy.deepcopy(question_mappings[repeat_group_name][0])
                         subform_mapping["question_mappings"] = {}
                         for question_name in question_mappings:
                             question_mapping = question_mappings[question_name]
@@ -720,8 +792,7 @@ class EventTrackerHandler(BaseHandler):
         return tracked_entity_resp["response"]["importSummaries"][0]["reference"]
 
     def flag_as_exported(self, export_status, stats, export_logs):
-        export_request = export_status.export_request
-
+        # the counts of the export request are saved by `DataValueExporter._complete_page` on the main thread
         stats["exported_count"] += 1
         export_status.status = EXPORTED
         for export_log in export_logs:
@@ -733,10 +804,6 @@ class EventTrackerHandler(BaseHandler):
         instance.last_export_success_at = timezone.now()
         instance.save()
 
-        export_request.errored_count = stats["errored_count"]
-        export_request.exported_count = stats["exported_count"]
-        export_request.save()
-
     def handle_exception(self, resp, message):
         if "response" not in resp and resp["status"] == "ERROR":
             final_message = message + resp["message"]
@@ -770,20 +837,35 @@ class EventTrackerHandler(BaseHandler):
 
 
 class DataValueExporter:
-    def __init__(self):
+    """
+    Export the submissions of an `ExportRequest` to DHIS2, page by page.
+
+    Pages are pipelined: the next page is mapped while the DHIS2 calls of the previous ones are in flight, with at
+    most `max_workers` pages being sent to DHIS2 at the same time. Mapping and flagging the export statuses always
+    happen in the calling thread. With `max_workers=1` (the default, see `DHIS2_EXPORT_MAX_WORKERS`), pages are
+    exported one after another in the calling thread.
+    """
+
+    def __init__(self, max_workers=None):
         self.form_mappings_cache = {}
         self.api_cache = {}
+        self.max_workers = max_workers or settings.DHIS2_EXPORT_MAX_WORKERS
+        # shared by the handlers, so that an org unit is resolved once per export
+        self.orgunit_resolver = OrgUnitResolver()
+        self.orgunit_question_keys_cache = {}
         self.handlers = {
-            models.AGGREGATE: AggregateHandler(),
-            models.EVENT: EventHandler(),
-            models.EVENT_TRACKER: EventTrackerHandler(),
+            models.AGGREGATE: AggregateHandler(self.orgunit_resolver),
+            models.EVENT: EventHandler(self.orgunit_resolver),
+            models.EVENT_TRACKER: EventTrackerHandler(self.orgunit_resolver),
         }
 
     def get_api(self, mapping_version):
-        if mapping_version.id not in self.api_cache:
+        # `requests` sessions aren't meant to be shared between threads
+        key = (mapping_version.id, threading.get_ident())
+        if key not in self.api_cache:
             credentials = mapping_version.mapping.data_source.credentials
-            self.api_cache[mapping_version.id] = Api(credentials.url, credentials.login, credentials.password)
-        return self.api_cache[mapping_version.id]
+            self.api_cache[key] = Api(credentials.url, credentials.login, credentials.password)
+        return self.api_cache[key]
 
     def export_log_on(self, status, export_status, export_logs):
         export_status.status = status
@@ -791,9 +873,25 @@ class DataValueExporter:
             export_status.export_logs.add(export_log)
         export_status.save()
 
+    def get_orgunit_question_keys(self, mapping_version):
+        if mapping_version.id not in self.orgunit_question_keys_cache:
+            self.orgunit_question_keys_cache[mapping_version.id] = orgunit_question_keys(mapping_version.json)
+        return self.orgunit_question_keys_cache[mapping_version.id]
+
+    def prefetch_orgunits(self, export_statuses):
+        orgunit_ids = set()
+        for export_status in export_statuses:
+            if export_status.mapping_version and export_status.instance.json:
+                question_keys = self.get_orgunit_question_keys(export_status.mapping_version)
+                if question_keys:
+                    collect_answers(export_status.instance.json, question_keys, orgunit_ids)
+        self.orgunit_resolver.prefetch(orgunit_ids)
+
     def map_page_to_data_values(self, prefix, export_statuses, skipped):
         data = {models.AGGREGATE: [], models.EVENT: [], models.EVENT_TRACKER: []}
 
+        self.prefetch_orgunits(export_statuses)
+
         for export_status in export_statuses:
             instance = export_status.instance
 
@@ -835,7 +933,6 @@ class DataValueExporter:
         export_request.last_error_message = message
         export_request.save()
 
-        task.refresh_from_db()
         task.report_progress_and_stop_if_killed(progress_message=message, prepend_progress=True)
 
     def flag_as_exported(self, export_request, export_statuses, stats, export_logs):
@@ -860,8 +957,7 @@ class DataValueExporter:
         except BaseException as exception:
             message = repr(exception) + " : " + type(exception).__name__
             logger.error("%s %s", message, exception)
-            task.refresh_from_db()
-            task.report_progress_and_stop_if_killed(progress_message=message, prepend_progress=True)
+            task.report_progress_and_stop_if_killed(progress_message=message, prepend_progress=True, force=True)
             task.terminate_with_error(message=message + "\n" + task.progress_message, exception=exception)
 
     def _export_instances(
@@ -877,10 +973,9 @@ class DataValueExporter:
         export_request.continue_on_error = continue_on_error
         export_request.save()
 
-        fatal_errors = 0
-
         paginator = Paginator(
             export_request.exportstatus_set.prefetch_related("mapping_version")
+            .prefetch_related("mapping_version__mapping__data_source__credentials")
             .prefetch_related("instance")
             .prefetch_related("instance__org_unit")
             .prefetch_related("instance__org_unit__version")
@@ -896,66 +991,42 @@ class DataValueExporter:
         )
 
         skipped = []
-        stats = {"exported_count": 0, "errored_count": 0}
-        export_statuses = []
-        for page in range(1, paginator.num_pages + 1):
-            page_start = timer()
-            prefix = "page %d/%d" % (page, paginator.num_pages)
-
-            try:
-                export_statuses = paginator.page(page).object_list
-                if len(export_statuses) == 0:
-                    logger.warning(f"Empty page {page} for {export_request}")
+        stats = {"exported_count": 0, "errored_count": 0, "dhis2_time": 0.0, "processed_count": 0}
+        export_start = timer()
+        in_flight = collections.deque()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers) if self.max_workers > 1 else None
+        try:
+            for page in range(1, paginator.num_pages + 1):
+                prefix = "page %d/%d" % (page, paginator.num_pages)
+                export_statuses = []
+                try:
+                    export_statuses = paginator.page(page).object_list
+                    if len(export_statuses) == 0:
+                        logger.warning(f"Empty page {page} for {export_request}")
+                        continue
+                    data = self.map_page_to_data_values(prefix, export_statuses, skipped)
+                    in_flight.append(
+                        (prefix, export_statuses, self._submit_page(executor, prefix, data, export_statuses))
+                    )
+                except BaseException as exception:
+                    self._handle_page_error(export_request, export_statuses, exception, stats, task)
                     continue
-                data = self.map_page_to_data_values(prefix, export_statuses, skipped)
-                api = self.get_api(export_statuses[0].mapping_version)
-
-                export_logs_aggregate = self.handlers[models.AGGREGATE].export_page(
-                    prefix, data[models.AGGREGATE], export_statuses, stats, api
-                )
-
-                export_logs_event = self.handlers[models.EVENT].export_page(
-                    prefix, data[models.EVENT], export_statuses, stats, api
-                )
-
-                self.handlers[models.EVENT_TRACKER].export_page(
-                    prefix, data[models.EVENT_TRACKER], export_statuses, stats, api
-                )
 
-                if len(data[models.EVENT_TRACKER]) == 0:
-                    export_logs = list(itertools.chain(export_logs_aggregate, export_logs_event))
-                    self.flag_as_exported(export_request, export_statuses, stats, export_logs)
-
-                page_end = timer()
-                page_time = page_end - page_start
-                message = prefix + " in %1.2f sec (dhis2 time %1.2f batched): %d skipped, %d error count" % (
-                    page_time,
-                    stats["batched_time"],
-                    len(skipped),
-                    stats["errored_count"],
-                )
-                logger.debug(message)
-
-                task.refresh_from_db()
-                task.report_progress_and_stop_if_killed(progress_message=message, prepend_progress=True)
-
-            except InstanceExportError as exception:
-                self.flag_as_errored(export_request, export_statuses, exception.message, stats, task=task)
-                stats["errored_count"] += 1
-                if not export_request.continue_on_error:
-                    raise exception
-
-            # it's ok to catch BaseException, we want to be able to mark it as errored if cancelled or worst
-            except BaseException as exception:
-                stats["errored_count"] += 1
-                self.flag_as_errored(
-                    export_request,
-                    export_statuses,
-                    repr(exception) + " : " + type(exception).__name__,
-                    stats,
-                    task=task,
-                )
-                raise exception
+                # Wait for the oldest pages so that at most `max_workers` pages are in flight
+                while len(in_flight) >= self.max_workers:
+                    message = self._complete_page(
+                        export_request, task, *in_flight.popleft(), stats, skipped, export_start
+                    )
+
+            while in_flight:
+                message = self._complete_page(export_request, task, *in_flight.popleft(), stats, skipped, export_start)
+        except BaseException:
+            self._complete_in_flight_pages(export_request, task, in_flight, stats, skipped, export_start)
+            raise
+        finally:
+            if executor:
+                # on errors, don't start the pages waiting in the queue
+                executor.shutdown(wait=True, cancel_futures=True)
 
         export_request.status = EXPORTED if stats["errored_count"] == 0 else ERRORED
         export_request.finished = True
@@ -969,3 +1040,121 @@ class DataValueExporter:
         else:
             task.terminate_with_error(message + "\n" + task.progress_message)
         return message
+
+    def _submit_page(self, executor, prefix, data, export_statuses):
+        """Send the mapped `data` of a page to DHIS2, in a worker thread if there is an executor."""
+        if executor:
+            return executor.submit(self._export_page_in_thread, prefix, data, export_statuses)
+
+        future = Future()
+        try:
+            future.set_result(self._export_page(prefix, data, export_statuses))
+        except BaseException as exception:
+            future.set_exception(exception)
+        return future
+
+    def _export_page_in_thread(self, prefix, data, export_statuses):
+        try:
+            return self._export_page(prefix, data, export_statuses)
+        finally:
+            # worker threads get their own database connection, don't leak it
+            db.connection.close()
+
+    def _export_page(self, prefix, data, export_statuses):
+        page_stats = {"exported_count": 0, "errored_count": 0, "batched_time": 0.0}
+        start = timer()
+        api = self.get_api(export_statuses[0].mapping_version)
+
+        export_logs_aggregate = self.handlers[models.AGGREGATE].export_page(
+            prefix, data[models.AGGREGATE], export_statuses, page_stats, api
+        )
+
+        export_logs_event = self.handlers[models.EVENT].export_page(
+            prefix, data[models.EVENT], export_statuses, page_stats, api
+        )
+
+        self.handlers[models.EVENT_TRACKER].export_page(
+            prefix, data[models.EVENT_TRACKER], export_statuses, page_stats, api
+        )
+
+        page_stats["dhis2_time"] = timer() - start
+        # event tracker handler flags the export statuses by itself
+        page_stats["export_logs"] = (
+            list(itertools.chain(export_logs_aggregate, export_logs_event))
+            if len(data[models.EVENT_TRACKER]) == 0
+            else None
+        )
+        return page_stats
+
+    def _complete_page(self, export_request, task, prefix, export_statuses, future, stats, skipped, export_start):
+        """Wait for a page sent to DHIS2, then flag its export statuses and report progress"""
+        message = ""
+        try:
+            page_stats = future.result()
+            stats["exported_count"] += page_stats["exported_count"]
+            stats["errored_count"] += page_stats["errored_count"]
+            stats["dhis2_time"] += page_stats["dhis2_time"]
+            stats["processed_count"] += len(export_statuses)
+
+            if page_stats["export_logs"] is not None:
+                self.flag_as_exported(export_request, export_statuses, stats, page_stats["export_logs"])
+            else:
+                export_request.errored_count = stats["errored_count"]
+                export_request.exported_count = stats["exported_count"]
+                export_request.save()
+
+            elapsed = timer() - export_start
+            message = (
+                prefix
+                + " sent in %1.2f sec (%1.2f sec for the batched data values): %d skipped, %d error count, %1.2f instances/s, total dhis2 time %1.2f sec, %s"
+                % (
+                    page_stats["dhis2_time"],
+                    page_stats["batched_time"],
+                    len(skipped),
+                    stats["errored_count"],
+                    stats["processed_count"] / elapsed if elapsed else 0,
+                    stats["dhis2_time"],
+                    self.orgunit_resolver.stats_message(),
+                )
+            )
+            logger.debug(message)
+
+            # no reload of the task: it would drop the throttled progress, the kill flag is read by the report
+            task.report_progress_and_stop_if_killed(progress_message=message, prepend_progress=True)
+        except BaseException as exception:
+            self._handle_page_error(export_request, export_statuses, exception, stats, task)
+        return message
+
+    def _complete_in_flight_pages(self, export_request, task, in_flight, stats, skipped, export_start):
+        """When the export is aborted, flag the pages already sent to DHIS2, else a rerun would send them again.
+
+        The pages which haven't been started yet are cancelled."""
+        for _, _, future in in_flight:
+            future.cancel()
+        while in_flight:
+            prefix, export_statuses, future = in_flight.popleft()
+            if future.cancelled():
+                continue
+            try:
+                self._complete_page(export_request, task, prefix, export_statuses, future, stats, skipped, export_start)
+            except BaseException as exception:
+                logger.error("Error while completing %s of an aborted export: %r", prefix, exception)
+
+    def _handle_page_error(self, export_request, export_statuses, exception, stats, task):
+        if isinstance(exception, InstanceExportError):
+            self.flag_as_errored(export_request, export_statuses, exception.message, stats, task=task)
+            stats["errored_count"] += 1
+            if not export_request.continue_on_error:
+                raise exception
+            return
+
+        # it's ok to catch BaseException, we want to be able to mark it as errored if cancelled or worst
+        stats["errored_count"] += 1
+        self.flag_as_errored(
+            export_request,
+            export_statuses,
+            repr(exception) + " : " + type(exception).__name__,
+            stats,
+            task=task,
+        )
+        raise exception
@@ -33,6 +33,12 @@ class FieldType(Dictable):
     def distance(self, dhis2_value, ref_value):
         return None
 
+    def access_row(self, row):
+        """Same as `access` but on a row of `Differ.pyramid_rows`, a `values()` dict with the groups of the org unit."""
+        if row is None:
+            return None
+        return row[self.field_name]
+
 
 class NameFieldType(FieldType):
     def access(self, org_unit):
@@ -70,6 +76,11 @@ class GeometryFieldType(FieldType):
             return org_unit.simplified_geom
         return None
 
+    def access_row(self, row):
+        if row is None:
+            return None
+        return row["location"] or row["geom"] or row["simplified_geom"]
+
     def is_same(self, value, other_value):
         if value is None and other_value is None:
             return True
@@ -107,6 +118,11 @@ class ParentFieldType(FieldType):
             return org_unit.parent.source_ref
         return None
 
+    def access_row(self, row):
+        if row is None:
+            return None
+        return row["parent__source_ref"]
+
 
 class GroupSetFieldType(FieldType):
     def __init__(self, field_name):
@@ -125,6 +141,17 @@ class GroupSetFieldType(FieldType):
 
         return groups
 
+    def access_row(self, row):
+        if row is None:
+            return None
+        groups = []
+        for group in row["groups"]:
+            for groupset_ref in group["group_set_refs"]:
+                if groupset_ref == self.groupset_ref:
+                    groups.append({"id": group["source_ref"], "name": group["name"]})
+
+        return groups
+
     def is_same(self, value, other_value):
         val = sorted(map(lambda g: g["id"], value or []))
         other_val = sorted(map(lambda g: g["id"], other_value or []))
@@ -147,6 +174,16 @@ class GroupFieldType(FieldType):
 
         return groups
 
+    def access_row(self, row):
+        if row is None:
+            return None
+        groups = []
+        for group in row["groups"]:
+            if group["source_ref"] == self.group_ref:
+                groups.append({"id": group["source_ref"], "name": group["name"], "iaso_id": group["pk"]})
+
+        return groups
+
     def is_same(self, value, other_value):
         val = sorted(map(lambda g: g["id"], value or []))
         other_val = sorted(map(lambda g: g["id"], other_value or []))
@@ -1,8 +1,13 @@
+import itertools
 import logging
 
-from django.db.models import Q
+from operator import itemgetter
+
+from django.db.models import F, OuterRef
+from django.db.models.functions import Collate
 
 from iaso.models import Group, OrgUnit
+from iaso.utils.expressions import ArraySubquery
 from iaso.utils.memory import memory_mb
 
 from .comparisons import Comparison, Diff, as_field_types
@@ -10,17 +15,51 @@ from .comparisons import Comparison, Diff, as_field_types
 
 logger = logging.getLogger(__name__)
 
+# number of rows fetched at once from the database, and of diffs for which the org units are loaded at once
+DIFF_CHUNK_SIZE = 2000
+PYRAMID_ROW_FIELDS = ["id", "source_ref", "name", "code", "opening_date", "closed_date", "parent__source_ref"]
+PYRAMID_ROW_GEOMETRY_FIELDS = ["location", "geom", "simplified_geom"]
+
+
+def _merge_key(group):
+    # org units without source_ref come last, like NULLs in `Differ.pyramid_rows`
+    source_ref = group[0]
+    return (1, "") if source_ref is None else (0, source_ref)
 
-def index_pyramid(orgunits):
-    orgunits_by_source_ref = {}
-    for orgunit in orgunits:
-        if orgunits_by_source_ref.get(orgunit.source_ref, None) is None:
-            orgunits_by_source_ref[orgunit.source_ref] = [orgunit]
+
+def _group_rows(rows):
+    for source_ref, group in itertools.groupby(rows, itemgetter("source_ref")):
+        if source_ref is None:
+            # org units without source_ref are distinct org units, each one is its own group
+            for row in group:
+                yield None, [row]
         else:
-            print("TWO ORG UNITS WITH THE SAME source_ref: %s (THIS SHOULD NOT HAPPEN!)" % orgunit.source_ref)
+            yield source_ref, list(group)
+
 
-            orgunits_by_source_ref[orgunit.source_ref].append(orgunit)
-    return orgunits_by_source_ref
+def merge_pyramids(rows_dhis2, rows_ref):
+    """
+    Join two streams of rows ordered by `source_ref` on their `source_ref`.
+
+    Yield `(source_ref, rows_dhis2, rows_ref)` for each `source_ref`, one of the lists being empty when the source_ref
+    only exists on one side. Rows without source_ref are never matched: each one is yielded on its own.
+    """
+    groups_dhis2 = _group_rows(rows_dhis2)
+    groups_ref = _group_rows(rows_ref)
+    group_dhis2 = next(groups_dhis2, None)
+    group_ref = next(groups_ref, None)
+
+    while group_dhis2 is not None or group_ref is not None:
+        if group_ref is None or (group_dhis2 is not None and _merge_key(group_dhis2) < _merge_key(group_ref)):
+            yield group_dhis2[0], group_dhis2[1], []
+            group_dhis2 = next(groups_dhis2, None)
+        elif group_dhis2 is None or _merge_key(group_ref) < _merge_key(group_dhis2) or group_ref[0] is None:
+            yield group_ref[0], [], group_ref[1]
+            group_ref = next(groups_ref, None)
+        else:
+            yield group_ref[0], group_dhis2[1], group_ref[1]
+            group_dhis2 = next(groups_dhis2, None)
+            group_ref = next(groups_ref, None)
 
 
 class Differ:
@@ -30,26 +69,15 @@ class Differ:
     STATUS_NOT_IN_ORIGIN = "not in origin - ignored"
     STATUS_NEVER_SEEN = "never_seen"
 
-    def load_pyramid(
+    def filter_pyramid(
         self,
         version,
         validation_status=None,
         top_org_unit=None,
         org_unit_types=None,
         org_unit_group=None,
-        ignore_groups=False,
     ):
-        logger.info(f"loading pyramid {version.data_source} {version} {top_org_unit} {org_unit_types}")
-        queryset = (
-            OrgUnit.objects.prefetch_related("parent")
-            .prefetch_related("parent__parent")
-            .prefetch_related("parent__parent__parent")
-            .prefetch_related("parent__parent__parent__parent")
-            .select_related("org_unit_type")
-            .filter(version=version)
-        )
-        if not ignore_groups:
-            queryset = queryset.prefetch_related("groups").prefetch_related("groups__group_sets")
+        queryset = OrgUnit.objects.filter(version=version)
         if validation_status:
             queryset = queryset.filter(validation_status=validation_status)
         if top_org_unit:
@@ -58,8 +86,51 @@ class Differ:
         if org_unit_types:
             queryset = queryset.filter(org_unit_type__in=org_unit_types)
         if org_unit_group:
-            queryset = queryset.filter(groups=org_unit_group).distinct("id")  # distinct because groups is m2m
-        return queryset.order_by("id")
+            # subquery rather than a join, so that no distinct is needed
+            queryset = queryset.filter(
+                id__in=Group.org_units.through.objects.filter(group=org_unit_group).values("orgunit_id")
+            )
+        return queryset
+
+    def load_groups(self, *pyramids):
+        """Index by id the groups of the org units of the pyramids, with the source_ref of their group sets."""
+        groups_by_id = {}
+        for pyramid in pyramids:
+            memberships = Group.org_units.through.objects.filter(orgunit_id__in=pyramid.values("id"))
+            groups = (
+                Group.objects.filter(id__in=memberships.values("group_id"))
+                .exclude(id__in=list(groups_by_id))
+                .prefetch_related("group_sets")
+            )
+            for group in groups:
+                groups_by_id[group.id] = {
+                    "pk": group.pk,
+                    "source_ref": group.source_ref,
+                    "name": group.name,
+                    "source_version_id": group.source_version_id,
+                    "group_set_refs": [group_set.source_ref for group_set in group.group_sets.all()],
+                }
+        return groups_by_id
+
+    def pyramid_rows(self, queryset, groups_by_id, ignore_groups=False, with_geometry=True):
+        """
+        Stream the org units of `queryset` as `values()` dicts, ordered by `source_ref`.
+
+        The "C" collation orders the source_refs like python compares strings, which `merge_pyramids` relies on.
+        """
+        fields = PYRAMID_ROW_FIELDS + (PYRAMID_ROW_GEOMETRY_FIELDS if with_geometry else [])
+        if not ignore_groups:
+            queryset = queryset.annotate(
+                group_ids=ArraySubquery(
+                    Group.org_units.through.objects.filter(orgunit_id=OuterRef("pk")).values("group_id")
+                )
+            )
+            fields = fields + ["group_ids"]
+        queryset = queryset.order_by(Collate(F("source_ref"), "C").asc(nulls_last=True), "id").values(*fields)
+
+        for row in queryset.iterator(chunk_size=DIFF_CHUNK_SIZE):
+            row["groups"] = [groups_by_id[group_id] for group_id in row.pop("group_ids", None) or []]
+            yield row
 
     def diff(
         self,
@@ -77,126 +148,188 @@ class Differ:
         org_unit_group_ref=None,
         field_names=None,
     ):
+        diffs, field_names = self.stream_diff(
+            version_ref,
+            version,
+            ignore_groups=ignore_groups,
+            show_deleted_org_units=show_deleted_org_units,
+            validation_status=validation_status,
+            validation_status_ref=validation_status_ref,
+            top_org_unit=top_org_unit,
+            top_org_unit_ref=top_org_unit_ref,
+            org_unit_types=org_unit_types,
+            org_unit_types_ref=org_unit_types_ref,
+            org_unit_group=org_unit_group,
+            org_unit_group_ref=org_unit_group_ref,
+            field_names=field_names,
+        )
+        return list(diffs), field_names
+
+    def stream_diff(
+        self,
+        version_ref,
+        version,
+        ignore_groups=False,
+        show_deleted_org_units=False,
+        validation_status=None,
+        validation_status_ref=None,
+        top_org_unit=None,
+        top_org_unit_ref=None,
+        org_unit_types=None,
+        org_unit_types_ref=None,
+        org_unit_group=None,
+        org_unit_group_ref=None,
+        field_names=None,
+    ):
+        """
+        Same as `diff`, but return a generator of the diffs instead of a list. Diffs are ordered by `source_ref`.
+
+        Both pyramids are streamed as lightweight rows and compared in a merge join on `source_ref`, so memory
+        doesn't grow with the size of the pyramids. Org units are only loaded as model instances for the diffs, by
+        chunks of `DIFF_CHUNK_SIZE`.
+        """
         if field_names is None:
             field_names = ["name", "geometry", "parent", "opening_date", "closed_date", "code"]
         elif not isinstance(field_names, list):
             field_names = list(field_names)
 
-        orgunits_dhis2 = self.load_pyramid(
+        pyramid_dhis2 = self.filter_pyramid(
             version,
             validation_status=validation_status,
             top_org_unit=top_org_unit,
             org_unit_types=org_unit_types,
             org_unit_group=org_unit_group,
-            ignore_groups=ignore_groups,
         )
-        orgunit_refs = self.load_pyramid(
+        pyramid_ref = self.filter_pyramid(
             version_ref,
             validation_status=validation_status_ref,
             top_org_unit=top_org_unit_ref,
             org_unit_types=org_unit_types_ref,
             org_unit_group=org_unit_group_ref,
-            ignore_groups=ignore_groups,
         )
 
-        # Fetching IDs to restrict groups to the ones that are in the pyramid
-        orgunit_ids_in_ref_pyramid = set(orgunit_refs.values_list("id", flat=True))
-        orgunit_ids_in_dhis2_pyramid = set(orgunits_dhis2.values_list("id", flat=True))
-        org_unit_ids = orgunit_ids_in_dhis2_pyramid | orgunit_ids_in_ref_pyramid
-
+        groups_by_id = {}
         if not ignore_groups:
-            groups = Group.objects.filter(
-                Q(Q(source_version=version) | Q(source_version=version_ref)),
-                source_ref__isnull=False,
-                org_units__in=org_unit_ids,
-            ).distinct("source_ref")
-            for group in groups:
-                field_names.append("group:" + group.source_ref + ":" + group.name)
+            # Restrict groups to the ones that are in the pyramids
+            groups_by_id = self.load_groups(pyramid_dhis2, pyramid_ref)
+            group_field_names = {}
+            for group in groups_by_id.values():
+                if group["source_ref"] is not None and group["source_version_id"] in (version.id, version_ref.id):
+                    group_field_names.setdefault(
+                        group["source_ref"], "group:" + group["source_ref"] + ":" + group["name"]
+                    )
+            field_names.extend(group_field_names[source_ref] for source_ref in sorted(group_field_names))
 
         logger.info(f"will compare the following fields {field_names}")
         field_types = as_field_types(field_names)
+        with_geometry = "geometry" in field_names
 
-        logger.info(f"comparing {version_ref} ({len(orgunits_dhis2)}) and {version} ({len(orgunit_refs)})")
-        # speed how to index_by(&:source_ref)
-        diffs = []
+        logger.info(f"comparing {version_ref} and {version}")
+        rows_dhis2 = self.pyramid_rows(pyramid_dhis2, groups_by_id, ignore_groups, with_geometry)
+        rows_ref = self.pyramid_rows(pyramid_ref, groups_by_id, ignore_groups, with_geometry)
+        diffs = self._stream_diffs(
+            merge_pyramids(rows_dhis2, rows_ref), version, field_types, ignore_groups, show_deleted_org_units
+        )
+        return diffs, field_names
+
+    def _stream_diffs(self, merged_pyramids, version, field_types, ignore_groups, show_deleted_org_units):
+        pending = []
         index = 0
-        orgunits_dhis2_by_ref = index_pyramid(orgunits_dhis2)
-
-        for orgunit_ref in orgunit_refs:
-            index = index + 1
-            orgunit_dhis2_with_ref = orgunits_dhis2_by_ref.get(orgunit_ref.source_ref, [])
-            status = "same"
-            orgunit_dhis2 = None
-
-            if len(orgunit_dhis2_with_ref) > 0:
-                orgunit_dhis2 = orgunit_dhis2_with_ref[0]
-            else:
-                status = "new"
-
-            if index % 100 == 0:
-                logger.info(f"{index} will compare {orgunit_ref} vs {orgunit_dhis2} {memory_mb()}")
-
-            comparisons = self.compare_fields(orgunit_dhis2, orgunit_ref, field_types)
-            all_same = all(map(lambda comp: comp.status == self.STATUS_SAME, comparisons))
-            if status != self.STATUS_NEW and not all_same:
-                status = self.STATUS_MODIFIED
-            elif status != self.STATUS_NEW and all_same:
-                status = self.STATUS_SAME
-
-            if status != self.STATUS_SAME:
-                diff = Diff(
-                    orgunit_ref=orgunit_ref, orgunit_dhis2=orgunit_dhis2, status=status, comparisons=comparisons
-                )
-                diffs.append(diff)
-
-        if show_deleted_org_units:
-            target_set = set(orgunits_dhis2_by_ref.keys())
-            source_set = set([org_unit.source_ref for org_unit in orgunit_refs])
-            deleted_org_units_ids = target_set - source_set
-            for deleted_id in deleted_org_units_ids:
-                orgunit_dhis2 = orgunits_dhis2_by_ref.get(deleted_id)[0]
-                comparisons = []
-                for field in field_types:
-                    comparison = Comparison(
-                        before=field.access(orgunit_dhis2),
+        for source_ref, rows_dhis2, rows_ref in merged_pyramids:
+            if len(rows_dhis2) > 1:
+                logger.warning(f"two org units with the same source_ref: {source_ref} (this should not happen!)")
+            row_dhis2 = rows_dhis2[0] if rows_dhis2 else None
+
+            for row_ref in rows_ref:
+                index = index + 1
+                if index % 10000 == 0:
+                    logger.info(f"{index} compared, now at {source_ref} {memory_mb()}")
+
+                comparisons = self.compare_rows(row_dhis2, row_ref, field_types)
+                if row_dhis2 is None:
+                    status = self.STATUS_NEW
+                elif all(comp.status == self.STATUS_SAME for comp in comparisons):
+                    continue
+                else:
+                    status = self.STATUS_MODIFIED
+                pending.append((row_ref["id"], row_dhis2["id"] if row_dhis2 else None, status, comparisons, source_ref))
+
+            if show_deleted_org_units and row_dhis2 is not None and not rows_ref:
+                comparisons = [
+                    Comparison(
+                        before=field.access_row(row_dhis2),
                         after=None,
                         field=field.field_name,
                         status=self.STATUS_NOT_IN_ORIGIN,
                         distance=100,
                     )
-                    comparisons.append(comparison)
-                used_to_exist = OrgUnit.objects.filter(source_ref=deleted_id, version=version).count() > 0
-                status = self.STATUS_NOT_IN_ORIGIN if used_to_exist else self.STATUS_NEVER_SEEN
-                diff = Diff(orgunit_ref=None, orgunit_dhis2=orgunit_dhis2, status=status, comparisons=comparisons)
-                diffs.append(diff)
+                    for field in field_types
+                ]
+                # status is resolved in bulk when loading the org units
+                pending.append((None, row_dhis2["id"], None, comparisons, source_ref))
 
-        return diffs, field_names
+            if len(pending) >= DIFF_CHUNK_SIZE:
+                yield from self._load_diffs(pending, version, ignore_groups)
+                pending = []
 
-    def compare_fields(self, orgunit_dhis2, orgunit_ref, field_types):
-        comparisons = []
-
-        for field in field_types:
-            origin_value = field.access(orgunit_dhis2)
-            ref_value = field.access(orgunit_ref)
-
-            same = field.is_same(origin_value, ref_value)
-            if same:
-                status = self.STATUS_SAME
-            else:
-                status = self.STATUS_MODIFIED
-
-            if not origin_value and ref_value:
-                status = self.STATUS_NEW
-            if not same and origin_value is not None and (ref_value is None or ref_value == []):
-                status = self.STATUS_NOT_IN_ORIGIN
-
-            comparisons.append(
-                Comparison(
-                    before=origin_value,
-                    after=ref_value,
-                    field=field.field_name,
-                    status=status,
-                    distance=0 if same else field.distance(origin_value, ref_value),
+        yield from self._load_diffs(pending, version, ignore_groups)
+
+    def _load_diffs(self, pending, version, ignore_groups):
+        """Build the `Diff` of the pending comparisons, loading their org units in bulk"""
+        if not pending:
+            return
+        org_unit_ids = {org_unit_id for diff in pending for org_unit_id in diff[:2] if org_unit_id is not None}
+        queryset = OrgUnit.objects.select_related("parent", "org_unit_type")
+        if not ignore_groups:
+            queryset = queryset.prefetch_related("groups").prefetch_related("groups__group_sets")
+        org_units = queryset.in_bulk(org_unit_ids)
+
+        deleted_source_refs = [diff[4] for diff in pending if diff[0] is None and diff[4] is not None]
+        existing_source_refs = set()
+        if deleted_source_refs:
+            existing_source_refs = set(
+                OrgUnit.objects.filter(source_ref__in=deleted_source_refs, version=version).values_list(
+                    "source_ref", flat=True
                 )
             )
-        return comparisons
+
+        for org_unit_ref_id, org_unit_dhis2_id, status, comparisons, source_ref in pending:
+            if org_unit_ref_id is None:
+                used_to_exist = source_ref is None or source_ref in existing_source_refs
+                status = self.STATUS_NOT_IN_ORIGIN if used_to_exist else self.STATUS_NEVER_SEEN
+            yield Diff(
+                orgunit_ref=org_units.get(org_unit_ref_id),
+                orgunit_dhis2=org_units.get(org_unit_dhis2_id),
+                status=status,
+                comparisons=comparisons,
+            )
+
+    def compare_fields(self, orgunit_dhis2, orgunit_ref, field_types):
+        return [
+            self.compare_values(field, field.access(orgunit_dhis2), field.access(orgunit_ref)) for field in field_types
+        ]
+
+    def compare_rows(self, row_dhis2, row_ref, field_types):
+        return [
+            self.compare_values(field, field.access_row(row_dhis2), field.access_row(row_ref)) for field in field_types
+        ]
+
+    def compare_values(self, field, origin_value, ref_value):
+        same = field.is_same(origin_value, ref_value)
+        if same:
+            status = self.STATUS_SAME
+        else:
+            status = self.STATUS_MODIFIED
+
+        if not origin_value and ref_value:
+            status = self.STATUS_NEW
+        if not same and origin_value is not None and (ref_value is None or ref_value == []):
+            status = self.STATUS_NOT_IN_ORIGIN
+
+        return Comparison(
+            before=origin_value,
+            after=ref_value,
+            field=field.field_name,
+            status=status,
+            distance=0 if same else field.distance(origin_value, ref_value),
+        )
@@ -1,10 +1,18 @@
 import os
+import shutil
+import tempfile
+import threading
 import time
+import uuid
+import zipfile
 
+from dataclasses import dataclass
 from logging import getLogger
+from typing import Optional, Sequence
 
 import duckdb
 
+from django.conf import settings
 from django.db import connection
 from django.db.models import QuerySet
 
@@ -12,54 +20,147 @@ from django.db.models import QuerySet
 logger = getLogger(__name__)
 
 
-def export_django_query_to_parquet_via_duckdb(qs: QuerySet, output_file_path: str, mapping=None):
-    start = time.perf_counter()
-
-    sql, params = qs.query.sql_with_params()
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT 1")  # ensure cursor is open
-        full_sql = cursor.mogrify(sql, params).decode()
-    # initially was full_sql = sql % tuple(map(adapt_param, params)) but supporting all types is complicated
-    dsn = connection.get_connection_params()
-
-    tmpdir = "/tmp/duckdb_tmp"
-    os.makedirs(tmpdir, exist_ok=True)
-
-    with duckdb.connect() as duckdb_connection:
-        duckdb_connection.execute(f"PRAGMA temp_directory='{tmpdir}'")
-        duckdb_connection.execute(
-            "PRAGMA memory_limit='1500MB'"
-        )  # reasonable but should work even if you don't have that memory available
+@dataclass
+class ExportStats:
+    row_count: int
+    column_count: int
+    duration: float
+
+
+class DuckDBExportEngine:
+    """
+    Export Django querysets to parquet files through DuckDB, reading Postgres with the `postgres` extension.
+
+    One engine is kept per process (see `get_duckdb_export_engine`): the DuckDB database is configured and the
+    extension installed and loaded only once. Each export then runs in its own cursor, attaching Postgres for the
+    duration of the export only, so that no connection to Postgres is left open between exports.
+
+    Memory, threads and row group size come from the `PARQUET_EXPORT_*` settings.
+    """
+
+    def __init__(self, memory_limit: str, threads: int, row_group_size: int, temp_directory: str):
+        self.memory_limit = memory_limit
+        self.threads = threads
+        self.row_group_size = row_group_size
+        self.temp_directory = temp_directory
+        self.pid = os.getpid()
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        with self._lock:
+            if self._connection is None:
+                os.makedirs(self.temp_directory, exist_ok=True)
+                duckdb_connection = duckdb.connect()
+                duckdb_connection.execute(f"PRAGMA temp_directory='{self.temp_directory}'")
+                # reasonable but should work even if you don't have that memory available
+                duckdb_connection.execute(f"PRAGMA memory_limit='{self.memory_limit}'")
+                if self.threads:
+                    duckdb_connection.execute(f"PRAGMA threads={int(self.threads)}")
+                duckdb_connection.execute("INSTALL postgres; LOAD postgres;")
+                self._connection = duckdb_connection
+            return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def export(
+        self, qs: QuerySet, output_path: str, mapping=None, partition_by: Optional[Sequence[str]] = None
+    ) -> ExportStats:
+        """
+        Export `qs` to parquet in `output_path`.
 
-        attach_sql = f"""
-            INSTALL postgres;
-            LOAD postgres;
-            ATTACH 'dbname={dsn["dbname"]} host={dsn["host"]} user={dsn["user"]} password={dsn["password"]} port={dsn["port"]}' AS pg (TYPE postgres, READ_ONLY);
+        :param mapping: optional {output column name: queryset column name} used to rename the columns
+        :param partition_by: optional output column names, when given `output_path` is a directory which will
+                             contain one hive partitioned sub directory per value (e.g. `org_unit_type_id=12/`)
         """
-        duckdb_connection.execute(attach_sql)
+        start = time.perf_counter()
+
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")  # ensure cursor is open
+            full_sql = cursor.mogrify(sql, params).decode()
+        # initially was full_sql = sql % tuple(map(adapt_param, params)) but supporting all types is complicated
 
-        logger.info(f"exporting parquet : {output_file_path} \n\n {full_sql}")
-        # had to specify ROW_GROUP_SIZE when exporting large rows like several geojson on the same row
         alias_stmt = " * "
         if mapping:
             alias_stmt = dict_to_projection(mapping)
+        # cursors share the attached databases, so each export needs its own alias
+        alias = f"pg_{uuid.uuid4().hex}"
+        select_sql = f"SELECT {alias_stmt} FROM postgres_query('{alias}', $$ {full_sql} $$)"
 
-        parquet_export_sql = f"""
-            COPY (
-                SELECT {alias_stmt} FROM postgres_query('pg', $$ {full_sql} $$)
-            ) TO '{output_file_path}' (FORMAT PARQUET, COMPRESSION 'ZSTD', ROW_GROUP_SIZE 10000)
-        """
-
-        duckdb_connection.execute(parquet_export_sql)
-
-        row_count = duckdb_connection.execute(f"SELECT COUNT(*) FROM '{output_file_path}'").fetchone()[0]
-        col_count = len(duckdb_connection.execute(f"DESCRIBE SELECT * FROM '{output_file_path}'").fetchall())
-
-    duration = time.perf_counter() - start
-    size_mb = os.path.getsize(output_file_path) / (1024 * 1024)
-    logger.warning(
-        f"dumped to {output_file_path} took {duration:.3f} seconds for {row_count} records and {col_count} columns, final file size {size_mb:.2f} Mb"
-    )
+        # had to specify ROW_GROUP_SIZE when exporting large rows like several geojson on the same row
+        copy_options = f"FORMAT PARQUET, COMPRESSION 'ZSTD', ROW_GROUP_SIZE {int(self.row_group_size)}"
+        if partition_by:
+            copy_options += ", PARTITION_BY ({}), OVERWRITE_OR_IGNORE".format(
+                ", ".join(f'"{column}"' for column in partition_by)
+            )
+
+        logger.info(f"exporting parquet : {output_path} \n\n {full_sql}")
+        dsn = connection.get_connection_params()
+        with self._get_connection().cursor() as duckdb_cursor:
+            duckdb_cursor.execute(
+                f"ATTACH 'dbname={dsn['dbname']} host={dsn['host']} user={dsn['user']} password={dsn['password']} port={dsn['port']}' AS {alias} (TYPE postgres, READ_ONLY)"
+            )
+            try:
+                # binding the relation gives the columns without running the query
+                column_count = len(duckdb_cursor.sql(select_sql).columns)
+                # COPY returns the number of rows written, no need to read the file again
+                copy_sql = f"COPY ({select_sql}) TO '{output_path}' ({copy_options})"
+                row_count = duckdb_cursor.execute(copy_sql).fetchone()[0]
+            finally:
+                duckdb_cursor.execute(f"DETACH {alias}")
+
+        duration = time.perf_counter() - start
+        logger.warning(
+            f"dumped to {output_path} took {duration:.3f} seconds for {row_count} records and {column_count} columns"
+        )
+        return ExportStats(row_count=row_count, column_count=column_count, duration=duration)
+
+
+_engine: Optional[DuckDBExportEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_duckdb_export_engine() -> DuckDBExportEngine:
+    """Return the export engine of the current process (a new one is created after a fork)."""
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.pid != os.getpid():
+            _engine = DuckDBExportEngine(
+                memory_limit=settings.PARQUET_EXPORT_MEMORY_LIMIT,
+                threads=settings.PARQUET_EXPORT_THREADS,
+                row_group_size=settings.PARQUET_EXPORT_ROW_GROUP_SIZE,
+                temp_directory=settings.PARQUET_EXPORT_TEMP_DIRECTORY,
+            )
+        return _engine
+
+
+def export_django_query_to_parquet_via_duckdb(
+    qs: QuerySet, output_file_path: str, mapping=None, partition_by: Optional[Sequence[str]] = None
+) -> ExportStats:
+    return get_duckdb_export_engine().export(qs, output_file_path, mapping, partition_by)
+
+
+def export_django_query_to_partitioned_parquet_zip(
+    qs: QuerySet, output_file_path: str, partition_by: Sequence[str], mapping=None
+) -> ExportStats:
+    """Export to a hive partitioned parquet dataset, packed in the zip file `output_file_path`."""
+    output_dir = tempfile.mkdtemp(suffix="_parquet")
+    try:
+        stats = export_django_query_to_parquet_via_duckdb(qs, output_dir, mapping, partition_by)
+        # parquet files are already compressed
+        with zipfile.ZipFile(output_file_path, "w", zipfile.ZIP_STORED) as zipf:
+            for root, _dirs, files in os.walk(output_dir):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    zipf.write(file_path, os.path.relpath(file_path, output_dir))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return stats
 
 
 def dict_to_projection(mapping):
@@ -1,6 +1,11 @@
-from .duckdb_util import export_django_query_to_parquet_via_duckdb
+from .duckdb_util import export_django_query_to_parquet_via_duckdb, export_django_query_to_partitioned_parquet_zip
 from .pyramid import build_pyramid_queryset
 from .submissions import build_submissions_queryset
 
 
-__all__ = ["build_pyramid_queryset", "build_submissions_queryset", "export_django_query_to_parquet_via_duckdb"]
+__all__ = [
+    "build_pyramid_queryset",
+    "build_submissions_queryset",
+    "export_django_query_to_parquet_via_duckdb",
+    "export_django_query_to_partitioned_parquet_zip",
+]
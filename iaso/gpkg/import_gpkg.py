@@ -11,6 +11,7 @@ from django.contrib.auth.models import User
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 
 from hat.audit import models as audit_models
 from iaso.models import DataSource, Group, OrgUnit, OrgUnitType, SourceVersion, Task
@@ -65,6 +66,24 @@ class OrgUnitData(TypedDict):
 OLD_INTERNAL_REF = "iaso#"
 NEW_INTERNAL_REF = "iaso:"
 
+# number of rows inserted or updated by query
+BULK_BATCH_SIZE = 2000
+# fields set from the gpkg on existing org units (path, parent and updated_at are handled separately)
+IMPORTED_ORG_UNIT_FIELDS = [
+    "name",
+    "org_unit_type",
+    "validation_status",
+    "source_ref",
+    "version",
+    "code",
+    "closed_date",
+    "opening_date",
+    "location",
+    "geom",
+    "simplified_geom",
+    "extra_fields",
+]
+
 
 def convert_to_geography(geom_type: str, coordinates: list):
     """Convert a geography dict from gpkg/fiona to a geodjango.Geom
@@ -133,13 +152,18 @@ def create_or_update_orgunit(
     validation_status: str,
     ref_group: Dict[str, Group],
     task=None,
+    save: bool = True,
 ) -> OrgUnit:
+    """Create or update the org unit from a gpkg row.
+
+    With `save=False`, neither the org unit nor its groups are saved, see `import_gpkg_file2`.
+    """
     props = data["properties"]
     geometry = data["geometry"]
 
     if not orgunit:
         orgunit = OrgUnit()
-    else:
+    elif orgunit.pk is not None:
         # Make a copy, so we can do the audit log, otherwise we would edit in place
         orgunit = deepcopy(orgunit)
 
@@ -174,30 +198,106 @@ def create_or_update_orgunit(
             orgunit.geom = geom
             orgunit.simplified_geom = simplify_geom(geom)
 
+    if not save:
+        orgunit.clean()
+        return orgunit
+
     orgunit.save(skip_calculate_path=True)
 
-    if "group_refs" not in props:
+    groups = get_orgunit_groups(props, orgunit, ref_group)
+    if groups is None:
         # the column is not here we don't touch the group
         pass
-    elif not props["group_refs"]:
-        # if it's an empty string or null we will remove all groups presumably
-        # I previously wanted to differentiate the case of empty str vs null but QGIS don't show the difference
-        #  in the ui so it's perilous
+    elif not groups:
         if orgunit is not None and orgunit.id is not None:
             orgunit.groups.clear()
-    elif props["group_refs"]:
-        group_refs = props["group_refs"].split(",")
-        group_refs = [ref.strip().replace(OLD_INTERNAL_REF, NEW_INTERNAL_REF) for ref in group_refs]
-
-        try:
-            groups = [ref_group[ref] for ref in group_refs if ref]
-        except KeyError:
-            raise ValueError(f"Bad GPKG group {group_refs} for {orgunit} don't exist in input or SourceVersion")
+    else:
         orgunit.groups.set(groups)
 
     return orgunit
 
 
+def get_orgunit_groups(props: Dict[str, str], orgunit: OrgUnit, ref_group: Dict[str, Group]) -> Optional[List[Group]]:
+    """Return the groups of the org unit according to the `group_refs` column, None if there is no such column."""
+    if "group_refs" not in props:
+        return None
+    if not props["group_refs"]:
+        # if it's an empty string or null we will remove all groups presumably
+        # I previously wanted to differentiate the case of empty str vs null but QGIS don't show the difference
+        #  in the ui so it's perilous
+        return []
+
+    group_refs = props["group_refs"].split(",")
+    group_refs = [ref.strip().replace(OLD_INTERNAL_REF, NEW_INTERNAL_REF) for ref in group_refs]
+
+    try:
+        return [ref_group[ref] for ref in group_refs if ref]
+    except KeyError:
+        raise ValueError(f"Bad GPKG group {group_refs} for {orgunit} don't exist in input or SourceVersion")
+
+
+def set_orgunits_groups(orgunits_groups: Dict[int, List[Group]]):
+    """Same as calling `orgunit.groups.set(groups)` for each org unit id, but with bulk queries."""
+    through = OrgUnit.groups.through
+    orgunit_ids = list(orgunits_groups.keys())
+    for i in range(0, len(orgunit_ids), BULK_BATCH_SIZE):
+        through.objects.filter(orgunit_id__in=orgunit_ids[i : i + BULK_BATCH_SIZE]).delete()
+    memberships = [
+        through(orgunit_id=orgunit_id, group_id=group_id)
+        for orgunit_id, groups in orgunits_groups.items()
+        for group_id in {group.pk for group in groups}
+    ]
+    through.objects.bulk_create(memberships, batch_size=BULK_BATCH_SIZE)
+
+
+def calculate_paths_in_memory(orgunits: List[OrgUnit]) -> List[OrgUnit]:
+    """Set the path of the org units from their parent, top-down, without querying them one by one.
+
+    Like `OrgUnit.calculate_paths`, org units having a parent without a path are skipped, as are cycles.
+    Returns the org units whose path changed, they still need to be saved.
+    """
+    orgunits_by_id = {orgunit.pk: orgunit for orgunit in orgunits}
+    outside_parent_ids = {
+        orgunit.parent_id
+        for orgunit in orgunits
+        if orgunit.parent_id is not None and orgunit.parent_id not in orgunits_by_id
+    }
+    outside_paths = dict(OrgUnit.objects.filter(id__in=outside_parent_ids).values_list("id", "path"))
+
+    paths: Dict[int, Optional[List[str]]] = {}
+    updated_orgunits = []
+    for orgunit in orgunits:
+        # go up until an org unit whose path is known, keeping the chain of ancestors to compute
+        chain: List[OrgUnit] = []
+        current = orgunit
+        while True:
+            if current.pk in paths:
+                base_path = paths[current.pk]
+                break
+            if current in chain:
+                base_path = None
+                break
+            chain.append(current)
+            if current.parent_id is None:
+                base_path = []
+                break
+            if current.parent_id not in orgunits_by_id:
+                parent_path = outside_paths.get(current.parent_id)
+                base_path = list(parent_path) if parent_path is not None else None
+                break
+            current = orgunits_by_id[current.parent_id]
+
+        for ancestor in reversed(chain):
+            if base_path is not None:
+                base_path = [*base_path, str(ancestor.pk)]
+                if base_path != ancestor.path:
+                    ancestor.path = base_path
+                    updated_orgunits.append(ancestor)
+            paths[ancestor.pk] = base_path
+
+    return updated_orgunits
+
+
 def get_ref(inst: Union[OrgUnit, Group]) -> str:
     """We make an artificial ref in case there is none so the gpkg can still refer existing record in iaso, even if
     they don't have a ref
@@ -338,7 +438,7 @@ def import_gpkg_file2(
     # index all existing OrgUnit per ref
     if task:
         task.report_progress_and_stop_if_killed(progress_message="Retrieving existing OUs' references...")
-    existing_orgunits = version.orgunit_set.all()  # Maybe add a only?
+    existing_orgunits = list(version.orgunit_set.all())  # Maybe add a only?
     ref_ou: Dict[str, OrgUnit] = {}
     for ou in existing_orgunits:
         ref = get_ref(ou)
@@ -351,6 +451,10 @@ def import_gpkg_file2(
     # The child may be created before the parent, so we keep a list to update after creating them all
     to_update_with_parent: List[Tuple[str, str]] = []
     modifications_to_log: List[Tuple[Optional[OrgUnit], OrgUnit]] = []
+    # org units are only written at the end, in bulk
+    to_create: List[OrgUnit] = []
+    to_update: Dict[int, OrgUnit] = {}
+    groups_to_set: List[Tuple[OrgUnit, List[Group]]] = []
     total_org_unit = 0
 
     # Layer are OrgUnit's Type
@@ -383,7 +487,20 @@ def import_gpkg_file2(
                 ref = ref.replace(OLD_INTERNAL_REF, NEW_INTERNAL_REF)
 
             existing_ou = ref_ou.get(ref)
-            orgunit = create_or_update_orgunit(existing_ou, row, version, validation_status, ref_group, task)
+            # an org unit appearing twice in the gpkg and not created yet is updated in place
+            already_pending = existing_ou is not None and existing_ou.pk is None
+            orgunit = create_or_update_orgunit(
+                existing_ou, row, version, validation_status, ref_group, task, save=False
+            )
+            if orgunit.pk is None:
+                if not already_pending:
+                    to_create.append(orgunit)
+            else:
+                to_update[orgunit.pk] = orgunit
+
+            groups = get_orgunit_groups(row["properties"], orgunit, ref_group)
+            if groups is not None:
+                groups_to_set.append((orgunit, groups))
 
             if task and total_org_unit % 500 == 0:
                 task.report_progress_and_stop_if_killed(
@@ -402,30 +519,56 @@ def import_gpkg_file2(
 
             to_update_with_parent.append((ref, parent_ref))
             # we will log the modification after we set the parent
-            if orgunit.location is not None or orgunit.geom is not None:
+            if (orgunit.location is not None or orgunit.geom is not None) and not already_pending:
                 modifications_to_log.append((existing_ou, orgunit))
 
             total_org_unit += 1
+
+    if task:
+        task.report_progress_and_stop_if_killed(
+            progress_message=f"creating org units : to_create : {len(to_create)} to_update : {len(to_update)}"
+        )
+    OrgUnit.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+    # the last row of an org unit wins, like successive `groups.set()`
+    set_orgunits_groups({orgunit.pk: groups for orgunit, groups in groups_to_set})
+
     if task:
         task.report_progress_and_stop_if_killed(
             progress_value=80,
             progress_message=f"processing parents : total_org_unit : {total_org_unit} to_update_with_parent : {len(to_update_with_parent)}",
         )
-    parent_count = 0
     for ref, parent_ref in to_update_with_parent:
-        parent_count += 1
         ou = ref_ou[ref]
         if parent_ref and parent_ref not in ref_ou:
             raise ValueError(f"Bad GPKG parent {parent_ref} for {ou} don't exist in input or SourceVersion")
 
-        if task and parent_count % 1000 == 0:
-            task.report_progress_and_stop_if_killed(
-                progress_message=f"processing parent : parent_count : #{parent_count}"
-            )
         parent_ou = ref_ou[parent_ref] if parent_ref else None
         ou.parent = parent_ou
         ou.source_ref = ou.source_ref.replace(OLD_INTERNAL_REF, NEW_INTERNAL_REF)
-        ou.save()
+
+    # the imported org units replace the existing ones with the same id
+    orgunits_by_id = {ou.pk: ou for ou in existing_orgunits}
+    orgunits_by_id.update({ou.pk: ou for ou in ref_ou.values()})
+    orgunits_by_id.update(to_update)
+    updated_paths = calculate_paths_in_memory(list(orgunits_by_id.values()))
+
+    if task:
+        task.report_progress_and_stop_if_killed(
+            progress_message=f"saving org units : total_org_unit : {total_org_unit} updated paths : {len(updated_paths)}"
+        )
+    now = timezone.now()
+    for ou in to_update.values():
+        ou.updated_at = now
+    OrgUnit.objects.bulk_update(
+        to_update.values(), IMPORTED_ORG_UNIT_FIELDS + ["parent", "path", "updated_at"], batch_size=BULK_BATCH_SIZE
+    )
+    OrgUnit.objects.bulk_update(to_create, ["parent", "source_ref", "path"], batch_size=BULK_BATCH_SIZE)
+    imported_ids = {ou.pk for ou in to_create} | to_update.keys()
+    # the descendants are moved with the imported org units, like in `OrgUnit.save`
+    moved_descendants = [ou for ou in updated_paths if ou.pk not in imported_ids]
+    for ou in moved_descendants:
+        ou.updated_at = now
+    OrgUnit.objects.bulk_update(moved_descendants, ["path", "updated_at"], batch_size=BULK_BATCH_SIZE)
 
     recalculate_missing_paths_if_necessary(version, task)
 
@@ -433,9 +576,13 @@ def import_gpkg_file2(
         task.report_progress_and_stop_if_killed(
             progress_message=f"storing log_modifications total_org_unit : {total_org_unit}"
         )
-    for old_ou, new_ou in modifications_to_log:
-        # Possible optimisation, crate a bulk update
-        audit_models.log_modification(old_ou, new_ou, source=audit_models.GPKG_IMPORT, user=user)
+    audit_models.log_modifications_in_bulk(
+        modifications_to_log,
+        source=audit_models.GPKG_IMPORT,
+        user=user,
+        batch_size=BULK_BATCH_SIZE,
+        simplify_geometries=True,
+    )
     return total_org_unit
 
 
@@ -0,0 +1,120 @@
+"""
+Benchmark the Levenshtein deduplication with blocking keys against the exhaustive comparison of all the pairs.
+
+    docker compose exec iaso ./manage.py benchmark_deduplication \
+        --entity-type-id=12 --fields=first_name,last_name,age__int__ --seed=20000
+
+Both runs compute the potential duplicates without saving them. The recall is the share of the pairs found by the
+exhaustive run that are also found with blocking. The exhaustive run is quadratic, use `--skip-exhaustive` to only time
+the blocking on large registries.
+
+With `--seed`, entities with random answers are created in the entity type before running the benchmark, a share of
+them (`--duplicates-ratio`) being copies of a previous entity with a typo. Everything happens in a transaction which is
+rolled back at the end.
+"""
+
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from iaso.api.deduplication.algos.levenshtein import LevenshteinAlgorithm
+from iaso.api.workflows.serializers import find_question_by_name
+from iaso.models import Entity, EntityType, Instance
+from iaso.models.instances import InMemoryTask
+from iaso.tasks.run_deduplication_algo import get_deduplication_aglo_default_parameters
+
+
+NAMES = ["amina", "fatou", "moussa", "ibrahim", "aissatou", "mamadou", "mariam", "oumar", "kadiatou", "awa", "seydou"]
+NUMBER_SUFFIXES = ("__int__", "__integer__", "__long__", "__decimal__", "__double__")
+
+
+def with_typo(value):
+    if not value:
+        return value
+    position = random.randrange(len(value))
+    return value[:position] + random.choice(string.ascii_lowercase) + value[position + 1 :]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the recall and throughput of the deduplication blocking against the exhaustive run"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entity-type-id", type=int, required=True)
+        parser.add_argument("--fields", type=str, required=True, help="comma separated names of the compared fields")
+        parser.add_argument("--seed", type=int, default=0, help="number of entities to create before the benchmark")
+        parser.add_argument("--duplicates-ratio", type=float, default=0.1)
+        parser.add_argument("--max-block-size", type=int, default=None)
+        parser.add_argument("--org-unit-depth", type=int, default=None)
+        parser.add_argument("--skip-exhaustive", action="store_true")
+
+    def handle(self, *args, **options):
+        entity_type = EntityType.objects.select_related("reference_form").get(id=options["entity_type_id"])
+        possible_fields = entity_type.reference_form.possible_fields
+        fields = [find_question_by_name(name, possible_fields) for name in options["fields"].split(",")]
+
+        parameters = get_deduplication_aglo_default_parameters("levenshtein")
+        blocking_parameters = {"blocking": True}
+        if options["max_block_size"]:
+            blocking_parameters["blocking_max_block_size"] = options["max_block_size"]
+        if options["org_unit_depth"]:
+            blocking_parameters["blocking_org_unit_depth"] = options["org_unit_depth"]
+
+        with transaction.atomic():
+            if options["seed"]:
+                self.seed(entity_type, fields, options["seed"], options["duplicates_ratio"])
+            entities_count = Entity.objects.filter(entity_type=entity_type).count()
+
+            runs = [("blocking", parameters | blocking_parameters)]
+            if not options["skip_exhaustive"]:
+                runs.insert(0, ("exhaustive", parameters))
+
+            pairs = {}
+            for name, run_parameters in runs:
+                params = {"entity_type_id": entity_type.id, "fields": fields, "parameters": run_parameters}
+                start = time.perf_counter()
+                potential_duplicates = LevenshteinAlgorithm().find_potential_duplicates(params, InMemoryTask())
+                duration = time.perf_counter() - start
+                pairs[name] = {(d["entity1_id"], d["entity2_id"]) for d in potential_duplicates}
+                self.stdout.write(
+                    f"{name}: {entities_count} entities, {len(pairs[name])} potential duplicates, "
+                    f"{duration:.2f}s, {entities_count / duration:.0f} entities/s"
+                )
+
+            if "exhaustive" in pairs:
+                found = len(pairs["exhaustive"] & pairs["blocking"])
+                recall = found / len(pairs["exhaustive"]) if pairs["exhaustive"] else 1
+                self.stdout.write(f"recall: {recall:.3f} ({found}/{len(pairs['exhaustive'])})")
+
+            transaction.set_rollback(True)
+
+    def seed(self, entity_type, fields, count, duplicates_ratio):
+        self.stdout.write(f"Creating {count} entities in {entity_type}...")
+        answers = []
+        for _ in range(count):
+            if answers and random.random() < duplicates_ratio:
+                answer = dict(random.choice(answers))
+                typo_field = random.choice(fields)["name"]
+                if isinstance(answer.get(typo_field), str) and not answer[typo_field].isdigit():
+                    answer[typo_field] = with_typo(answer[typo_field])
+            else:
+                answer = {}
+                for field in fields:
+                    if field["type"] in ["number", "integer", "decimal"] or field["name"].endswith(NUMBER_SUFFIXES):
+                        answer[field["name"]] = str(random.randint(0, 99))
+                    else:
+                        answer[field["name"]] = random.choice(NAMES) + random.choice(NAMES)[: random.randint(0, 4)]
+            answers.append(answer)
+
+        instances = Instance.objects.bulk_create(
+            [Instance(form=entity_type.reference_form, json=answer) for answer in answers], batch_size=5000
+        )
+        Entity.objects.bulk_create(
+            [
+                Entity(entity_type=entity_type, attributes=instance, account=entity_type.account)
+                for instance in instances
+            ],
+            batch_size=5000,
+        )
@@ -0,0 +1,108 @@
+"""
+Benchmark the CSV import of metric values (`ImportMetricValuesSerializer`).
+
+    docker compose exec iaso ./manage.py benchmark_metric_values_import \
+        --username="testemailstable-2-41-5" --org-units=10000 --metric-types=50
+
+Org units with a location and metric types are created in the account of the user, then a CSV with a value for each
+of them is imported `--runs` times (the second run replaces the values of the first one). Everything happens in a
+transaction which is rolled back at the end.
+"""
+
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Point
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from iaso.api.metrics.serializers import ImportMetricValuesSerializer
+from iaso.models import MetricType, MetricValue, OrgUnit, OrgUnitType
+
+
+class Command(BaseCommand):
+    help = "Benchmark the CSV import of metric values"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", type=str, help="user to use to import the values", required=True)
+        parser.add_argument("--org-units", type=int, help="number of org units (rows) in the CSV", default=10000)
+        parser.add_argument("--metric-types", type=int, help="number of metric types (columns) in the CSV", default=50)
+        parser.add_argument("--runs", type=int, help="number of imports", default=3)
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.get(username=options["username"])
+        request = APIRequestFactory().post("/api/metricvalues/import_from_csv/")
+        request.user = user
+
+        with transaction.atomic():
+            org_unit_ids = self.seed_org_units(user, options["org_units"])
+            codes = self.seed_metric_types(user, options["metric_types"])
+            csv_content = self.build_csv(org_unit_ids, codes)
+            self.stdout.write(f"CSV of {len(org_unit_ids)} rows x {len(codes)} metric types: {len(csv_content)} bytes")
+
+            for run in range(options["runs"]):
+                start = time.perf_counter()
+                serializer = ImportMetricValuesSerializer(
+                    data={"file": SimpleUploadedFile("benchmark.csv", csv_content), "year": 2024},
+                    context={"request": request},
+                )
+                serializer.is_valid(raise_exception=True)
+                validated = time.perf_counter()
+                metric_values = serializer.save()
+                saved = time.perf_counter()
+                self.stdout.write(
+                    f"run {run + 1}: {len(metric_values)} values, validation {validated - start:.3f}s, "
+                    f"save {saved - validated:.3f}s, total {saved - start:.3f}s"
+                )
+
+            self.stdout.write(f"{MetricValue.objects.filter(metric_type__code__in=codes).count()} values in the table")
+            transaction.set_rollback(True)
+
+    def seed_org_units(self, user, count):
+        version = user.iaso_profile.account.default_version
+        if version is None:
+            raise CommandError("The account of the user needs a default version to seed org units")
+
+        org_unit_type = OrgUnitType.objects.create(name="benchmark_metric_values_import", short_name="bench")
+        self.stdout.write(f"Creating {count} org units in {version}...")
+        org_units = OrgUnit.objects.bulk_create(
+            [
+                OrgUnit(
+                    name=f"Benchmark {i}",
+                    version=version,
+                    org_unit_type=org_unit_type,
+                    validation_status=OrgUnit.VALIDATION_VALID,
+                    location=Point((i % 1000) / 100, (i // 1000) / 100, 0),
+                )
+                for i in range(count)
+            ],
+            batch_size=5000,
+        )
+        return [org_unit.id for org_unit in org_units]
+
+    def seed_metric_types(self, user, count):
+        account = user.iaso_profile.account
+        metric_types = MetricType.objects.bulk_create(
+            [
+                MetricType(
+                    account=account,
+                    code=f"BENCH_{i}",
+                    name=f"Benchmark {i}",
+                    category="Benchmark",
+                    legend_type=MetricType.LegendType.LINEAR,
+                    legend_config={"domain": [0, 1000], "range": ["#A2CAEA", "#ACDF9B"]},
+                )
+                for i in range(count)
+            ]
+        )
+        return [metric_type.code for metric_type in metric_types]
+
+    def build_csv(self, org_unit_ids, codes):
+        lines = [",".join(["ADM1_NAME", "ADM2_NAME", "ADM2_ID", *codes])]
+        for org_unit_id in org_unit_ids:
+            values = [str(round(random.uniform(0, 1000), 2)) for _ in codes]
+            lines.append(",".join(["Region", f"Benchmark {org_unit_id}", str(org_unit_id), *values]))
+        return "\n".join(lines).encode()
@@ -0,0 +1,88 @@
+"""
+Benchmark the map layer response of the org units API (`/api/orgunits/?asLocation=true&limit=...`).
+
+    docker compose exec iaso ./manage.py benchmark_org_units_as_location \
+        --username="testemailstable-2-41-5" --page-sizes=1000,10000,50000 --seed=50000
+
+With `--seed`, org units with a shape and a location are created in the default version of the user's account before
+running the benchmark. Everything happens in a transaction which is rolled back at the end.
+"""
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import MultiPolygon, Point, Polygon
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from iaso.api.org_units import OrgUnitViewSet
+from iaso.models import OrgUnit, OrgUnitType
+
+
+class Command(BaseCommand):
+    help = "Benchmark the asLocation response of the org units API for several page sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", type=str, help="user to use to call the api", required=True)
+        parser.add_argument("--page-sizes", type=str, help="comma separated page sizes", default="1000,10000,50000")
+        parser.add_argument("--seed", type=int, help="number of org units to create before the benchmark", default=0)
+        parser.add_argument("--runs", type=int, help="number of runs per page size", default=3)
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.get(username=options["username"])
+        page_sizes = [int(size) for size in options["page_sizes"].split(",")]
+
+        with transaction.atomic():
+            if options["seed"]:
+                self.seed(user, options["seed"])
+
+            for page_size in page_sizes:
+                durations = []
+                for _ in range(options["runs"]):
+                    duration, queries_count, results_count = self.run_once(user, page_size)
+                    durations.append(duration)
+                self.stdout.write(
+                    f"limit={page_size}: {results_count} org units, {queries_count} queries, "
+                    f"best {min(durations):.3f}s, avg {sum(durations) / len(durations):.3f}s"
+                )
+
+            transaction.set_rollback(True)
+
+    def run_once(self, user, page_size):
+        request = APIRequestFactory().get("/api/orgunits/", {"asLocation": "true", "limit": page_size})
+        request.user = user
+        view = OrgUnitViewSet.as_view({"get": "list"})
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            duration = time.perf_counter() - start
+
+        return duration, len(queries.captured_queries), len(response.data)
+
+    def seed(self, user, count):
+        version = user.iaso_profile.account.default_version
+        if version is None:
+            raise CommandError("The account of the user needs a default version to seed org units")
+
+        org_unit_type = OrgUnitType.objects.create(name="benchmark_org_units_as_location", short_name="bench")
+        org_unit_type.projects.set(version.data_source.projects.all())
+        self.stdout.write(f"Creating {count} org units in {version}...")
+        org_units = []
+        for i in range(count):
+            x, y = (i % 1000) / 100, (i // 1000) / 100
+            shape = MultiPolygon(Polygon([[x, y], [x + 0.01, y], [x + 0.01, y + 0.01], [x, y]]))
+            org_units.append(
+                OrgUnit(
+                    name=f"Benchmark {i}",
+                    version=version,
+                    org_unit_type=org_unit_type,
+                    validation_status=OrgUnit.VALIDATION_VALID,
+                    simplified_geom=shape,
+                    location=Point(x, y, 0),
+                )
+            )
+        OrgUnit.objects.bulk_create(org_units, batch_size=5000)
@@ -0,0 +1,93 @@
+"""
+Benchmark the conversion of submission XML files to JSON, BeautifulSoup (`flat_parse_xml_soup`) against the streaming
+parser (`flat_parse_xml`).
+
+    docker compose exec iaso ./manage.py benchmark_xml_to_json --repeats=10,100,1000 --questions=50
+
+Submissions are generated with `--questions` top level answers and a repeat group of `--repeats` entries, each entry
+having 10 answers. Real submissions can be benchmarked as well with `--file` (without repeat groups and filtering).
+Nothing is written to the database.
+"""
+
+import time
+
+from io import StringIO
+
+from bs4 import BeautifulSoup as Soup  # type: ignore
+from django.core.management.base import BaseCommand
+
+from iaso.utils import flat_parse_xml, flat_parse_xml_soup
+from iaso.utils.emoji import fix_emoji
+
+
+REPEAT_GROUP = "household"
+REPEAT_QUESTIONS = 10
+
+
+def generate_submission(questions_count, repeats_count):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<data id="benchmark" version="2024010101">']
+    for i in range(questions_count):
+        lines.append(f"<group_{i % 5}><question_{i}>answer {i} &amp; é</question_{i}></group_{i % 5}>")
+    for r in range(repeats_count):
+        answers = "".join(f"<member_{q}>{r}-{q}</member_{q}>" for q in range(REPEAT_QUESTIONS))
+        lines.append(f"<{REPEAT_GROUP}><details>{answers}</details></{REPEAT_GROUP}>")
+    lines.append("<meta><instanceID>uuid:00000000-0000-0000-0000-000000000000</instanceID></meta>")
+    lines.append("</data>")
+    return "\n".join(lines).encode("utf-8")
+
+
+def allowed_paths_for(questions_count):
+    allowed_paths = {"meta", "meta/instanceID"}
+    for i in range(questions_count):
+        allowed_paths.update([f"group_{i % 5}", f"group_{i % 5}/question_{i}"])
+    allowed_paths.update(f"details/member_{q}" for q in range(REPEAT_QUESTIONS))
+    return allowed_paths
+
+
+def parse_with_soup(raw_content, repeat_groups, allowed_paths):
+    fixed_content = fix_emoji(raw_content.decode("utf-8")).decode("utf-8")
+    soup = Soup(StringIO(fixed_content), "lxml-xml", from_encoding="utf-8")
+    return flat_parse_xml_soup(soup, repeat_groups, allowed_paths)["flat_json"]
+
+
+def parse_streaming(raw_content, repeat_groups, allowed_paths):
+    content = fix_emoji(raw_content.decode("utf-8"))
+    return flat_parse_xml(content, repeat_groups, allowed_paths)["flat_json"]
+
+
+class Command(BaseCommand):
+    help = "Benchmark the XML to JSON conversion of submissions, BeautifulSoup against lxml iterparse"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeats", type=str, help="comma separated repeat group sizes", default="10,100,1000")
+        parser.add_argument("--questions", type=int, help="number of top level questions", default=50)
+        parser.add_argument("--file", type=str, action="append", help="submission XML file to benchmark")
+        parser.add_argument("--runs", type=int, help="number of runs per submission", default=5)
+
+    def handle(self, *args, **options):
+        submissions = []
+        for repeats_count in [int(size) for size in options["repeats"].split(",") if size]:
+            content = generate_submission(options["questions"], repeats_count)
+            submissions.append(
+                (f"repeats={repeats_count}", content, [REPEAT_GROUP], allowed_paths_for(options["questions"]))
+            )
+        for file_name in options["file"] or []:
+            with open(file_name, "rb") as xml_file:
+                submissions.append((file_name, xml_file.read(), [], None))
+
+        for label, content, repeat_groups, allowed_paths in submissions:
+            results = {}
+            durations = {}
+            for parser_name, parse in [("soup", parse_with_soup), ("iterparse", parse_streaming)]:
+                durations[parser_name] = []
+                for _ in range(options["runs"]):
+                    start = time.perf_counter()
+                    results[parser_name] = parse(content, repeat_groups, allowed_paths)
+                    durations[parser_name].append(time.perf_counter() - start)
+
+            soup_best, iterparse_best = min(durations["soup"]), min(durations["iterparse"])
+            self.stdout.write(
+                f"{label} ({len(content) / 1024:.0f} KiB): soup best {soup_best:.4f}s, "
+                f"iterparse best {iterparse_best:.4f}s, x{soup_best / iterparse_best:.1f}"
+                + ("" if results["soup"] == results["iterparse"] else " RESULTS DIFFER")
+            )
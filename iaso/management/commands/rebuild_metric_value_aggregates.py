@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from iaso.models import MetricType, MetricValue
+from iaso.models.metric import refresh_metric_value_aggregates
+
+
+class Command(BaseCommand):
+    help = """Rebuild the aggregates of the metric values on the org unit pyramid
+
+    Run it once after deploying the aggregates, they are then refreshed by the CSV imports of metric values. Values
+    written in another way (e.g. by OpenHexa pipelines) need a rebuild of their metric types."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account-id", type=int, help="only the metric types of this account")
+        parser.add_argument(
+            "--metric-type-id", type=int, action="append", help="only this metric type, can be repeated"
+        )
+
+    def handle(self, *args, account_id=None, metric_type_id=None, **options):
+        metric_types = MetricType.objects.order_by("id")
+        if account_id:
+            metric_types = metric_types.filter(account_id=account_id)
+        if metric_type_id:
+            metric_types = metric_types.filter(id__in=metric_type_id)
+
+        aggregates_count = 0
+        for metric_type in metric_types:
+            years = set(MetricValue.objects.filter(metric_type=metric_type).values_list("year", flat=True).distinct())
+            with transaction.atomic():
+                # also clears the aggregates of the years which have no value anymore
+                years.update(metric_type.aggregates.values_list("year", flat=True).distinct())
+                aggregates_count += refresh_metric_value_aggregates([metric_type.id], years)
+
+        self.stdout.write(f"Rebuilt {aggregates_count} aggregates of {metric_types.count()} metric types")
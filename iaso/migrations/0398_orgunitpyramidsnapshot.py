@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:20
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+
+import iaso.models.org_unit_pyramid_snapshot
+import iaso.utils.models.sized_file_field
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("iaso", "0397_bulkcreateuserfile_file_size_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrgUnitPyramidSnapshot",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("roots_key", models.TextField(blank=True, default="")),
+                ("include_geo_json", models.BooleanField(default=False)),
+                ("version_key", models.CharField(max_length=32)),
+                (
+                    "file",
+                    iaso.utils.models.sized_file_field.SizedFileField(
+                        upload_to=iaso.models.org_unit_pyramid_snapshot.org_unit_pyramid_snapshot_upload_to
+                    ),
+                ),
+                ("org_units_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("file_size", models.PositiveBigIntegerField(blank=True, editable=False, null=True)),
+                (
+                    "project",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="org_unit_pyramid_snapshots",
+                        to="iaso.project",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("project", "roots_key", "include_geo_json")},
+            },
+        ),
+    ]
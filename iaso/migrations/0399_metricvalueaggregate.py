@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:05
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("iaso", "0398_orgunitpyramidsnapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetricValueAggregate",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("level", models.IntegerField()),
+                ("year", models.IntegerField(blank=True, null=True)),
+                ("values_count", models.IntegerField()),
+                ("value_sum", models.FloatField()),
+                ("value_avg", models.FloatField()),
+                ("value_min", models.FloatField()),
+                ("value_max", models.FloatField()),
+                (
+                    "metric_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="aggregates", to="iaso.metrictype"
+                    ),
+                ),
+                (
+                    "org_unit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="metric_value_aggregates",
+                        to="iaso.orgunit",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["metric_type", "level", "year"], name="iaso_metric_metric__2b1e07_idx")
+                ],
+                "unique_together": {("metric_type", "org_unit", "year")},
+            },
+        ),
+    ]
@@ -11,11 +11,12 @@ from .form_ai import TemporaryForm
 from .forms import Form, FormAttachment, FormPredefinedFilter, FormVersion
 from .import_gpkg import ImportGPKG
 from .instances import Instance, InstanceFile, InstanceLock, InstanceQuerySet
-from .metric import MetricType, MetricValue
+from .metric import MetricType, MetricValue, MetricValueAggregate
 from .microplanning import Planning
 from .openhexa import OpenHEXAInstance, OpenHEXAWorkspace
 from .org_unit import OrgUnit, OrgUnitChangeRequest, OrgUnitReferenceInstance, OrgUnitType
 from .org_unit_change_request_configuration import OrgUnitChangeRequestConfiguration
+from .org_unit_pyramid_snapshot import OrgUnitPyramidSnapshot
 from .pages import IFRAME, POWERBI, RAW, SUPERSET, TEXT, Page
 from .payments import Payment, PaymentLot, PotentialPayment
 from .project import Project
@@ -72,11 +73,13 @@ __all__ = [
     "KilledException",
     "MetricType",
     "MetricValue",
+    "MetricValueAggregate",
     "OpenHEXAInstance",
     "OpenHEXAWorkspace",
     "OrgUnit",
     "OrgUnitChangeRequest",
     "OrgUnitChangeRequestConfiguration",
+    "OrgUnitPyramidSnapshot",
     "OrgUnitReferenceInstance",
     "OrgUnitType",
     "Page",
@@ -317,18 +317,22 @@ class DataSourceVersionsSynchronization(models.Model):
             "show_deleted_org_units": show_deleted_org_units,
             "field_names": field_names,
         }
-        diffs, _ = Differ().diff(**differ_params)
-
-        # Reduce the size of the diff that will be stored in the DB.
-        diffs = [diff for diff in diffs if diff.status != Differ.STATUS_SAME]
+        diffs, _ = Differ().stream_diff(**differ_params)
 
         count_status = {
             Differ.STATUS_NEW: 0,
             Differ.STATUS_MODIFIED: 0,
         }
-        for diff in diffs:
-            if diff.status in count_status:
-                count_status[diff.status] += 1
+
+        def count_diffs(diffs):
+            for diff in diffs:
+                if diff.status in count_status:
+                    count_status[diff.status] += 1
+                yield diff
+
+        # Reduce the size of the diff that will be stored in the DB. The diffs are serialized as they are streamed,
+        # the org units of all the diffs are never loaded at once.
+        json_diff = diffs_to_json(count_diffs(diff for diff in diffs if diff.status != Differ.STATUS_SAME))
 
         # Keep track of the parameters used for the diff.
         differ_config = {
@@ -362,7 +366,7 @@ class DataSourceVersionsSynchronization(models.Model):
 
         self.count_create = count_status[Differ.STATUS_NEW]
         self.count_update = count_status[Differ.STATUS_MODIFIED]
-        self.json_diff = diffs_to_json(diffs)
+        self.json_diff = json_diff
         self.diff_config = str(differ_config)
         self.save()
 
@@ -4,15 +4,13 @@ import random
 import time
 import typing
 
-from functools import reduce
-from io import StringIO
+from functools import lru_cache, reduce
 from logging import getLogger
 from urllib.error import HTTPError
 from urllib.request import urlopen
 
 import django_cte
 
-from bs4 import BeautifulSoup as Soup  # type: ignore
 from django.contrib.auth.models import User
 from django.contrib.gis.db.models.fields import PointField
 from django.contrib.gis.geos import Point
@@ -26,7 +24,7 @@ from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from iaso.utils import extract_form_version_id, flat_parse_xml_soup
+from iaso.utils import flat_parse_xml, peek_xml_form_version_id
 from iaso.utils.emoji import fix_emoji
 from iaso.utils.file_utils import get_file_type
 from iaso.utils.jsonlogic import annotate_suffixed_json_fields, instance_jsonlogic_to_q
@@ -72,6 +70,23 @@ def instance_file_upload_to(instance_file: "InstanceFile", filename: str):
     )
 
 
+@lru_cache(maxsize=256)
+def get_xml_parsing_spec(
+    form_version_pk: int, updated_at: typing.Any
+) -> typing.Tuple[typing.FrozenSet[str], typing.Tuple[str, ...]]:
+    """
+    Return the allowed paths and the repeat group names used to convert the submissions of a form version to json.
+
+    Parsing the form descriptor is expensive and identical for every submission, so it is cached per process. The
+    `updated_at` of the form version is part of the key: a modified form version is parsed again.
+    """
+    form_version = FormVersion.objects.get(pk=form_version_pk)
+    allowed_paths = set(form_version.questions_by_path().keys())
+    allowed_paths.update(Instance.ALWAYS_ALLOWED_PATHS_XML)
+    repeat_groups = tuple(rg["name"] for rg in form_version.repeat_groups())
+    return frozenset(allowed_paths), repeat_groups
+
+
 def resolve_status_form_ids(form_id=None, form_ids=None):
     """
     Combine the `form_id` / `form_ids` (comma-separated string) filter params into a single list of ids
@@ -451,7 +466,7 @@ class InMemoryTask:
         pass
 
     def report_progress_and_stop_if_killed(
-        self, progress_value=None, progress_message=None, end_value=None, prepend_progress=False
+        self, progress_value=None, progress_message=None, end_value=None, prepend_progress=False, force=False
     ):
         pass
 
@@ -627,31 +642,33 @@ class Instance(ValidationWorkflowArtefact):
 
     def xml_file_to_json(self, file: typing.IO) -> typing.Dict[str, typing.Any]:
         raw_content = file.read().decode("utf-8")
-        fixed_content = fix_emoji(raw_content).decode("utf-8")
-        copy_io_utf8 = StringIO(fixed_content)
-        soup = Soup(copy_io_utf8, "lxml-xml", from_encoding="utf-8")
+        if "&#" in raw_content or any(chr(dec) in raw_content for dec in range(28, 32)):
+            content = fix_emoji(raw_content)
+        else:
+            # nothing for fix_emoji to fix, skip the copies
+            content = raw_content.encode("utf-8")
 
-        form_version_id = extract_form_version_id(soup)
+        form_version_id = peek_xml_form_version_id(content)
         if form_version_id:
             # TODO: investigate: can self.form be None here? What's the expected behavior?
-            form_versions = self.form.form_versions.filter(version_id=form_version_id)  # type: ignore
-            form_version = form_versions.first()
+            form_version = (
+                self.form.form_versions.filter(version_id=form_version_id)  # type: ignore
+                .values("id", "updated_at")
+                .first()
+            )
             if form_version:
-                questions_by_path = form_version.questions_by_path()
-                allowed_paths = set(questions_by_path.keys())
-                allowed_paths.update(self.ALWAYS_ALLOWED_PATHS_XML)
-                flat_results = flat_parse_xml_soup(
-                    soup, [rg["name"] for rg in form_version.repeat_groups()], allowed_paths
-                )
-                if len(flat_results["skipped_paths"]) > 0:
-                    logger.warning(
-                        f"skipped {len(flat_results['skipped_paths'])} paths while parsing instance {self.id}",
-                        flat_results,
-                    )
-                return flat_results["flat_json"]
+                allowed_paths, repeat_groups = get_xml_parsing_spec(form_version["id"], form_version["updated_at"])
+                flat_results = flat_parse_xml(content, repeat_groups, allowed_paths)
+                # the version is only taken into account when the root element is the only top level node
+                if flat_results["version_id"] == form_version_id:
+                    if len(flat_results["skipped_paths"]) > 0:
+                        logger.warning(
+                            f"skipped {len(flat_results['skipped_paths'])} paths while parsing instance {self.id}",
+                            flat_results,
+                        )
+                    return flat_results["flat_json"]
             # warn old form, but keep it working ? or throw error
-            return flat_parse_xml_soup(soup, [], None)["flat_json"]
-        return flat_parse_xml_soup(soup, [], None)["flat_json"]
+        return flat_parse_xml(content, [], None)["flat_json"]
 
     def get_and_save_json_of_xml(self, force=False, tries=3):
         """
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils.translation import gettext_lazy as _
 
 from iaso.models import OrgUnit
@@ -90,3 +90,101 @@ class MetricValue(models.Model):
 
     def __str__(self):
         return "%s %s %s %s" % (self.metric_type, self.org_unit, self.year, self.value)
+
+
+class MetricValueAggregate(models.Model):
+    """Roll-up of the numeric values of a metric type on the descendants of an org unit, for a year.
+
+    The values are imported at one level (e.g. the districts), their aggregates are precomputed for every ancestor so
+    the maps of the upper levels don't have to aggregate on the fly. See `refresh_metric_value_aggregates`.
+    """
+
+    class Meta:
+        unique_together = [["metric_type", "org_unit", "year"]]
+        indexes = [models.Index(fields=["metric_type", "level", "year"])]
+
+    metric_type = models.ForeignKey(MetricType, on_delete=models.CASCADE, related_name="aggregates")
+    org_unit = models.ForeignKey(OrgUnit, on_delete=models.CASCADE, related_name="metric_value_aggregates")
+    # depth of the org unit in the pyramid, 0 for the roots
+    level = models.IntegerField()
+    year = models.IntegerField(null=True, blank=True)
+    values_count = models.IntegerField()
+    value_sum = models.FloatField()
+    value_avg = models.FloatField()
+    value_min = models.FloatField()
+    value_max = models.FloatField()
+
+    def __str__(self):
+        return "%s %s %s %s" % (self.metric_type, self.org_unit, self.year, self.value_sum)
+
+
+# First key of the advisory locks taken per metric type while refreshing its aggregates, the second one being its id.
+METRIC_VALUE_AGGREGATE_LOCK_ID = 8_513_772
+
+
+def refresh_metric_value_aggregates(metric_type_ids, years, org_unit_ids=None) -> int:
+    """Recompute the aggregates of the metric types for the years, `None` being the values without year.
+
+    With `org_unit_ids`, only the aggregates of the ancestors of these org units are recomputed: the ones which can
+    change when the values of these org units change. Returns the number of aggregates written.
+
+    The values of the ordinal metric types are codes of categories, they are not aggregated: their former aggregates are
+    only deleted.
+
+    The metric types are locked until the end of the transaction, so concurrent imports sharing ancestors don't insert
+    the same aggregates twice.
+    """
+    metric_type_ids = sorted(set(metric_type_ids))
+    params = {
+        "metric_type_ids": metric_type_ids,
+        "years": [year for year in years if year is not None],
+        "without_year": None in years,
+        "org_unit_ids": list(org_unit_ids) if org_unit_ids is not None else None,
+        "ordinal": MetricType.LegendType.ORDINAL,
+    }
+    # the ancestors of an org unit are the labels of its path, except the last one which is the org unit itself
+    ancestors = """
+        CROSS JOIN LATERAL unnest(string_to_array(ou.path::text, '.')) WITH ORDINALITY AS ancestor(id, depth)
+        WHERE ancestor.depth < nlevel(ou.path)
+    """
+    delete_filter = insert_filter = ""
+    if org_unit_ids is not None:
+        ancestor_ids = f"""(
+            SELECT ancestor.id::integer FROM iaso_orgunit ou {ancestors} AND ou.id = ANY(%(org_unit_ids)s::integer[])
+        )"""
+        delete_filter = f"AND org_unit_id IN {ancestor_ids}"
+        insert_filter = f"AND ancestor.id::integer IN {ancestor_ids}"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # locks taken in the order of the ids, so two imports can't wait for each other
+        for metric_type_id in metric_type_ids:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [METRIC_VALUE_AGGREGATE_LOCK_ID, metric_type_id])
+        cursor.execute(
+            f"""
+            DELETE FROM iaso_metricvalueaggregate
+            WHERE metric_type_id = ANY(%(metric_type_ids)s::integer[])
+            AND (year = ANY(%(years)s::integer[]) OR (year IS NULL AND %(without_year)s))
+            {delete_filter}
+            """,
+            params,
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO iaso_metricvalueaggregate
+            (metric_type_id, org_unit_id, level, year, values_count, value_sum, value_avg, value_min, value_max)
+            SELECT mv.metric_type_id, ancestor.id::integer, ancestor.depth - 1, mv.year,
+                COUNT(*), SUM(mv.value), AVG(mv.value), MIN(mv.value), MAX(mv.value)
+            FROM iaso_metricvalue mv
+            JOIN iaso_orgunit ou ON ou.id = mv.org_unit_id
+            JOIN iaso_metrictype mt ON mt.id = mv.metric_type_id
+            {ancestors}
+            AND mv.value IS NOT NULL
+            AND mt.legend_type <> %(ordinal)s
+            AND mv.metric_type_id = ANY(%(metric_type_ids)s::integer[])
+            AND (mv.year = ANY(%(years)s::integer[]) OR (mv.year IS NULL AND %(without_year)s))
+            {insert_filter}
+            GROUP BY mv.metric_type_id, ancestor.id, ancestor.depth, mv.year
+            """,
+            params,
+        )
+        return cursor.rowcount
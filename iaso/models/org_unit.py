@@ -395,7 +395,11 @@ class OrgUnit(TreeModel):
         else:
             with transaction.atomic():
                 super().save(*args, **kwargs)
-                OrgUnit.objects.bulk_update(self.calculate_paths(force_recalculate=force_recalculate), ["path"])
+                moved_org_units = self.calculate_paths(force_recalculate=force_recalculate)
+                # the descendants are moved too, the delta sync of the mobile app must return them
+                for org_unit in moved_org_units:
+                    org_unit.updated_at = self.updated_at
+                OrgUnit.objects.bulk_update(moved_org_units, ["path", "updated_at"])
 
     def calculate_paths(self, force_recalculate: bool = False) -> typing.List["OrgUnit"]:
         """Calculate the path for this org unit and all its children.
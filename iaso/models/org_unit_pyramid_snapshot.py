@@ -0,0 +1,46 @@
+import os
+import typing
+
+from django.db import models
+
+from iaso.models.project import Project
+from iaso.utils.models.sized_file_field import SizedFileField
+
+
+def org_unit_pyramid_snapshot_upload_to(snapshot: "OrgUnitPyramidSnapshot", filename: str):
+    account = snapshot.project.account
+    return os.path.join(
+        f"{account.short_sanitized_name}_{account.id}",
+        "org_unit_pyramid_snapshots",
+        snapshot.project.app_id,
+        filename,
+    )
+
+
+def get_roots_key(root_ids: typing.Iterable[int]) -> str:
+    return "|".join(str(root_id) for root_id in sorted(root_ids))
+
+
+class OrgUnitPyramidSnapshot(models.Model):
+    """Gzipped JSON list of the org units downloaded by the mobile app for a project and a set of roots
+
+    Built in the background so the devices doing their first sync are served a file instead of querying and
+    serializing the whole pyramid. `version_key` identifies the state of the pyramid the snapshot was built from,
+    the snapshot is only served while the pyramid still has this key.
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="org_unit_pyramid_snapshots")
+    # Sorted ids of the org units the download is limited to, empty when it is not limited
+    roots_key = models.TextField(blank=True, default="")
+    include_geo_json = models.BooleanField(default=False)
+    version_key = models.CharField(max_length=32)
+    file = SizedFileField(upload_to=org_unit_pyramid_snapshot_upload_to)
+    org_units_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [["project", "roots_key", "include_geo_json"]]
+
+    def __str__(self):
+        return f"{self.project} - {self.roots_key or 'all'}{' - shapes' if self.include_geo_json else ''}"
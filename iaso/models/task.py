@@ -1,3 +1,4 @@
+import time
 import traceback
 
 from logging import getLogger
@@ -83,14 +84,30 @@ class Task(models.Model):
             "should_be_killed": self.should_be_killed,
         }
 
+    # monotonic time of the last progress written by `report_progress_and_stop_if_killed`
+    _last_progress_write: Optional[float] = None
+    # last progress message not yet written in the task logs
+    _unlogged_progress_message: Optional[str] = None
+    # progress reported but held back by the throttling, not yet written
+    _progress_pending: bool = False
+
+    def check_should_be_killed(self) -> bool:
+        """Read the `should_be_killed` flag from the database, without reloading the whole task"""
+        self.should_be_killed = (
+            Task.objects.using(self._state.db).filter(id=self.id).values_list("should_be_killed", flat=True).get()
+        )
+        return self.should_be_killed
+
     def stop_if_killed(self):
-        self.refresh_from_db()
-        if self.should_be_killed:
-            logger.warning(f"Stopping Task {self} as it as been marked for kill")
-            self.status = KILLED
-            self.ended_at = timezone.now()
-            self.result = {"result": KILLED, "message": "Killed"}
-            self.save()
+        if self.check_should_be_killed():
+            self._stop_killed()
+
+    def _stop_killed(self):
+        logger.warning(f"Stopping Task {self} as it as been marked for kill")
+        self.status = KILLED
+        self.ended_at = timezone.now()
+        self.result = {"result": KILLED, "message": "Killed"}
+        self.save()
 
     def report_progress_and_stop_if_killed(
         self,
@@ -98,15 +115,27 @@ class Task(models.Model):
         progress_message: Optional[str] = None,
         end_value: Optional[int] = None,
         prepend_progress=False,
+        force=False,
     ):
         """Save progress and check if we have been killed
         We use a separate transaction, so we can report the progress even from a transaction, see services.py
+
+        To keep the overhead low for tasks reporting progress on every few rows, the progress is written (and the kill
+        flag checked) at most once per `TASK_PROGRESS_MIN_INTERVAL` seconds unless `force` is set. In between, the
+        progress is only updated on this object and written by the next write or at the end of the task.
         """
         logger.info(f"Task {self} reported {progress_message}")
-        self.refresh_from_db()
-        if self.should_be_killed:
-            self.stop_if_killed()
-            raise KilledException("Killed by user")
+        now = time.monotonic()
+        throttled = (
+            not force
+            and self._last_progress_write is not None
+            and now - self._last_progress_write < settings.TASK_PROGRESS_MIN_INTERVAL
+        )
+        if not throttled:
+            self._last_progress_write = now
+            if self.check_should_be_killed():
+                self._stop_killed()
+                raise KilledException("Killed by user")
 
         if progress_value:
             self.progress_value = progress_value
@@ -117,10 +146,25 @@ class Task(models.Model):
                 )
             else:
                 self.progress_message = progress_message
+            self._unlogged_progress_message = progress_message
         if end_value:
             self.end_value = end_value
-        self.create_log_entry_if_needed(progress_message)
-        self.save()
+        self._progress_pending = True
+        if not throttled:
+            self.flush_progress()
+
+    def flush_progress(self):
+        """Write the progress held back by the throttling of `report_progress_and_stop_if_killed`, if any.
+
+        Call it before `refresh_from_db`, which would otherwise discard it."""
+        if not self._progress_pending:
+            return
+        Task.objects.using(self._state.db).filter(id=self.id).update(
+            progress_value=self.progress_value, progress_message=self.progress_message, end_value=self.end_value
+        )
+        self.create_log_entry_if_needed(self._unlogged_progress_message)
+        self._unlogged_progress_message = None
+        self._progress_pending = False
 
     def report_success_with_result(self, message: Optional[str] = None, result_data=None):
         logger.info(f"Task {self} reported success with message {message}")
@@ -158,6 +202,7 @@ class Task(models.Model):
         self.save()
 
     def terminate_with_error(self, message: Optional[str] = None, exception=None):
+        self.flush_progress()
         self.refresh_from_db()
         logger.error(f"Task {self} ended in error %s", message, exc_info=exception)
         self.status = ERRORED
@@ -0,0 +1,79 @@
+"""
+This task builds the gzipped snapshot of the org units downloaded by the mobile app for a project and a set of roots,
+with or without their shapes. The full downloads of `/api/mobile/orgunits/` are then served from this file, until
+an org unit of the pyramid changes. See `OrgUnitPyramidSnapshot`.
+"""
+
+import gzip
+import logging
+import tempfile
+
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from rest_framework.utils.encoders import JSONEncoder
+
+from beanstalk_worker import task_decorator
+from iaso.api.mobile.org_units import (
+    MobileOrgUnitSerializer,
+    get_mobile_org_units_queryset,
+    get_pyramid_snapshot_lock_key,
+    get_pyramid_version_key,
+)
+from iaso.models import OrgUnitPyramidSnapshot, Project
+from iaso.models.org_unit_pyramid_snapshot import get_roots_key
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2000
+
+
+def write_org_unit_pyramid_snapshot(project: Project, root_ids, include_geo_json: bool) -> OrgUnitPyramidSnapshot:
+    # Read before the org units: a change made during the build will make the snapshot outdated, not wrong
+    version_key = get_pyramid_version_key(project, root_ids, use_cache=False)
+
+    queryset = get_mobile_org_units_queryset(project, root_ids, include_geo_json)
+    serializer = MobileOrgUnitSerializer(context={"include_geo_json": include_geo_json, "app_id": project.app_id})
+    encoder = JSONEncoder()
+
+    with tempfile.TemporaryFile() as snapshot_file:
+        count = 0
+        with gzip.GzipFile(fileobj=snapshot_file, mode="wb") as gzip_file:
+            gzip_file.write(b"[")
+            for org_unit in queryset.iterator(chunk_size=CHUNK_SIZE):
+                if count:
+                    gzip_file.write(b",")
+                gzip_file.write(encoder.encode(serializer.to_representation(org_unit)).encode())
+                count += 1
+            gzip_file.write(b"]")
+        snapshot_file.seek(0)
+
+        with transaction.atomic():
+            snapshot, _ = OrgUnitPyramidSnapshot.objects.select_for_update().get_or_create(
+                project=project,
+                roots_key=get_roots_key(root_ids),
+                include_geo_json=include_geo_json,
+                defaults={"version_key": version_key},
+            )
+            previous_file_name = snapshot.file.name
+            snapshot.version_key = version_key
+            snapshot.org_units_count = count
+            file_name = f"org_units{'_shapes' if include_geo_json else ''}_{version_key}.json.gz"
+            snapshot.file.save(file_name, File(snapshot_file), save=False)
+            snapshot.save()
+
+    if previous_file_name and previous_file_name != snapshot.file.name:
+        snapshot.file.storage.delete(previous_file_name)
+    logger.info(f"Built {snapshot} with {count} org units")
+    return snapshot
+
+
+@task_decorator(task_name="build_org_unit_pyramid_snapshot")
+def build_org_unit_pyramid_snapshot(project_id, root_ids, include_geo_json, task=None):
+    project = Project.objects.select_related("account").get(id=project_id)
+    try:
+        snapshot = write_org_unit_pyramid_snapshot(project, root_ids, include_geo_json)
+    finally:
+        cache.delete(get_pyramid_snapshot_lock_key(project_id, root_ids, include_geo_json))
+    task.report_success(message=f"{snapshot.org_units_count} org units in the snapshot of {project.app_id}")
@@ -11,29 +11,35 @@ skipped.
 This task generates a .zip file containing all this data for a given app id an user.
 This .zip file can then be parsed by the mobile app, thus simulating a user's
 first login on the mobile app.
+
+The resources are fetched by calling the API views of this server in-process (see
+`InProcessIasoClient`), several at the same time when `MOBILE_APP_EXPORT_MAX_WORKERS` > 1,
+and written directly into the zip.
 """
 
 import json
 import logging
 import os
 import re
+import threading
 import uuid
 import zipfile
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlencode, urlparse, urlunparse
 
-import requests
-
+from django import db
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils.translation import gettext as _
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework_simplejwt.tokens import RefreshToken  # type: ignore
 
 from beanstalk_worker import task_decorator
 from iaso.models import Project
+from iaso.tasks.utils.in_process_api_client import InProcessIasoClient
 from iaso.tasks.utils.mobile_app_setup_api_calls import API_CALLS
 from iaso.utils.encryption import encrypt_file
-from iaso.utils.iaso_api_client import IasoClient
 from iaso.utils.s3_client import upload_file_to_s3
 
 
@@ -42,6 +48,21 @@ logger = logging.getLogger(__name__)
 SERVER = f"https://{settings.DNS_DOMAIN}"
 
 
+class ExportZipFile:
+    """The zip file of the export, written by the threads fetching the resources"""
+
+    def __init__(self, zip_file):
+        self.zip_file = zip_file
+        self.lock = threading.Lock()
+
+    def write(self, filename, content):
+        with self.lock:
+            self.zip_file.writestr(filename, content)
+
+    def write_json(self, filename, data):
+        self.write(filename, json.dumps(data, cls=JSONEncoder))
+
+
 @task_decorator(task_name="export_mobile_app_setup")
 def export_mobile_app_setup_for_user(
     user_id,
@@ -61,28 +82,29 @@ def export_mobile_app_setup_for_user(
     # setup
     export_name = f"mobile-app-export-{uuid.uuid4()}"
     tmp_dir = os.path.join("/tmp", export_name)
-    iaso_client = IasoClient(server_url=SERVER)
+    os.makedirs(tmp_dir)
+    zipfile_name = f"{export_name}.zip"
+    # The API views are called in this process, the worker does not need to reach the public DNS of the server
+    iaso_client = InProcessIasoClient(server_url=SERVER)
 
-    app_info = _get_project_app_details(iaso_client, tmp_dir, project.app_id)
-    feature_flags = [flag["code"] for flag in app_info["feature_flags"]]
+    logger.info(f"Creating zipfile {zipfile_name}")
+    with zipfile.ZipFile(os.path.join(tmp_dir, zipfile_name), "w", zipfile.ZIP_DEFLATED) as zipf:
+        export_zip = ExportZipFile(zipf)
+        app_info = _get_project_app_details(iaso_client, export_zip, project.app_id)
+        feature_flags = [flag["code"] for flag in app_info["feature_flags"]]
 
-    the_task.report_progress_and_stop_if_killed(progress_value=1)
+        the_task.report_progress_and_stop_if_killed(progress_value=1)
 
-    if app_info["needs_authentication"]:
-        logger.info("Authentication required, authenticating iaso_client")
-        refresh = RefreshToken.for_user(user)
-        iaso_client.authenticate_with_token(str(refresh.access_token))
+        if app_info["needs_authentication"]:
+            logger.info("Authentication required, authenticating iaso_client")
+            refresh = RefreshToken.for_user(user)
+            iaso_client.authenticate_with_token(str(refresh.access_token))
 
-    the_task.report_progress_and_stop_if_killed(progress_value=2)
+        the_task.report_progress_and_stop_if_killed(progress_value=2)
 
-    for call in API_CALLS:
-        the_task.report_progress_and_stop_if_killed(
-            progress_value=the_task.progress_value + 1,
-            progress_message=f"Fetching {call['filename']}",
-        )
-        _get_resource(iaso_client, call, tmp_dir, project.app_id, feature_flags)
+        _get_resources(the_task, iaso_client, export_zip, project.app_id, feature_flags)
 
-    s3_object_name = _compress_and_upload_to_s3(tmp_dir, export_name, password)
+    s3_object_name = _encrypt_and_upload_to_s3(tmp_dir, zipfile_name, password)
 
     the_task.report_success_with_result(
         message=f"Mobile app setup zipfile was created for user {user.username} and project {project.name}.",
@@ -91,7 +113,7 @@ def export_mobile_app_setup_for_user(
     return the_task
 
 
-def _get_project_app_details(iaso_client, tmp_dir, app_id):
+def _get_project_app_details(iaso_client, export_zip, app_id):
     logger.info("Getting app info (feature flags etc)")
     # Public endpoint, no auth needed
     app_info = iaso_client.get(f"/api/apps/current/?app_id={app_id}")
@@ -106,24 +128,56 @@ def _get_project_app_details(iaso_client, tmp_dir, app_id):
         logger.info(f"\t\t{flag['code']}: {flag['name']}")
     logger.info("")
 
-    logger.info(f"Writing results to {tmp_dir}")
-    if not os.path.exists(tmp_dir):
-        os.makedirs(tmp_dir)
-
-    with open(os.path.join(tmp_dir, "app.json"), "w") as json_file:
-        json.dump(app_info, json_file)
+    export_zip.write_json("app.json", app_info)
 
     return app_info
 
 
-def _get_resource(iaso_client, call, tmp_dir, app_id, feature_flags):
+def _get_resources(the_task, iaso_client, export_zip, app_id, feature_flags):
+    """Fetch the resources of `API_CALLS`, at most `MOBILE_APP_EXPORT_MAX_WORKERS` at the same time"""
+    max_workers = settings.MOBILE_APP_EXPORT_MAX_WORKERS
+    if max_workers <= 1:
+        for call in API_CALLS:
+            the_task.report_progress_and_stop_if_killed(
+                progress_value=the_task.progress_value + 1,
+                progress_message=f"Fetching {call['filename']}",
+            )
+            _get_resource(iaso_client, call, export_zip, app_id, feature_flags)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(_get_resource_in_thread, iaso_client, call, export_zip, app_id, feature_flags): call
+            for call in API_CALLS
+        }
+        for future in as_completed(futures):
+            future.result()
+            the_task.report_progress_and_stop_if_killed(
+                progress_value=the_task.progress_value + 1,
+                progress_message=f"Fetched {futures[future]['filename']}",
+            )
+    finally:
+        # on errors, don't start the calls waiting in the queue
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _get_resource_in_thread(iaso_client, call, export_zip, app_id, feature_flags):
+    try:
+        _get_resource(iaso_client, call, export_zip, app_id, feature_flags)
+    finally:
+        # worker threads get their own database connection, don't leak it
+        db.connection.close()
+
+
+def _get_resource(iaso_client, call, export_zip, app_id, feature_flags):
     if ("required_feature_flag" in call) and call["required_feature_flag"] not in feature_flags:
         logger.info(f"{call['filename']}: not writing, feature flag missing.")
         return
 
     page = 1
     while page == 1 or (isinstance(result, dict) and result.get("has_next", False)):
-        query_params = call.get("query_params", {})
+        query_params = dict(call.get("query_params", {}))
         query_params["app_id"] = app_id
 
         filename = None
@@ -143,21 +197,20 @@ def _get_resource(iaso_client, call, tmp_dir, app_id, feature_flags):
         # 2. Rewrite the file URLs to make them appear on a local disk, to facilitate
         #    fetching them in the mobile app.
         if call["filename"] == "formversions":
-            _download_form_versions(iaso_client, tmp_dir, result["form_versions"])
+            _download_form_versions(iaso_client, export_zip, result["form_versions"])
             for record in result["form_versions"]:
                 record["file"] = "forms/" + _extract_filename_from_url(record["file"])
         if call["filename"] == "reports":
-            _download_reports(iaso_client, tmp_dir, result)
+            _download_reports(iaso_client, export_zip, result)
             for record in result:
                 record["url"] = "reports/" + _extract_filename_from_url(record["url"])
         if call["filename"] == "formattachments":
-            _download_form_attachments(iaso_client, tmp_dir, result["results"], app_id)
+            _download_form_attachments(iaso_client, export_zip, result["results"], app_id)
             for record in result["results"]:
                 # don't use _extract_filename_from_url to preserve subpath
                 record["file"] = "formattachments/" + urlparse(record["file"]).path.split("/form_attachments/")[-1]
 
-        with open(os.path.join(tmp_dir, filename), "w") as json_file:
-            json.dump(result, json_file)
+        export_zip.write_json(filename, result)
 
         page += 1
 
@@ -181,102 +234,47 @@ def _call_endpoint(iaso_client, url, filename):
     return result
 
 
-def _download_form_attachments(iaso_client, tmp_dir, resources, app_id):
-    if len(resources) == 0:
-        return
-
-    # create subfolder for downloaded files
-    os.makedirs(os.path.join(tmp_dir, "formattachments"))
+def _download_form_attachments(iaso_client, export_zip, resources, app_id):
     for resource in resources:
         form_id = resource["form_id"]
-        os.makedirs(os.path.join(tmp_dir, "formattachments", str(form_id)))
         url = resource["file"]
         filename = _extract_filename_from_url(url)
 
         logger.info(f"\tDOWNLOAD {url}")
-        attachment_file = None
-        # S3 urls contain a signature and don't work with additional auth headers
-        if "s3.amazonaws" in url:
-            attachment_file = requests.get(url)
-        else:
-            attachment_file = requests.get(url, headers=iaso_client.headers)
+        attachment_file = iaso_client.get_file(url)
 
         logger.info("\tDOWNLOAD manifest")
-        manifest_file = requests.get(
-            SERVER + f"/api/forms/{form_id}/manifest/?app_id={app_id}",
-            headers=iaso_client.headers,
-        )
+        manifest_file = iaso_client.get_file(f"/api/forms/{form_id}/manifest/?app_id={app_id}")
 
-        with open(os.path.join(tmp_dir, "formattachments", str(form_id), filename), mode="wb") as f:
-            f.write(attachment_file.content)
+        export_zip.write(os.path.join("formattachments", str(form_id), filename), attachment_file)
         # For the manifest.xml, rewrite the `downloadUrl` to the local file path
-        with open(os.path.join(tmp_dir, "formattachments", str(form_id), "manifest.xml"), mode="w") as f:
-            content = manifest_file.content.decode("utf-8")
-            url_regex = r"(?<=<downloadUrl>)(.*?)(?=</downloadUrl>)"
-            download_url = re.search(url_regex, content).group()
-            # don't use _extract_filename_from_url to preserve subpath
-            new_download_url = "formattachments/" + urlparse(download_url).path.split("/form_attachments/")[-1]
-            f.write(re.sub(url_regex, new_download_url, content))
-
+        content = manifest_file.decode("utf-8")
+        url_regex = r"(?<=<downloadUrl>)(.*?)(?=</downloadUrl>)"
+        download_url = re.search(url_regex, content).group()
+        # don't use _extract_filename_from_url to preserve subpath
+        new_download_url = "formattachments/" + urlparse(download_url).path.split("/form_attachments/")[-1]
+        export_zip.write(
+            os.path.join("formattachments", str(form_id), "manifest.xml"), re.sub(url_regex, new_download_url, content)
+        )
 
-def _download_form_versions(iaso_client, tmp_dir, form_versions):
-    if len(form_versions) == 0:
-        return
 
-    os.makedirs(os.path.join(tmp_dir, "forms"))
+def _download_form_versions(iaso_client, export_zip, form_versions):
     for form_version in form_versions:
-        _download_and_save_file(
-            iaso_client,
-            tmp_dir,
-            url=form_version["file"],
-            non_s3_url=form_version["file"],
-            folder_name="forms",
-        )
+        _download_and_save_file(iaso_client, export_zip, url=form_version["file"], folder_name="forms")
 
 
-def _download_reports(iaso_client, tmp_dir, reports):
-    if len(reports) == 0:
-        return
-
-    os.makedirs(os.path.join(tmp_dir, "reports"))
+def _download_reports(iaso_client, export_zip, reports):
     for report in reports:
-        _download_and_save_file(
-            iaso_client,
-            tmp_dir,
-            url=report["url"],
-            non_s3_url=SERVER + report["url"],
-            folder_name="reports",
-        )
+        _download_and_save_file(iaso_client, export_zip, url=report["url"], folder_name="reports")
 
 
-def _download_and_save_file(iaso_client, tmp_dir, folder_name, url, non_s3_url):
+def _download_and_save_file(iaso_client, export_zip, folder_name, url):
     filename = _extract_filename_from_url(url)
-    response = None
-    # S3 urls contain a signature and don't work with additional auth headers
-    if "s3.amazonaws" in url:
-        logger.info(f"\tDOWNLOAD {url}")
-        response = requests.get(url)
-    else:
-        logger.info(f"\tDOWNLOAD {non_s3_url}")
-        response = requests.get(non_s3_url, headers=iaso_client.headers)
-
-    with open(os.path.join(tmp_dir, folder_name, filename), mode="wb") as f:
-        f.write(response.content)
-
+    logger.info(f"\tDOWNLOAD {url}")
+    export_zip.write(os.path.join(folder_name, filename), iaso_client.get_file(url))
 
-def _compress_and_upload_to_s3(tmp_dir, export_name, password):
-    zipfile_name = f"{export_name}.zip"
-    logger.info(f"Creating zipfile {zipfile_name}")
-
-    with zipfile.ZipFile(os.path.join(tmp_dir, zipfile_name), "w", zipfile.ZIP_DEFLATED) as zipf:
-        # add all files in /tmp directory to the .zip file
-        for root, _dirs, files in os.walk(tmp_dir):
-            for file in files:
-                if file != zipfile_name:
-                    file_path = os.path.join(root, file)
-                    archive_name = os.path.relpath(file_path, tmp_dir)
-                    zipf.write(file_path, archive_name)
 
+def _encrypt_and_upload_to_s3(tmp_dir, zipfile_name, password):
     logger.info("Encrypting zipfile")
     encrypted_file_path = encrypt_file(
         file_path=tmp_dir,
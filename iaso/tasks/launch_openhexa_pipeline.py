@@ -83,6 +83,7 @@ def _launch_pipeline(task: Task, pipeline_id: str, version: str, config: dict, p
 
     logger.info(f"Successfully launched pipeline {pipeline_id} v{version} as task {task.pk}")
     # Preserve external flag during progress updates
+    task.flush_progress()
     task.refresh_from_db()
     task.report_progress_and_stop_if_killed(
         progress_message=f"Successfully launched pipeline {pipeline_id} v{version} as task {task.pk}"
@@ -175,6 +176,7 @@ def _handle_success_status(task: Task, pipeline_id: str, run_status: str) -> boo
         logger.info(
             f"Pipeline {pipeline_id} succeeded in OpenHEXA with status: {run_status}, updating task {task.pk} to SUCCESS"
         )
+        task.flush_progress()
         task.refresh_from_db()
         task.status = SUCCESS
         task.ended_at = timezone.now()
@@ -249,6 +251,7 @@ def launch_openhexa_pipeline(
     while True:
         try:
             # Check if task was killed
+            task.flush_progress()
             task.refresh_from_db()
             # Ensure external flag is preserved after refresh
             if not task.external:
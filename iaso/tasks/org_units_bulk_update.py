@@ -1,8 +1,8 @@
-from copy import deepcopy
 from time import time
 from typing import List, Optional
 
 from django.db import transaction
+from django.utils import timezone
 
 from beanstalk_worker import task_decorator
 from hat.audit import models as audit_models
@@ -10,29 +10,47 @@ from iaso.api.org_unit_search import build_org_units_queryset
 from iaso.models import DataSource, Group, OrgUnit, OrgUnitType, Task
 
 
-def update_single_unit_from_bulk(
-    user, org_unit, *, validation_status, org_unit_type_id, groups_ids_added, groups_ids_removed
+CHUNK_SIZE = 1000
+
+
+def update_units_from_bulk(
+    user, org_unit_ids, *, validation_status, org_unit_type_id, groups_ids_added, groups_ids_removed
 ):
-    """Used within the context of a bulk operation"""
+    """Used within the context of a bulk operation, same result as saving the org units one by one.
+
+    The org units are updated with one `UPDATE`, their groups with one insert and one delete on the groups table and
+    their `Modification` are created in bulk, keeping only the changed fields. Their path is not recalculated since
+    their parent doesn't change.
+    """
+    org_units = OrgUnit.objects.filter(pk__in=org_unit_ids).order_by("pk")
+    past_values = {org_unit.pk: audit_models.serialize_instance(org_unit) for org_unit in org_units}
 
-    original_copy = deepcopy(org_unit)
+    fields = {"updated_at": timezone.now()}
     if validation_status is not None:
-        org_unit.validation_status = validation_status
+        fields["validation_status"] = validation_status
     if org_unit_type_id is not None:
-        org_unit_type = OrgUnitType.objects.get(pk=org_unit_type_id)
-        org_unit.org_unit_type = org_unit_type
-    if groups_ids_added is not None:
-        for group_id in groups_ids_added:
-            group = Group.objects.get(pk=group_id)
-            group.org_units.add(org_unit)
-    if groups_ids_removed is not None:
-        for group_id in groups_ids_removed:
-            group = Group.objects.get(pk=group_id)
-            group.org_units.remove(org_unit)
-
-    org_unit.save()
-
-    audit_models.log_modification(original_copy, org_unit, source=audit_models.ORG_UNIT_API_BULK, user=user)
+        fields["org_unit_type_id"] = org_unit_type_id
+    org_units.update(**fields)
+
+    group_org_units = Group.org_units.through
+    if groups_ids_added:
+        group_org_units.objects.bulk_create(
+            [
+                group_org_units(group_id=group_id, orgunit_id=org_unit_id)
+                for group_id in groups_ids_added
+                for org_unit_id in org_unit_ids
+            ],
+            ignore_conflicts=True,
+        )
+    if groups_ids_removed:
+        group_org_units.objects.filter(group_id__in=groups_ids_removed, orgunit_id__in=org_unit_ids).delete()
+
+    audit_models.log_modifications_in_bulk(
+        ((past_values[org_unit.pk], org_unit) for org_unit in org_units.all()),
+        source=audit_models.ORG_UNIT_API_BULK,
+        user=user,
+        diff_only=True,
+    )
 
 
 @task_decorator(task_name="org_unit_bulk_update")
@@ -80,34 +98,49 @@ def org_units_bulk_update(
     if read_only_data_sources.count() > 0:
         raise Exception("Modification on read only source are not allowed")
 
-    total = queryset.count()
+    # Fail before any change if the type or a group doesn't exist
+    if org_unit_type_id is not None:
+        OrgUnitType.objects.get(pk=org_unit_type_id)
+    for group_id in set(groups_ids_added or []) | set(groups_ids_removed or []):
+        Group.objects.get(pk=group_id)
+
+    org_unit_ids = sorted(set(queryset.values_list("id", flat=True)))
+    total = len(org_unit_ids)
     editable_org_unit_type_ids = user.iaso_profile.get_editable_org_unit_type_ids()
     skipped_messages = []
 
     # FIXME Task don't handle rollback properly if task is killed by user or other error
     with transaction.atomic():
-        for index, org_unit in enumerate(queryset.iterator()):
-            if org_unit.org_unit_type and not user.iaso_profile.has_org_unit_write_permission(
-                org_unit_type_id=org_unit.org_unit_type.pk,
-                prefetched_editable_org_unit_type_ids=editable_org_unit_type_ids,
-            ):
-                skipped_messages.append(
-                    f"Org unit `{org_unit.name}` (#{org_unit.pk}) silently skipped "
-                    f"because user `{user.username}` (#{user.pk}) cannot edit "
-                    f"an org unit of type `{org_unit.org_unit_type.name}` (#{org_unit.org_unit_type.pk})."
-                )
-                continue
-
+        for index in range(0, total, CHUNK_SIZE):
             res_string = "%.2f sec, processed %i org units" % (time() - start, index)
             task.report_progress_and_stop_if_killed(progress_message=res_string, end_value=total, progress_value=index)
-            update_single_unit_from_bulk(
-                user,
-                org_unit,
-                validation_status=validation_status,
-                org_unit_type_id=org_unit_type_id,
-                groups_ids_added=groups_ids_added,
-                groups_ids_removed=groups_ids_removed,
+
+            chunk_ids = []
+            chunk = OrgUnit.objects.filter(pk__in=org_unit_ids[index : index + CHUNK_SIZE]).select_related(
+                "org_unit_type"
             )
+            for org_unit in chunk.order_by("pk"):
+                if org_unit.org_unit_type and not user.iaso_profile.has_org_unit_write_permission(
+                    org_unit_type_id=org_unit.org_unit_type.pk,
+                    prefetched_editable_org_unit_type_ids=editable_org_unit_type_ids,
+                ):
+                    skipped_messages.append(
+                        f"Org unit `{org_unit.name}` (#{org_unit.pk}) silently skipped "
+                        f"because user `{user.username}` (#{user.pk}) cannot edit "
+                        f"an org unit of type `{org_unit.org_unit_type.name}` (#{org_unit.org_unit_type.pk})."
+                    )
+                    continue
+                chunk_ids.append(org_unit.pk)
+
+            if chunk_ids:
+                update_units_from_bulk(
+                    user,
+                    chunk_ids,
+                    validation_status=validation_status,
+                    org_unit_type_id=org_unit_type_id,
+                    groups_ids_added=groups_ids_added,
+                    groups_ids_removed=groups_ids_removed,
+                )
 
         message = f"{total} modified"
         if skipped_messages:
@@ -5,7 +5,7 @@ from datetime import datetime
 from beanstalk_worker import task_decorator
 from iaso.api.deduplication.algos.levenshtein import ABOVE_SCORE_DISPLAY, LEVENSHTEIN_MAX_DISTANCE, LevenshteinAlgorithm
 from iaso.api.workflows.serializers import find_question_by_name
-from iaso.models import EntityType
+from iaso.models import SUCCESS, EntityDuplicateAnalyzis, EntityType
 from iaso.models.deduplication import PossibleAlgorithms
 
 
@@ -19,6 +19,31 @@ def get_deduplication_aglo_default_parameters(algo_name=None):
     return {}
 
 
+def _comparable_metadata(metadata):
+    parameters = {name: value for name, value in metadata.get("parameters", {}).items() if name != "incremental"}
+    return str(metadata.get("entity_type_id")), list(metadata.get("fields", [])), parameters
+
+
+def find_previous_analyze(algo_name, algo_params, task):
+    """Last successful analyze of the same algorithm, on the same entity type with the same fields and parameters"""
+    current = task.entity_duplicate_analyzis.first()
+    previous_analyzes = (
+        EntityDuplicateAnalyzis.objects.filter(
+            algorithm=algo_name,
+            task__status=SUCCESS,
+            finished_at__isnull=False,
+            metadata__entity_type_id=algo_params["entity_type_id"],
+        )
+        .exclude(id=current.id if current else None)
+        .select_related("task")
+        .order_by("-task__started_at")
+    )
+    for analyze in previous_analyzes:
+        if _comparable_metadata(analyze.metadata) == _comparable_metadata(algo_params):
+            return analyze
+    return None
+
+
 @task_decorator(task_name="run_deduplication_algo")
 def run_deduplication_algo(algo_name=None, algo_params=None, task=None):
     """Background Task to run deduplication algo."""
@@ -43,6 +68,16 @@ def run_deduplication_algo(algo_name=None, algo_params=None, task=None):
     )
     reference_form_fields = [find_question_by_name(field, possible_fields) for field in algo_params.get("fields", [])]
 
+    # Incremental runs only score the pairs with an entity created or changed since the start of the previous run,
+    # the other pairs found by the previous runs are kept as they are in `EntityDuplicate`.
+    if algo_params.get("parameters", {}).get("incremental"):
+        previous_analyze = find_previous_analyze(algo_name, algo_params, task)
+        if previous_analyze:
+            algo_params["changed_since"] = previous_analyze.task.started_at
+            task.report_progress_and_stop_if_killed(
+                progress_message=f"Incremental run from the analyze {previous_analyze.id}"
+            )
+
     algo_params["fields"] = reference_form_fields
 
     algo.run(algo_params, task)
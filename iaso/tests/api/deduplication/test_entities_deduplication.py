@@ -375,6 +375,87 @@ class EntitiesDuplicationAPITestCase(APITestCase):
                     self.assertEqual(result["analyzis"][0]["analyze_id"], analyze_id)
                     break
 
+    def test_analyzes_with_blocking_finds_the_same_duplicates(self):
+        self.client.force_authenticate(self.user_with_default_ou_rw)
+        task_service = TestTaskService()
+
+        duplicates = {}
+        for blocking in [False, True]:
+            m.EntityDuplicate.objects.all().delete()
+            response = self.client.post(
+                "/api/entityduplicates_analyzes/",
+                {
+                    "entity_type_id": self.default_entity_type.id,
+                    "fields": ["Prenom", "Nom", "age__int__"],
+                    "algorithm": "levenshtein",
+                    "parameters": [{"name": "blocking", "value": blocking}],
+                },
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            task_service.run_all()
+
+            analyze = m.EntityDuplicateAnalyzis.objects.get(id=response.data["analyze_id"])
+            self.assertEqual(analyze.task.status, "SUCCESS")
+            duplicates[blocking] = set(analyze.duplicates.values_list("entity1_id", "entity2_id", "similarity_score"))
+
+        self.assertEqual(len(duplicates[False]), 6)
+        self.assertEqual(duplicates[True], duplicates[False])
+
+    def test_incremental_analyzes_only_score_changed_entities(self):
+        self.client.force_authenticate(self.user_with_default_ou_rw)
+        task_service = TestTaskService()
+        analyze_data = {
+            "entity_type_id": self.default_entity_type.id,
+            "fields": ["Prenom", "Nom", "age__int__"],
+            "algorithm": "levenshtein",
+            "parameters": [{"name": "incremental", "value": True}],
+        }
+
+        # without previous run, everything is scored
+        response = self.client.post("/api/entityduplicates_analyzes/", analyze_data, format="json")
+        task_service.run_all()
+        first_analyze = m.EntityDuplicateAnalyzis.objects.get(id=response.data["analyze_id"])
+        self.assertEqual(first_analyze.duplicates.count(), 6)
+
+        create_instance_and_entity(
+            self,
+            "new_entity",
+            {"Prenom": "same_instance", "Nom": "iaso", "age__int__": "20"},
+            self.default_form.form_versions.first().version_id,
+        )
+        response = self.client.post("/api/entityduplicates_analyzes/", analyze_data, format="json")
+        task_service.run_all()
+        second_analyze = m.EntityDuplicateAnalyzis.objects.get(id=response.data["analyze_id"])
+
+        self.assertEqual(second_analyze.task.status, "SUCCESS")
+        self.assertEqual(second_analyze.duplicates.count(), 4)
+        for duplicate in second_analyze.duplicates.all():
+            self.assertEqual(duplicate.entity1_id, self.new_entity.id)
+        # the duplicates of the first run are kept
+        self.assertEqual(first_analyze.duplicates.count(), 6)
+
+        # nothing changed since the previous run
+        response = self.client.post("/api/entityduplicates_analyzes/", analyze_data, format="json")
+        task_service.run_all()
+        third_analyze = m.EntityDuplicateAnalyzis.objects.get(id=response.data["analyze_id"])
+        self.assertEqual(third_analyze.task.status, "SUCCESS")
+        self.assertEqual(third_analyze.duplicates.count(), 0)
+
+        # the pairs of a changed entity found by a previous run are scored again
+        scores = dict(second_analyze.duplicates.values_list("entity2_id", "similarity_score"))
+        instance = self.new_entity.attributes
+        instance.json = {**instance.json, "Nom": "completely different", "age__int__": "90"}
+        instance.save()
+        response = self.client.post("/api/entityduplicates_analyzes/", analyze_data, format="json")
+        task_service.run_all()
+        fourth_analyze = m.EntityDuplicateAnalyzis.objects.get(id=response.data["analyze_id"])
+        self.assertEqual(fourth_analyze.task.status, "SUCCESS")
+        self.assertEqual(fourth_analyze.duplicates.count(), 0)
+        new_scores = dict(second_analyze.duplicates.values_list("entity2_id", "similarity_score"))
+        self.assertEqual(new_scores.keys(), scores.keys())
+        self.assertLess(sum(new_scores.values()), sum(scores.values()))
+
     def test_detail_of_duplicate(self):
         self.client.force_authenticate(self.user_with_default_ou_rw)
 
@@ -572,7 +653,7 @@ class EntitiesDuplicationAPITestCase(APITestCase):
         self.assertContains(response, "This duplicate has already been validated or ignored", status_code=400)
 
         # we can't merge it after it was ignored
-        merged_data = {i: duplicate.entity1.id for i in duplicate.analyze.metadata["fields"]}
+        merged_data = dict.fromkeys(duplicate.analyze.metadata["fields"], duplicate.entity1.id)
         response = self.client.post(
             "/api/entityduplicates/",
             data={"merge": merged_data, "entity1_id": duplicate.entity1.id, "entity2_id": duplicate.entity2.id},
@@ -112,6 +112,62 @@ class MobileEntityAPITestCase(EntityAPITestCase):
         # Verify no duplicate entity IDs
         self.assertEqual(len(entity_ids), len(set(entity_ids)), "Found duplicate entities in response")
 
+    def test_list_entities_cursor_pagination(self):
+        entities = []
+        for name in ["first", "second", "third"]:
+            instance = self.create_form_instance(
+                project=self.project, org_unit=self.ou_country, form=self.form_1, uuid=uuid.uuid4()
+            )
+            entity = m.Entity.objects.create(
+                name=name, entity_type=self.entity_type, attributes=instance, account=self.account
+            )
+            instance.entity = entity
+            instance.save()
+            entities.append(entity)
+
+        self.client.force_authenticate(self.yoda)
+        response = self.client.get(self.BASE_URL, {"app_id": self.project.app_id, "cursor": "null", "limit": 2})
+        response_json = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual([e["id"] for e in response_json["results"]], [str(e.uuid) for e in entities[:2]])
+        self.assertTrue(response_json["has_next"])
+
+        # an entity deleted from an already downloaded page does not shift the next page
+        entities[0].delete()
+        response = self.client.get(
+            self.BASE_URL, {"app_id": self.project.app_id, "cursor": response_json["next"], "limit": 2}
+        )
+        response_json = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual([e["id"] for e in response_json["results"]], [str(entities[2].uuid)])
+        self.assertFalse(response_json["has_next"])
+        self.assertIsNone(response_json["next"])
+
+    def test_list_entities_cursor_pagination_follows_next(self):
+        entities = []
+        for name in ["first", "second", "third", "fourth", "fifth"]:
+            instance = self.create_form_instance(
+                project=self.project, org_unit=self.ou_country, form=self.form_1, uuid=uuid.uuid4()
+            )
+            entity = m.Entity.objects.create(
+                name=name, entity_type=self.entity_type, attributes=instance, account=self.account
+            )
+            instance.entity = entity
+            instance.save()
+            entities.append(entity)
+
+        self.client.force_authenticate(self.yoda)
+        downloaded_ids = []
+        cursor = "null"
+        for _ in range(len(entities)):
+            response = self.client.get(self.BASE_URL, {"app_id": self.project.app_id, "cursor": cursor, "limit": 2})
+            response_json = self.assertJSONResponse(response, status.HTTP_200_OK)
+            downloaded_ids += [e["id"] for e in response_json["results"]]
+            if not response_json["has_next"]:
+                break
+            cursor = response_json["next"]
+
+        self.assertFalse(response_json["has_next"])
+        self.assertEqual(downloaded_ids, [str(e.uuid) for e in entities])
+
     def test_list_entities_filter_by_limit_date_ignores_soft_deleted_instances(self):
         self.client.force_authenticate(self.yoda)
 
@@ -1,5 +1,6 @@
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from rest_framework.test import APIRequestFactory
 
 from iaso.api.metrics.serializers import (
@@ -13,7 +14,7 @@ from iaso.api.metrics.serializers import (
 )
 from iaso.models.base import Account
 from iaso.models.data_source import DataSource, SourceVersion
-from iaso.models.metric import MetricType, MetricValue
+from iaso.models.metric import MetricType, MetricValue, MetricValueAggregate
 from iaso.models.org_unit import OrgUnit, OrgUnitType
 from iaso.models.project import Project
 from iaso.test import TestCase
@@ -732,6 +733,105 @@ class ImportMetricValuesSerializerTestCase(TestCase):
         self.assertEqual(ou1_2025_population.value, 12000)
         self.assertEqual(ou2_2025_population.value, 15000)
 
+    def test_save_upserts_values(self):
+        MetricValue.objects.create(metric_type=self.mt_1, org_unit=self.district1, year=None, value=3)
+        csv_content = (
+            f"ADM1_NAME,ADM2_NAME,ADM2_ID,MT1,MT2\n"
+            f"DISTRICT,District 1,{self.district1.id},1,high\n"
+            f"DISTRICT,District 2,{self.district2.id},,20"
+        )
+        serializer = ImportMetricValuesSerializer(
+            data={"file": SimpleUploadedFile("test.csv", csv_content.encode()), "year": 2024},
+            context={"request": self.request},
+        )
+        serializer.is_valid(raise_exception=True)
+        metric_values = serializer.save()
+
+        self.assertEqual(
+            [(mv.org_unit_id, mv.metric_type_id, mv.value, mv.string_value) for mv in metric_values],
+            [
+                (self.district1.id, self.mt_1.id, 1, ""),
+                (self.district1.id, self.mt_2.id, None, "high"),
+                (self.district2.id, self.mt_2.id, 20, ""),
+            ],
+        )
+        # the value without year is replaced
+        self.assertEqual(MetricValue.objects.count(), 3)
+        self.assertFalse(MetricValue.objects.filter(year__isnull=True).exists())
+
+        csv_content = f"ADM1_NAME,ADM2_NAME,ADM2_ID,MT1\nDISTRICT,District 1,{self.district1.id},7.5"
+        serializer = ImportMetricValuesSerializer(
+            data={"file": SimpleUploadedFile("test.csv", csv_content.encode()), "year": 2024},
+            context={"request": self.request},
+        )
+        serializer.is_valid(raise_exception=True)
+        [metric_value] = serializer.save()
+
+        self.assertEqual(metric_value.id, metric_values[0].id)
+        self.assertEqual(MetricValue.objects.get(id=metric_value.id).value, 7.5)
+        self.assertEqual(MetricValue.objects.count(), 3)
+
+    def test_save_refreshes_aggregates(self):
+        country = OrgUnit.objects.create(name="Country", version=self.sw_version_1)
+        region = OrgUnit.objects.create(name="Region", version=self.sw_version_1, parent=country)
+        for district in [self.district1, self.district2]:
+            district.parent = region
+            district.save()
+        MetricValue.objects.create(metric_type=self.mt_1, org_unit=self.district2, year=None, value=100)
+
+        def import_csv(csv_content):
+            serializer = ImportMetricValuesSerializer(
+                data={"file": SimpleUploadedFile("test.csv", csv_content.encode()), "year": 2024},
+                context={"request": self.request},
+            )
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        import_csv(
+            f"ADM1_NAME,ADM2_NAME,ADM2_ID,MT1,MT2\n"
+            f"DISTRICT,District 1,{self.district1.id},1,high\n"
+            f"DISTRICT,District 2,{self.district2.id},3,20"
+        )
+
+        def aggregates():
+            return {
+                (a.metric_type_id, a.org_unit_id, a.level, a.year): (
+                    a.values_count,
+                    a.value_sum,
+                    a.value_avg,
+                    a.value_min,
+                    a.value_max,
+                )
+                for a in MetricValueAggregate.objects.all()
+            }
+
+        # the value without year of District 2 was replaced, the string values are not aggregated
+        self.assertEqual(
+            aggregates(),
+            {
+                (self.mt_1.id, country.id, 0, 2024): (2, 4, 2, 1, 3),
+                (self.mt_1.id, region.id, 1, 2024): (2, 4, 2, 1, 3),
+                (self.mt_2.id, country.id, 0, 2024): (1, 20, 20, 20, 20),
+                (self.mt_2.id, region.id, 1, 2024): (1, 20, 20, 20, 20),
+            },
+        )
+
+        import_csv(f"ADM1_NAME,ADM2_NAME,ADM2_ID,MT1\nDISTRICT,District 1,{self.district1.id},7")
+
+        self.assertEqual(aggregates()[(self.mt_1.id, region.id, 1, 2024)], (2, 10, 5, 3, 7))
+        self.assertEqual(aggregates()[(self.mt_2.id, region.id, 1, 2024)], (1, 20, 20, 20, 20))
+
+        MetricValueAggregate.objects.all().delete()
+        call_command("rebuild_metric_value_aggregates", f"--account-id={self.account.id}")
+        self.assertEqual(aggregates()[(self.mt_1.id, country.id, 0, 2024)], (2, 10, 5, 3, 7))
+
+        # the ordinal values are categories: their aggregates are removed
+        self.mt_2.legend_type = MetricType.LegendType.ORDINAL
+        self.mt_2.save()
+        call_command("rebuild_metric_value_aggregates", f"--account-id={self.account.id}")
+        self.assertFalse(MetricValueAggregate.objects.filter(metric_type=self.mt_2).exists())
+        self.assertEqual(aggregates()[(self.mt_1.id, country.id, 0, 2024)], (2, 10, 5, 3, 7))
+
 
 class ExportMetricValuesSerializerTestCase(TestCase):
     @classmethod
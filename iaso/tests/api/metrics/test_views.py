@@ -5,7 +5,7 @@ from rest_framework import status
 
 from iaso.models.base import Account
 from iaso.models.data_source import DataSource, SourceVersion
-from iaso.models.metric import MetricType, MetricValue
+from iaso.models.metric import MetricType, MetricValue, MetricValueAggregate
 from iaso.models.org_unit import OrgUnit, OrgUnitType
 from iaso.models.project import Project
 from iaso.permissions.core_permissions import CORE_METRIC_TYPES_PERMISSION, CORE_ORG_UNITS_PERMISSION
@@ -540,6 +540,50 @@ class MetricValueAPITestCase(APITestCase):
         returned_ids = {item["id"] for item in data}
         self.assertEqual(returned_ids, {self.metric_value_1.id, self.metric_value_2.id})
 
+    def create_aggregate(self, metric_type, org_unit, level, year, value_sum):
+        return MetricValueAggregate.objects.create(
+            metric_type=metric_type,
+            org_unit=org_unit,
+            level=level,
+            year=year,
+            values_count=1,
+            value_sum=value_sum,
+            value_avg=value_sum,
+            value_min=value_sum,
+            value_max=value_sum,
+        )
+
+    def test_metric_value_aggregates(self):
+        """The aggregates are filtered on level, org unit and reference_year, within the user's account."""
+        region = self.create_aggregate(self.metric_type, self.org_unit, 0, 2020, 250.0)
+        region_timeless = self.create_aggregate(self.metric_type, self.org_unit, 0, None, 999.0)
+        region_2021 = self.create_aggregate(self.metric_type, self.org_unit, 0, 2021, 150.0)
+        district = self.create_aggregate(self.metric_type, self.org_unit_no_location, 1, 2020, 100.0)
+        self.create_aggregate(self.metric_type_wrong_account, self.org_unit, 0, 2020, 1.0)
+
+        self.client.force_authenticate(self.user)
+        url = f"{self.BASE_URL}aggregates/"
+
+        data = self.assertJSONResponse(self.client.get(url), status.HTTP_200_OK)
+        self.assertEqual({item["id"] for item in data}, {region.id, region_timeless.id, region_2021.id, district.id})
+
+        data = self.assertJSONResponse(self.client.get(url, {"level": 1}), status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in data], [district.id])
+        self.assertEqual(data[0]["value_sum"], 100.0)
+
+        data = self.assertJSONResponse(self.client.get(url, {"org_unit_id": self.org_unit.id}), status.HTTP_200_OK)
+        self.assertEqual({item["id"] for item in data}, {region.id, region_timeless.id, region_2021.id})
+
+        data = self.assertJSONResponse(self.client.get(url, {"level": 0, "reference_year": 2020}), status.HTTP_200_OK)
+        self.assertEqual({item["id"] for item in data}, {region.id, region_timeless.id})
+
+        response = self.client.get(url, {"level": "top"})
+        self.assertJSONResponse(response, status.HTTP_400_BAD_REQUEST)
+
+    def test_metric_value_aggregates_unauthenticated(self):
+        response = self.client.get(f"{self.BASE_URL}aggregates/")
+        self.assertJSONResponse(response, status.HTTP_401_UNAUTHORIZED)
+
     def test_metric_value_post(self):
         payload = {
             "metric_type": self.metric_type.id,
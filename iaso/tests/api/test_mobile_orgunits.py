@@ -1,13 +1,20 @@
 import datetime
+import gzip
+import json
+
+from copy import deepcopy
 
 import time_machine
 
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.core.cache import cache
+from django.test import override_settings
 from rest_framework import status
 
+from beanstalk_worker.services import TestTaskService
+from hat.audit.models import ORG_UNIT_API, log_modification
 from iaso.api.mobile.org_units import SHAPE_RESULTS_MAX
-from iaso.api.query_params import APP_ID, IDS, LIMIT, PAGE
+from iaso.api.query_params import APP_ID, CURSOR, IDS, LAST_SYNC, LIMIT, PAGE, SYNC_TOKEN
 from iaso.models import (
     Account,
     DataSource,
@@ -18,10 +25,12 @@ from iaso.models import (
     Instance,
     InstanceFile,
     OrgUnit,
+    OrgUnitPyramidSnapshot,
     OrgUnitReferenceInstance,
     OrgUnitType,
     Project,
     SourceVersion,
+    Task,
 )
 from iaso.permissions.core_permissions import CORE_ORG_UNITS_PERMISSION
 from iaso.test import APITestCase
@@ -535,6 +544,168 @@ class MobileOrgUnitAPITestCase(APITestCase):
         response = self.client.get(BASE_URL, data={APP_ID: BASE_APP_ID, IDS: f"{self.goku.id},-1,{self.goten.id}"})
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_orgunits_cursor_pagination(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID})
+        expected_ids = [ou["id"] for ou in self.assertJSONResponse(response, status.HTTP_200_OK)["orgUnits"]]
+
+        ids = []
+        cursor = "null"
+        while cursor:
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, CURSOR: cursor, LIMIT: 3})
+            page = self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertLessEqual(len(page["orgUnits"]), 3)
+            self.assertEqual(page["has_next"], page["next"] is not None)
+            ids += [ou["id"] for ou in page["orgUnits"]]
+            cursor = page["next"]
+
+        self.assertEqual(ids, expected_ids)
+        self.assertEqual(len(ids), 4)
+
+    @override_settings(MOBILE_ORG_UNITS_SNAPSHOTS=True)
+    def test_orgunits_served_from_snapshot(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID})
+        expected = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(Task.objects.filter(name="build_org_unit_pyramid_snapshot").count(), 1)
+
+        TestTaskService().run_all()
+        snapshot = OrgUnitPyramidSnapshot.objects.get(project=self.project, include_geo_json=False)
+        self.assertEqual(snapshot.org_units_count, 4)
+
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID}, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(b"".join(response.streaming_content))), expected)
+
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID})
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), expected)
+        etag = response["ETag"]
+
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # The snapshot is outdated as soon as the pyramid changes
+        self.goten.name = "Son Goten SSJ"
+        self.goten.save()
+        cache.clear()
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID}, HTTP_IF_NONE_MATCH=etag)
+        org_units = self.assertJSONResponse(response, status.HTTP_200_OK)["orgUnits"]
+        self.assertIn("Son Goten SSJ", [org_unit["name"] for org_unit in org_units])
+        self.assertEqual(Task.objects.filter(name="build_org_unit_pyramid_snapshot").count(), 2)
+
+    def test_orgunits_delta_sync(self):
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        OrgUnit.objects.filter(id=self.bardock.id).update(updated_at=base + datetime.timedelta(minutes=1))
+        OrgUnit.objects.filter(id__in=[self.raditz.id, self.goku.id]).update(
+            updated_at=base + datetime.timedelta(minutes=2)
+        )
+        OrgUnit.objects.filter(id=self.gohan.id).update(updated_at=base + datetime.timedelta(minutes=3))
+        OrgUnit.objects.filter(id=self.goten.id).update(updated_at=base + datetime.timedelta(minutes=10))
+        self.client.force_authenticate(self.user)
+
+        with time_machine.travel(base + datetime.timedelta(minutes=10, seconds=30), tick=False):
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, LAST_SYNC: base.isoformat(), LIMIT: 2})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertEqual([ou["id"] for ou in changes["orgUnits"]], [self.bardock.id, self.raditz.id])
+            self.assertEqual(changes["deleted"], [])
+            self.assertTrue(changes["has_more"])
+
+            # goku is rejected, the device must remove it; goten was saved too recently to be returned yet
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, SYNC_TOKEN: changes[SYNC_TOKEN], LIMIT: 2})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertEqual([ou["id"] for ou in changes["orgUnits"]], [self.gohan.id])
+            self.assertEqual(changes["deleted"], [self.goku.id])
+            self.assertFalse(changes["has_more"])
+            sync_token = changes[SYNC_TOKEN]
+
+        with time_machine.travel(base + datetime.timedelta(minutes=12), tick=False):
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, SYNC_TOKEN: sync_token, LIMIT: 2})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertEqual([ou["id"] for ou in changes["orgUnits"]], [self.goten.id])
+            self.assertFalse(changes["has_more"])
+
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, SYNC_TOKEN: changes[SYNC_TOKEN]})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+            self.assertEqual(changes["orgUnits"], [])
+
+    def test_orgunits_delta_sync_limited_to_roots(self):
+        ff, _created = FeatureFlag.objects.get_or_create(code=FeatureFlag.LIMIT_OU_DOWNLOAD_TO_ROOTS)
+        self.project.feature_flags.add(ff)
+        self.user.iaso_profile.org_units.set([self.goku])
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        OrgUnit.objects.filter(id=self.goku.id).update(
+            validation_status=OrgUnit.VALIDATION_VALID, updated_at=base + datetime.timedelta(minutes=1)
+        )
+        OrgUnit.objects.filter(id__in=[self.bardock.id, self.raditz.id]).update(
+            updated_at=base + datetime.timedelta(minutes=2)
+        )
+        OrgUnit.objects.filter(id=self.goten.id).update(
+            validation_status=OrgUnit.VALIDATION_REJECTED, updated_at=base + datetime.timedelta(minutes=3)
+        )
+        self.client.force_authenticate(self.user)
+
+        with time_machine.travel(base + datetime.timedelta(minutes=10), tick=False):
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, LAST_SYNC: base.isoformat()})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+
+        # bardock and raditz are outside of the roots of the user, they are neither returned nor deleted
+        self.assertEqual([ou["id"] for ou in changes["orgUnits"]], [self.goku.id])
+        self.assertEqual(changes["deleted"], [self.goten.id])
+
+    def test_orgunits_delta_sync_subtree_moves(self):
+        ff, _created = FeatureFlag.objects.get_or_create(code=FeatureFlag.LIMIT_OU_DOWNLOAD_TO_ROOTS)
+        self.project.feature_flags.add(ff)
+        self.user.iaso_profile.org_units.set([self.goku])
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        with time_machine.travel(base, tick=False):
+            self.goku.validation_status = OrgUnit.VALIDATION_VALID
+            self.goku.save()
+            vegeta = OrgUnit.objects.create(
+                org_unit_type=self.super_saiyans,
+                version=self.sw_version_2,
+                name="Vegeta",
+                validation_status=OrgUnit.VALIDATION_VALID,
+            )
+            trunks = OrgUnit.objects.create(
+                parent=vegeta,
+                org_unit_type=self.on_earth,
+                version=self.sw_version_2,
+                name="Trunks",
+                validation_status=OrgUnit.VALIDATION_VALID,
+            )
+            pan = OrgUnit.objects.create(
+                parent=self.gohan,
+                org_unit_type=self.on_earth,
+                version=self.sw_version_2,
+                name="Pan",
+                validation_status=OrgUnit.VALIDATION_VALID,
+            )
+
+        with time_machine.travel(base + datetime.timedelta(minutes=5), tick=False):
+            # vegeta moves into the roots of the user, gohan moves out of them, both with their descendants
+            for org_unit, new_parent in [(vegeta, self.goku), (OrgUnit.objects.get(id=self.gohan.id), self.bardock)]:
+                original_copy = deepcopy(org_unit)
+                org_unit.parent = new_parent
+                org_unit.save()
+                log_modification(original_copy, org_unit, source=ORG_UNIT_API, user=self.user)
+
+        self.client.force_authenticate(self.user)
+        with time_machine.travel(base + datetime.timedelta(minutes=10), tick=False):
+            since = base + datetime.timedelta(minutes=1)
+            response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, LAST_SYNC: since.isoformat()})
+            changes = self.assertJSONResponse(response, status.HTTP_200_OK)
+
+        self.assertCountEqual([ou["id"] for ou in changes["orgUnits"]], [vegeta.id, trunks.id])
+        self.assertCountEqual(changes["deleted"], [self.gohan.id, pan.id])
+
+    def test_orgunits_delta_sync_invalid_token(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, SYNC_TOKEN: "not-a-token"})
+        self.assertJSONResponse(response, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL, {APP_ID: BASE_APP_ID, LAST_SYNC: "yesterday"})
+        self.assertJSONResponse(response, status.HTTP_400_BAD_REQUEST)
+
     def test_create_org_unit_not_authenticated_project_requires_authentication(self):
         count_before = OrgUnit.objects.count()
         response = self.client.post(
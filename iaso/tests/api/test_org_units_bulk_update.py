@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.geos import MultiPolygon, Point, Polygon
 from django.test import tag
@@ -253,6 +255,41 @@ class OrgUnitsBulkUpdateAPITestCase(APITestCase):
 
         self.assertEqual(5, am.Modification.objects.count())
 
+    @tag("iaso_only")
+    @mock.patch("iaso.tasks.org_units_bulk_update.CHUNK_SIZE", 2)
+    def test_org_unit_bulkupdate_in_chunks(self):
+        """The org units are updated by chunks, with the same result as one by one"""
+
+        self.client.force_authenticate(self.yoda)
+        response = self.client.post(
+            "/api/tasks/create/orgunitsbulkupdate/",
+            data={
+                "select_all": True,
+                "validation_status": m.OrgUnit.VALIDATION_REJECTED,
+                "org_unit_type": self.jedi_squad.pk,
+                "groups_added": [self.unofficial_group.pk, self.elite_group.pk],
+                "groups_removed": [self.elite_group.pk],
+            },
+            format="json",
+        )
+        self.assertJSONResponse(response, status.HTTP_201_CREATED)
+        task = self.runAndValidateTask(Task.objects.get(id=response.json()["task"]["id"]), "SUCCESS")
+
+        self.assertEqual(task.end_value, 5)
+        self.assertEqual(task.progress_value, 4)  # start of the last chunk
+        for org_unit in m.OrgUnit.objects.all():
+            self.assertEqual(org_unit.validation_status, m.OrgUnit.VALIDATION_REJECTED)
+            self.assertEqual(org_unit.org_unit_type, self.jedi_squad)
+            self.assertQuerySetEqual(org_unit.groups.all(), [self.unofficial_group])
+
+        self.assertEqual(5, am.Modification.objects.count())
+        modification = am.Modification.objects.get(object_id=self.jedi_council_corruscant.pk)
+        self.assertEqual(modification.content_object, self.jedi_council_corruscant)
+        self.assertEqual(self.yoda, modification.user)
+        self.assertEqual(
+            set(modification.field_diffs()["modified"].keys()), {"validation_status", "org_unit_type", "updated_at"}
+        )
+
     @tag("iaso_only")
     def test_org_unit_bulkupdate_select_all_should_fail_with_restricted_editable_org_unit_types(self):
         """
@@ -2,8 +2,10 @@ import csv
 import datetime
 import io
 import json
+import os
 import typing
 
+from unittest import mock
 from urllib.parse import urlencode
 
 from django.contrib.gis.geos import GEOSGeometry, MultiPolygon, Point, Polygon
@@ -12,9 +14,11 @@ from django.test import SimpleTestCase
 from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
+from hat.api.export_utils import generate_xlsx_file
 from hat.audit.models import Modification
 from iaso import models as m
 from iaso.api.org_units import OrgUnitViewSet
+from iaso.exports import CleaningFileResponse
 from iaso.models import OrgUnit, OrgUnitType
 from iaso.permissions.core_permissions import CORE_ORG_UNITS_PERMISSION, CORE_ORG_UNITS_READ_PERMISSION
 from iaso.test import APITestCase
@@ -727,6 +731,64 @@ class OrgUnitAPITestCase(APITestCase):
         response = self.client.get("/api/orgunits/?asLocation=true&limit=1&group=1")
         self.assertJSONResponse(response, status.HTTP_200_OK)
 
+    def test_org_unit_list_as_location_geo_json(self):
+        """GET /api/orgunits/?asLocation=true joins each org unit to its own simplified shape"""
+        self.client.force_authenticate(self.yoda)
+        response = self.client.get("/api/orgunits/?asLocation=true&limit=50&validation_status=all")
+        response_data = self.assertJSONResponse(response, status.HTTP_200_OK)
+        org_units_by_id = {org_unit["id"]: org_unit for org_unit in response_data}
+
+        geo_json = org_units_by_id[self.jedi_squad_endor_2.pk]["geo_json"]
+        self.assertEqual(len(geo_json["features"]), 1)
+        self.assertEqual(geo_json["features"][0]["id"], self.jedi_squad_endor_2.pk)
+        self.assertEqual(geo_json["features"][0]["geometry"]["type"], "MultiPolygon")
+
+        # Only a location: the feature is there but without geometry
+        geo_json = org_units_by_id[self.jedi_squad_endor.pk]["geo_json"]
+        self.assertEqual(geo_json["features"][0]["id"], self.jedi_squad_endor.pk)
+        self.assertIsNone(geo_json["features"][0]["geometry"])
+
+    def test_org_unit_list_with_shapes(self):
+        """GET /api/orgunits/?withShapes=true returns the simplified shapes as GeoJSON"""
+        self.client.force_authenticate(self.yoda)
+        response = self.client.get("/api/orgunits/?withShapes=true&validation_status=all")
+        response_data = self.assertJSONResponse(response, status.HTTP_200_OK)
+        org_units_by_id = {org_unit["id"]: org_unit for org_unit in response_data["orgUnits"]}
+
+        self.assertIsNone(org_units_by_id[self.jedi_council_corruscant.pk]["geo_json"])
+        geo_json = org_units_by_id[self.jedi_squad_endor_2.pk]["geo_json"]
+        self.assertEqual(geo_json["type"], "FeatureCollection")
+        self.assertEqual(geo_json["crs"], {"type": "name", "properties": {"name": "EPSG:4326"}})
+        self.assertEqual(len(geo_json["features"]), 1)
+        feature = geo_json["features"][0]
+        self.assertEqual(feature["id"], self.jedi_squad_endor_2.pk)
+        self.assertEqual(feature["geometry"]["type"], "MultiPolygon")
+
+    def test_org_unit_list_with_shapes_number_of_queries(self):
+        """The number of queries of ?withShapes=true must not grow with the number of org units having a shape"""
+        self.client.force_authenticate(self.yoda)
+        url = "/api/orgunits/?withShapes=true&validation_status=all"
+
+        with CaptureQueriesContext(connection) as before:
+            response = self.client.get(url)
+        shapes_before = len([ou for ou in response.json()["orgUnits"] if ou["geo_json"]])
+
+        for i in range(5):
+            m.OrgUnit.objects.create(
+                org_unit_type=self.jedi_squad,
+                version=self.sw_version_1,
+                name=f"Endor Jedi Squad extra {i}",
+                simplified_geom=self.mock_multipolygon,
+                validation_status=m.OrgUnit.VALIDATION_VALID,
+            )
+
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+
+        response_data = self.assertJSONResponse(response, status.HTTP_200_OK)
+        self.assertEqual(len([ou for ou in response_data["orgUnits"] if ou["geo_json"]]), shapes_before + 5)
+        self.assertEqual(len(before.captured_queries), len(after.captured_queries))
+
     def test_org_unit_list_without_as_location_with_group(self):
         """
         Test that `build_org_units_queryset()` which sets `.distinct()` clauses
@@ -986,6 +1048,27 @@ class OrgUnitAPITestCase(APITestCase):
         first_row_code = first_row[5]
         self.assertEqual(first_row_code, self.jedi_council_corruscant.code)
 
+    def test_org_units_list_csv_group_membership_columns(self):
+        """Group columns of the csv export contain 1 for members of the group and 0 otherwise"""
+        self.jedi_squad_endor.groups.set([self.elite_group, self.unofficial_group])
+        self.client.force_authenticate(self.yoda)
+
+        response = self.client.get("/api/orgunits/?order=id&csv=true&validation_status=all")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = list(csv.reader(io.StringIO(response.getvalue().decode("utf-8")), delimiter=","))
+
+        headers = data[0]
+        elite_index = headers.index(self.elite_group.name)
+        unofficial_index = headers.index(self.unofficial_group.name)
+        rows_by_id = {int(row[0]): row for row in data[1:]}
+
+        self.assertEqual(rows_by_id[self.jedi_council_corruscant.pk][elite_index], "1")
+        self.assertEqual(rows_by_id[self.jedi_council_corruscant.pk][unofficial_index], "0")
+        self.assertEqual(rows_by_id[self.jedi_squad_endor.pk][elite_index], "1")
+        self.assertEqual(rows_by_id[self.jedi_squad_endor.pk][unofficial_index], "1")
+        self.assertEqual(rows_by_id[self.jedi_council_endor.pk][elite_index], "0")
+        self.assertEqual(rows_by_id[self.jedi_council_endor.pk][unofficial_index], "0")
+
     def test_can_retrieve_org_units_list_in_xlsx_format(self):
         self.client.force_authenticate(self.yoda)
         response = self.client.get("/api/orgunits/?&order=id&xlsx=true")
@@ -1045,6 +1128,32 @@ class OrgUnitAPITestCase(APITestCase):
             },
         )
 
+    def test_org_units_list_xlsx_export_is_written_to_a_temporary_file(self):
+        self.client.force_authenticate(self.yoda)
+        response = self.client.get("/api/orgunits/?&order=id&xlsx=true")
+
+        self.assertIsInstance(response, CleaningFileResponse)
+        path = response._path
+        self.assertTrue(os.path.exists(path))
+        columns, excel_data = self.assertXlsxFileResponse(response)
+        self.assertEqual(len(excel_data["ID"]), 5)
+        # The file is removed once the response has been consumed
+        self.assertFalse(os.path.exists(path))
+
+    def test_generate_xlsx_file_removes_the_file_on_error(self):
+        paths = []
+
+        def write_workbook(path, *args, **kwargs):
+            paths.append(path)
+            raise ValueError("broken row")
+
+        with mock.patch("hat.api.export_utils.write_workbook", side_effect=write_workbook):
+            with self.assertRaises(ValueError):
+                generate_xlsx_file("Org units", ["ID"], OrgUnit.objects.all(), lambda org_unit, **kwargs: [])
+
+        self.assertEqual(len(paths), 1)
+        self.assertFalse(os.path.exists(paths[0]))
+
     def set_up_org_unit_creation(self):
         return self.client.post(
             self.ORG_UNIT_CREATE_URL,
@@ -6,11 +6,13 @@ from django.db import connection
 from rest_framework import status
 
 from iaso import models as m
+from iaso.exports import parquet
 from iaso.permissions.core_permissions import CORE_ORG_UNITS_PERMISSION, CORE_ORG_UNITS_READ_PERMISSION
 from iaso.tests.utils_parquet import (
     BaseAPITransactionTestCase,
     compare_or_create_snapshot,
     read_parquet,
+    read_partitioned_parquet_zip,
     write_response_to_file,
 )
 
@@ -371,6 +373,47 @@ class OrgUnitAPITestCase(BaseAPITransactionTestCase):
         self.assertEqual(endor_row[elite_col], 0)
         self.assertEqual(endor_row[accented_col], 0)
 
+    def test_partitioned_export_zip_layout(self):
+        qs = parquet.build_pyramid_queryset(m.OrgUnit.objects.filter(version=self.sw_version_1), extra_fields=[])
+
+        with tempfile.NamedTemporaryFile(suffix=".zip") as f:
+            stats = parquet.export_django_query_to_partitioned_parquet_zip(qs, f.name, ["org_unit_type_id"])
+            partitions = read_partitioned_parquet_zip(f.name, "org_unit_name")
+
+        self.assertEqual(stats.row_count, 4)
+        self.assertEqual(
+            partitions,
+            {
+                f"org_unit_type_id={self.jedi_council.id}": ["Corruscant Jedi Council", "Endor Jedi Council"],
+                f"org_unit_type_id={self.jedi_squad.id}": ["Endor Jedi Squad 1", "Endor Jedi Squad 2"],
+            },
+        )
+
+    def test_can_retrieve_org_units_partitioned_by_level(self):
+        self.client.force_authenticate(self.yoda)
+
+        response = self.client.get("/api/orgunits/?order=id&parquet=true&partition_by=level")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(".zip", response["Content-Disposition"])
+        with tempfile.NamedTemporaryFile(suffix=".zip") as f:
+            write_response_to_file(response, f)
+            partitions = read_partitioned_parquet_zip(f.name, "org_unit_name")
+
+        self.assertEqual(
+            partitions,
+            {
+                "org_unit_level=1": ["Brussels Jedi Council", "Corruscant Jedi Council", "Endor Jedi Council"],
+                "org_unit_level=2": ["Endor Jedi Squad 1", "Endor Jedi Squad 2"],
+            },
+        )
+
+    def test_bad_request_parquet_validates_unknown_partition_by(self):
+        self.client.force_authenticate(self.yoda)
+        response = self.client.get("/api/orgunits/?order=id&parquet=true&partition_by=bad_param")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("Unknown partition_by for parquet exports: bad_param", response.json()["error"])
+
     def test_bad_request_parquet_validates_unknown_extra_fields(self):
         response = self.client.get("/api/orgunits/?order=id&parquet=true&extra_fields=bad_param")
         self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
@@ -387,7 +430,7 @@ class OrgUnitAPITestCase(BaseAPITransactionTestCase):
         self.assertEqual(
             response.json(),
             {
-                "error": "Unsupported query parameters for parquet exports: unknown_unsupported_filter. Allowed parameters extra_fields, order, parquet, searches"
+                "error": "Unsupported query parameters for parquet exports: unknown_unsupported_filter. Allowed parameters extra_fields, order, parquet, partition_by, searches"
             },
         )
 
@@ -1,17 +1,21 @@
 import json
 import logging
+import threading
+import time
 
 from collections import namedtuple
+from unittest import mock
 
 import responses
 
 from django.core.files.uploadedfile import UploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from iaso.models import (
     AGGREGATE,
     ERRORED,
     EXPORTED,
+    SKIPPED,
     Account,
     DataSource,
     ExportLog,
@@ -347,6 +351,124 @@ class DataValueExporterTests(TestCase):
         instance.refresh_from_db()
         self.assertIsNotNone(instance.last_export_success_at)
 
+    @responses.activate
+    def test_aggregate_export_reports_throughput(self):
+        mapping_version = MappingVersion(
+            name="aggregate", json=build_form_mapping(), form_version=self.form_version, mapping=self.mapping
+        )
+        mapping_version.save()
+        instance = self.build_instance(self.form)
+
+        export_request = ExportRequestBuilder().build_export_request(
+            filters={"period_ids": "201801", "form_id": self.form.id, "org_unit_id": instance.org_unit.id},
+            launcher=self.user,
+        )
+        responses.add(
+            responses.POST,
+            "https://dhis2.com/api/dataValueSets",
+            json=load_dhis2_fixture("datavalues-ok.json"),
+            status=200,
+        )
+        responses.add(responses.POST, "https://dhis2.com/api/completeDataSetRegistrations", json={}, status=200)
+
+        DataValueExporter().export_instances(export_request, self.task)
+
+        self.task.refresh_from_db()
+        self.assertIn("instances/s", self.task.progress_message)
+        self.assertIn("total dhis2 time", self.task.progress_message)
+
+    @override_settings(TASK_PROGRESS_MIN_INTERVAL=60)
+    def test_export_keeps_throttled_progress(self):
+        mapping_version = MappingVersion(
+            name="aggregate", json=build_form_mapping(), form_version=self.form_version, mapping=self.mapping
+        )
+        mapping_version.save()
+        instances = [self.build_instance(self.form) for _ in range(2)]
+
+        export_request = ExportRequestBuilder().build_export_request(
+            filters={"period_ids": "201801", "form_id": self.form.id, "org_unit_id": instances[0].org_unit.id},
+            launcher=self.user,
+        )
+
+        exporter = DataValueExporter()
+        page_stats = {"exported_count": 1, "errored_count": 0, "dhis2_time": 0, "batched_time": 0, "export_logs": []}
+        with mock.patch.object(exporter, "_export_page", return_value=page_stats):
+            exporter.export_instances(export_request, self.task, page_size=1)
+
+        # the progress of the pages was only in memory when the export ended
+        self.task.refresh_from_db()
+        self.assertIn("page 1/2", self.task.progress_message)
+        self.assertIn("page 2/2", self.task.progress_message)
+
+    def test_export_pages_are_pipelined_with_bounded_concurrency(self):
+        mapping_version = MappingVersion(
+            name="aggregate", json=build_form_mapping(), form_version=self.form_version, mapping=self.mapping
+        )
+        mapping_version.save()
+        instances = [self.build_instance(self.form) for _ in range(4)]
+
+        export_request = ExportRequestBuilder().build_export_request(
+            filters={"period_ids": "201801", "form_id": self.form.id, "org_unit_id": instances[0].org_unit.id},
+            launcher=self.user,
+        )
+
+        lock = threading.Lock()
+        running = {"current": 0, "max": 0}
+
+        def fake_export_page(prefix, data, export_statuses):
+            with lock:
+                running["current"] += 1
+                running["max"] = max(running["max"], running["current"])
+            time.sleep(0.2)
+            with lock:
+                running["current"] -= 1
+            return {"exported_count": 0, "errored_count": 0, "dhis2_time": 0.2, "batched_time": 0, "export_logs": []}
+
+        exporter = DataValueExporter(max_workers=2)
+        with mock.patch.object(exporter, "_export_page", side_effect=fake_export_page) as export_page:
+            exporter.export_instances(export_request, self.task, page_size=1)
+
+        self.assertEqual(export_page.call_count, 4)
+        self.assertEqual(running["max"], 2)
+        self.expect_logs(EXPORTED)
+
+    def test_export_pages_in_flight_are_flagged_when_a_page_fails(self):
+        mapping_version = MappingVersion(
+            name="aggregate", json=build_form_mapping(), form_version=self.form_version, mapping=self.mapping
+        )
+        mapping_version.save()
+        instances = [self.build_instance(self.form) for _ in range(3)]
+
+        export_request = ExportRequestBuilder().build_export_request(
+            filters={"period_ids": "201801", "form_id": self.form.id, "org_unit_id": instances[0].org_unit.id},
+            launcher=self.user,
+        )
+
+        def fake_export_page(prefix, data, export_statuses):
+            if prefix.startswith("page 1/"):
+                time.sleep(0.1)
+                raise RuntimeError("DHIS2 is down")
+            return {
+                "exported_count": len(export_statuses),
+                "errored_count": 0,
+                "dhis2_time": 0,
+                "batched_time": 0,
+                "export_logs": [],
+            }
+
+        exporter = DataValueExporter(max_workers=2)
+        with mock.patch.object(exporter, "_export_page", side_effect=fake_export_page) as export_page:
+            exporter.export_instances(export_request, self.task, page_size=1)
+
+        # page 2 was sent while page 1 was failing, page 3 was never sent
+        self.assertEqual(export_page.call_count, 2)
+        self.assertEqual(
+            list(export_request.exportstatus_set.order_by("id").values_list("status", flat=True)),
+            [ERRORED, EXPORTED, SKIPPED],
+        )
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, ERRORED)
+
     @responses.activate
     def test_aggregate_export_works_with_2_forms(self):
         self.setUpFormQuality()
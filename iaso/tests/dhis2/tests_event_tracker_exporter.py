@@ -15,7 +15,12 @@ from django.contrib.gis.geos import Point
 from django.core.files import File
 from django.test import TestCase
 
-from iaso.dhis2.datavalue_exporter import DataValueExporter, EventTrackerHandler
+from iaso.dhis2.datavalue_exporter import (
+    DataValueExporter,
+    EventTrackerHandler,
+    OrgUnitResolver,
+    orgunit_question_keys,
+)
 from iaso.dhis2.export_request_builder import ExportRequestBuilder
 from iaso.models import (
     ERRORED,
@@ -554,6 +559,46 @@ class DataValueExporterTests(TestCase):
             trackedentity[2],
         )
 
+    def test_orgunit_question_keys(self):
+        mapping_json = build_form_mapping()
+
+        self.assertEqual(orgunit_question_keys(mapping_json), {"ST01DE3"})
+
+    def test_orgunit_resolver_uses_prefetched_orgunits(self):
+        instance = self.build_instance(
+            self.form,
+            {
+                "tea_unique_number": "CDLM-00001-45",
+                "ST01DE2": "Bounty",
+                "ST01DE3": str(self.another_org_unit.id),
+            },
+        )
+        mapping_json = build_form_mapping()
+        del mapping_json["question_mappings"]["ST01DE3"][0]["iaso_field"]
+
+        resolver = OrgUnitResolver()
+        with self.assertNumQueries(1):
+            resolver.prefetch({str(self.another_org_unit.id), str(self.org_unit.id), "not_an_id"})
+
+        trackedentity, errors = EventTrackerHandler(resolver).map_to_values(instance, mapping_json)
+
+        self.assertEqual(
+            trackedentity[2]["enrollments"][0]["events"][0]["dataValues"][1],
+            {"dataElement": "ST01DE3_DHIS2_ID", "value": "ANOTHER_OU_DHIS2_ID"},
+        )
+        self.assertEqual((resolver.hits, resolver.misses), (1, 0))
+
+    def test_orgunit_resolver_queries_an_orgunit_once(self):
+        resolver = OrgUnitResolver()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver(str(self.another_org_unit.id)), "ANOTHER_OU_DHIS2_ID")
+            self.assertEqual(resolver(str(self.another_org_unit.id)), "ANOTHER_OU_DHIS2_ID")
+            self.assertEqual(resolver("OU_DHIS2_ID"), "OU_DHIS2_ID")
+
+        self.assertEqual((resolver.hits, resolver.misses), (1, 1))
+        self.assertEqual(resolver.stats_message(), "org unit cache: 1 hits, 1 misses")
+
     @responses.activate
     def test_event_export_works_on_existing_tracked_entity(self):
         mapping_version = MappingVersion(
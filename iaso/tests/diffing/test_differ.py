@@ -1,10 +1,16 @@
 import datetime
 
+from unittest import mock
+
 import time_machine
 
 from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from iaso import models as m
 from iaso.diffing import Differ
+from iaso.diffing.differ import merge_pyramids
 from iaso.tests.diffing.utils import PyramidBaseTest
 
 
@@ -403,3 +409,99 @@ class DifferTestCase(PyramidBaseTest):
         self.assertEqual(country_diff.status, Differ.STATUS_MODIFIED)
         self.assertEqual(country_diff.orgunit_ref.id, self.angola_country_to_compare_with.id)
         self.assertEqual(country_diff.orgunit_dhis2.id, self.angola_country_to_update.id)
+
+    def test_stream_diff(self):
+        """
+        Test that `diff` returns the streamed diffs, ordered by source_ref.
+        """
+        self.angola_district_to_compare_with.name = "Cuvango new"
+        self.angola_district_to_compare_with.save()
+        self.angola_country_to_compare_with.name = "Angola new"
+        self.angola_country_to_compare_with.save()
+
+        params = {
+            "version": self.source_version_to_update,
+            "version_ref": self.source_version_to_compare_with,
+            "ignore_groups": True,
+            "field_names": ["name", "code"],
+        }
+        diffs, fields = Differ().diff(**params)
+        streamed_diffs, streamed_fields = Differ().stream_diff(**params)
+        streamed_diffs = list(streamed_diffs)
+
+        self.assertEqual(fields, streamed_fields)
+        self.assertEqual([diff.org_unit.source_ref for diff in streamed_diffs], ["id-1", "id-3"])
+        self.assertEqual(
+            [(diff.orgunit_ref.id, diff.orgunit_dhis2.id, diff.status) for diff in streamed_diffs],
+            [(diff.orgunit_ref.id, diff.orgunit_dhis2.id, diff.status) for diff in diffs],
+        )
+
+    def test_diff_deleted_org_units_in_bulk(self):
+        """
+        Test that the number of queries doesn't depend on the number of deleted org units.
+        """
+
+        def diff_deleted():
+            with CaptureQueriesContext(connection) as queries:
+                diffs, _ = Differ().diff(
+                    version=self.source_version_to_update,
+                    version_ref=self.source_version_to_compare_with,
+                    ignore_groups=False,
+                    show_deleted_org_units=True,
+                    field_names=["name"],
+                )
+            return [diff for diff in diffs if diff.orgunit_ref is None], len(queries)
+
+        for i in range(3):
+            m.OrgUnit.objects.create(version=self.source_version_to_update, source_ref=f"deleted-{i}", name=f"{i}")
+        deleted_diffs, queries_count = diff_deleted()
+        self.assertEqual(len(deleted_diffs), 3)
+        for diff in deleted_diffs:
+            self.assertEqual(diff.status, Differ.STATUS_NOT_IN_ORIGIN)
+            self.assertEqual(diff.comparisons[0].after, None)
+            self.assertEqual(diff.comparisons[0].distance, 100)
+
+        for i in range(3, 10):
+            m.OrgUnit.objects.create(version=self.source_version_to_update, source_ref=f"deleted-{i}", name=f"{i}")
+        deleted_diffs, more_queries_count = diff_deleted()
+        self.assertEqual(len(deleted_diffs), 10)
+        self.assertEqual(queries_count, more_queries_count)
+
+    def test_merge_pyramids(self):
+        rows_dhis2 = [
+            {"source_ref": "a"},
+            {"source_ref": "b"},
+            {"source_ref": "b"},
+            {"source_ref": None},
+            {"source_ref": None},
+        ]
+        rows_ref = [{"source_ref": "b"}, {"source_ref": "c"}, {"source_ref": None}]
+
+        self.assertEqual(
+            [(source_ref, len(dhis2), len(ref)) for source_ref, dhis2, ref in merge_pyramids(rows_dhis2, rows_ref)],
+            [("a", 1, 0), ("b", 2, 1), ("c", 0, 1), (None, 0, 1), (None, 1, 0), (None, 1, 0)],
+        )
+
+    def test_diff_deleted_org_units_without_source_ref(self):
+        """
+        Test that each org unit without source_ref is reported as deleted, without any duplicate warning.
+        """
+        deleted = [
+            m.OrgUnit.objects.create(version=self.source_version_to_update, source_ref=None, name=f"no ref {i}")
+            for i in range(2)
+        ]
+
+        with mock.patch("iaso.diffing.differ.logger.warning") as warning:
+            diffs, _ = Differ().diff(
+                version=self.source_version_to_update,
+                version_ref=self.source_version_to_compare_with,
+                ignore_groups=True,
+                show_deleted_org_units=True,
+                field_names=["name"],
+            )
+
+        warning.assert_not_called()
+        deleted_diffs = [diff for diff in diffs if diff.orgunit_ref is None and diff.orgunit_dhis2.source_ref is None]
+        self.assertCountEqual([diff.orgunit_dhis2.id for diff in deleted_diffs], [org_unit.id for org_unit in deleted])
+        for diff in deleted_diffs:
+            self.assertEqual(diff.status, Differ.STATUS_NOT_IN_ORIGIN)
@@ -1,6 +1,8 @@
 import tempfile
+import zipfile
 
 from iaso.exports import parquet
+from iaso.exports.duckdb_util import get_duckdb_export_engine
 from iaso.exports.pyramid import _safe_group_name, build_group_annotations
 from iaso.models import DataSource, Group, OrgUnit, SourceVersion
 from iaso.test import TestCase
@@ -134,3 +136,23 @@ class PyramidExportTest(TestCase):
             ["org_unit_groups", "VARCHAR"],
         ]
         self.assertEqual(actual_columns, expected)
+
+    def test_export_stats_come_from_the_copy_result(self):
+        qs = parquet.build_pyramid_queryset(OrgUnit.objects, extra_fields=[])
+        with tempfile.NamedTemporaryFile(suffix=".parquet") as tmpfile:
+            stats = parquet.export_django_query_to_parquet_via_duckdb(qs, tmpfile.name)
+            actual_columns = get_columns_from_parquet(tmpfile)
+
+        self.assertEqual(stats.row_count, 0)
+        self.assertEqual(stats.column_count, len(actual_columns))
+
+    def test_export_engine_is_reused(self):
+        self.assertIs(get_duckdb_export_engine(), get_duckdb_export_engine())
+
+    def test_partitioned_export_is_a_zip_file(self):
+        qs = parquet.build_pyramid_queryset(OrgUnit.objects, extra_fields=[])
+        with tempfile.NamedTemporaryFile(suffix=".zip") as tmpfile:
+            stats = parquet.export_django_query_to_partitioned_parquet_zip(qs, tmpfile.name, ["org_unit_type_id"])
+            self.assertTrue(zipfile.is_zipfile(tmpfile.name))
+
+        self.assertEqual(stats.row_count, 0)
@@ -1,7 +1,7 @@
 from django.contrib.gis.geos import Point
 
 from hat.audit.models import Modification
-from iaso.gpkg.import_gpkg import import_gpkg_file
+from iaso.gpkg.import_gpkg import calculate_paths_in_memory, import_gpkg_file
 from iaso.models import Account, DataSource, Group, OrgUnit, OrgUnitType, Project, SourceVersion
 from iaso.test import TestCase
 
@@ -180,6 +180,29 @@ class GPKGImport(TestCase):
 
         self.assertEqual(new["fields"]["name"], "AS Tongo Gadima")
 
+    def test_import_moves_the_descendants_of_the_imported_org_units(self):
+        source = DataSource.objects.create(name="hey")
+        source.projects.add(self.project)
+        version = SourceVersion.objects.create(number=2, data_source=source)
+        csi = OrgUnit.objects.create(name="bla2", source_ref="3c24c6ca-3012-4d38-abe8-6d620fe1deb8", version=version)
+        health_post = OrgUnit.objects.create(name="Health post", source_ref="health_post", version=version, parent=csi)
+        updated_at_before = health_post.updated_at
+
+        import_gpkg_file(
+            "./iaso/tests/fixtures/gpkg/minimal.gpkg",
+            source_name="hey",
+            version_number=2,
+            validation_status="new",
+            description="",
+        )
+
+        csi.refresh_from_db()
+        health_post.refresh_from_db()
+        self.assertEqual(csi.parent.name, "AS Tongo Gadima")
+        self.assertEqual(str(health_post.path), f"{csi.path}.{health_post.id}")
+        # the delta sync of the mobile app and the pyramid snapshots see the moved descendants
+        self.assertGreater(health_post.updated_at, updated_at_before)
+
     def test_minimal_import_dont_modify_if_diff_source(self):
         version_number = 1
         source_name = "hey"
@@ -492,6 +515,36 @@ class GPKGImportSimplifiedGroup(TestCase):
         ou = OrgUnit.objects.get(source_ref="3c24c6ca-3012-4d38-abe8-6d620fe1deb8")
         self.assertEqual(ou.groups.count(), 3)
 
+    def test_calculate_paths_in_memory(self):
+        version = SourceVersion.objects.create(number=3, data_source=DataSource.objects.create(name="paths"))
+        root_a = OrgUnit.objects.create(name="A", version=version)
+        root_b = OrgUnit.objects.create(name="B", version=version)
+        child = OrgUnit.objects.create(name="C", version=version, parent=root_a)
+        grandchild = OrgUnit.objects.create(name="D", version=version, parent=child)
+        new_child = OrgUnit.objects.create(name="E", version=version)
+
+        # move C (and D) under B, and add E under D
+        child.parent = root_b
+        new_child.parent = grandchild
+        updated = calculate_paths_in_memory([grandchild, new_child, child, root_a, root_b])
+
+        self.assertCountEqual(updated, [child, grandchild, new_child])
+        self.assertEqual(child.path, [str(root_b.pk), str(child.pk)])
+        self.assertEqual(grandchild.path, [str(root_b.pk), str(child.pk), str(grandchild.pk)])
+        self.assertEqual(new_child.path, [str(root_b.pk), str(child.pk), str(grandchild.pk), str(new_child.pk)])
+
+    def test_calculate_paths_in_memory_skips_cycles(self):
+        version = SourceVersion.objects.create(number=4, data_source=DataSource.objects.create(name="cycles"))
+        first = OrgUnit.objects.create(name="first", version=version)
+        second = OrgUnit.objects.create(name="second", version=version, parent=first)
+        first_path = first.path
+
+        first.parent = second
+        updated = calculate_paths_in_memory([first, second])
+
+        self.assertEqual(updated, [])
+        self.assertEqual(first.path, first_path)
+
     def test_import_orgunit_non_existing_group(self):
         # Group is referenced in gpkg but don't exist in gpkg or in source
         with self.assertRaises(ValueError):
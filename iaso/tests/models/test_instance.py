@@ -1,3 +1,6 @@
+from io import StringIO
+
+from bs4 import BeautifulSoup as Soup  # type: ignore
 from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.uploadedfile import UploadedFile
@@ -5,9 +8,12 @@ from django.utils.timezone import now
 from rest_framework import status
 
 from iaso import models as m
+from iaso.models.instances import get_xml_parsing_spec
 from iaso.odk import parsing
 from iaso.permissions.core_permissions import CORE_FORMS_PERMISSION
 from iaso.test import APITestCase, FileUploadToTestCase, IasoTestCaseMixin, TestCase
+from iaso.utils import flat_parse_xml, flat_parse_xml_soup
+from iaso.utils.emoji import fix_emoji
 
 
 class InstanceBase(IasoTestCaseMixin):
@@ -417,6 +423,74 @@ class InstanceModelTestCase(TestCase, InstanceBase):
             },
         )
 
+    def test_xml_to_json_caches_parsing_spec_per_form_version(self):
+        with open("iaso/tests/fixtures/odk_instance_repeat_group_form.xlsx", "rb") as form_1_version_1_file:
+            survey = parsing.parse_xls_form(form_1_version_1_file)
+            form_version = m.FormVersion.objects.create_for_form_and_survey(
+                form=self.form_1, survey=survey, xls_file=File(form_1_version_1_file)
+            )
+            form_version.version_id = "202008121012"  # force version to match instance files
+            form_version.save()
+
+        instances = [
+            m.Instance.objects.create(
+                form=self.form_1,
+                period="202001",
+                org_unit=self.org_unit_1,
+                file=UploadedFile(open("iaso/tests/fixtures/odk_instance_repeat_group.xml")),
+            )
+            for _ in range(3)
+        ]
+
+        misses = get_xml_parsing_spec.cache_info().misses
+        json_instances = [instance.get_and_save_json_of_xml() for instance in instances]
+        self.assertEqual(get_xml_parsing_spec.cache_info().misses, misses + 1)
+        self.assertEqual(json_instances[0], json_instances[2])
+        self.assertEqual(len(json_instances[0]["hh_repeat"]), 2)
+
+        # a modified form version is parsed again
+        form_version.start_period = "202001"
+        form_version.save()
+        instances[0].get_and_save_json_of_xml(force=True)
+        self.assertEqual(get_xml_parsing_spec.cache_info().misses, misses + 2)
+
+    def test_flat_parse_xml_same_as_soup(self):
+        fixtures = [
+            ("odk_instance_repeat_group.xml", ["hh_repeat"], None),
+            ("odk_instance_repeat_group.xml", ["hh_repeat"], {"is_existing", "gender", "meta", "meta/instanceID"}),
+            ("edit_existing_submission.xml", [], None),
+            ("submission_with_emoji.xml", [], None),
+            ("hydroponics_test_upload_with_encoding.xml", [], None),
+            ("hydroponics_test_upload_without_version.xml", [], None),
+        ]
+        for name, repeat_groups, allowed_paths in fixtures:
+            with self.subTest(name=name, allowed_paths=allowed_paths):
+                with open(f"iaso/tests/fixtures/{name}", "rb") as xml_file:
+                    content = fix_emoji(xml_file.read().decode("utf-8"))
+                soup = Soup(StringIO(content.decode("utf-8")), "lxml-xml")
+
+                flat_results = flat_parse_xml(content, repeat_groups, allowed_paths)
+
+                self.assertEqual(
+                    flat_results["flat_json"], flat_parse_xml_soup(soup, repeat_groups, allowed_paths)["flat_json"]
+                )
+
+    def test_flat_parse_xml_edge_cases(self):
+        cases = [
+            b"",
+            b"not xml",
+            b'<data version="1"><a>1</a>',
+            b'<!-- comment --><data version="1"><a> </a><b>x<!-- c -->y</b></data>',
+            b'<data version="1"><a><![CDATA[<b>]]></a><b>&amp;&#233;</b><c/></data>',
+        ]
+        for content in cases:
+            with self.subTest(content=content):
+                soup = Soup(StringIO(content.decode("utf-8")), "lxml-xml")
+
+                self.assertEqual(
+                    flat_parse_xml(content, [], None)["flat_json"], flat_parse_xml_soup(soup, [], None)["flat_json"]
+                )
+
     def test_xml_to_json_should_support_xml_without_version(self):
         instance = m.Instance.objects.create(
             form=self.form_1,
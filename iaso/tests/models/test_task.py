@@ -0,0 +1,68 @@
+from django.test import override_settings
+
+from iaso import models as m
+from iaso.models import ERRORED, KILLED, RUNNING, KilledException
+from iaso.test import TestCase
+
+
+class TaskModelTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = m.Account.objects.create(name="Account")
+
+    def setUp(self):
+        self.task = m.Task.objects.create(account=self.account, name="org_unit_bulk_update", status=RUNNING)
+
+    @override_settings(TASK_PROGRESS_MIN_INTERVAL=60)
+    def test_progress_writes_are_coalesced(self):
+        self.task.report_progress_and_stop_if_killed(progress_value=1, end_value=10, progress_message="Started")
+
+        with self.assertNumQueries(0):
+            self.task.report_progress_and_stop_if_killed(progress_value=2, progress_message="2 done")
+            self.task.report_progress_and_stop_if_killed(progress_value=3, progress_message="3 done")
+
+        self.assertEqual(self.task.progress_value, 3)
+        db_task = m.Task.objects.get(id=self.task.id)
+        self.assertEqual((db_task.progress_value, db_task.end_value, db_task.progress_message), (1, 10, "Started"))
+
+        self.task.report_progress_and_stop_if_killed(progress_value=4, force=True)
+
+        db_task.refresh_from_db()
+        self.assertEqual((db_task.progress_value, db_task.end_value, db_task.progress_message), (4, 10, "3 done"))
+        self.assertEqual(
+            list(m.TaskLog.objects.filter(task=self.task).order_by("id").values_list("message", flat=True)),
+            ["Started", "3 done"],
+        )
+
+    def test_progress_write_is_targeted(self):
+        m.Task.objects.filter(id=self.task.id).update(name="renamed")
+
+        with self.assertNumQueries(3):  # kill flag, progress update and task log
+            self.task.report_progress_and_stop_if_killed(progress_value=5, progress_message="5 done")
+
+        db_task = m.Task.objects.get(id=self.task.id)
+        self.assertEqual((db_task.name, db_task.progress_value), ("renamed", 5))
+
+    def test_progress_stops_killed_task(self):
+        m.Task.objects.filter(id=self.task.id).update(should_be_killed=True)
+
+        with self.assertRaises(KilledException):
+            self.task.report_progress_and_stop_if_killed(progress_value=5)
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, KILLED)
+        self.assertEqual(self.task.result, {"result": KILLED, "message": "Killed"})
+
+    @override_settings(TASK_PROGRESS_MIN_INTERVAL=60)
+    def test_throttled_progress_survives_terminate_with_error(self):
+        self.task.report_progress_and_stop_if_killed(progress_value=1, progress_message="Started")
+        self.task.report_progress_and_stop_if_killed(progress_value=2, progress_message="2 done")
+
+        self.task.terminate_with_error("Failed")
+
+        db_task = m.Task.objects.get(id=self.task.id)
+        self.assertEqual((db_task.status, db_task.progress_value, db_task.progress_message), (ERRORED, 2, "2 done"))
+        self.assertEqual(
+            list(m.TaskLog.objects.filter(task=self.task).order_by("id").values_list("message", flat=True)),
+            ["Started", "2 done", "Failed"],
+        )
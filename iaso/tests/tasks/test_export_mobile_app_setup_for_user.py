@@ -3,11 +3,14 @@ import zipfile
 
 from unittest import mock
 
+import requests
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from iaso.models import SUCCESS, Account, Project, Task
 from iaso.tasks.export_mobile_app_setup_for_user import export_mobile_app_setup_for_user
+from iaso.tasks.utils.in_process_api_client import InProcessIasoClient
 from iaso.utils.encryption import decrypt_file
 
 
@@ -52,7 +55,7 @@ class ExportMobileAppSetupForUserTest(TestCase):
             account=Account.objects.first(),
         )
 
-    @mock.patch("iaso.tasks.export_mobile_app_setup_for_user.IasoClient")
+    @mock.patch("iaso.tasks.export_mobile_app_setup_for_user.InProcessIasoClient")
     @mock.patch("boto3.client")
     def test_export(self, mock_s3_client, MockIasoClient):
         iaso_client_mock = mock.MagicMock()
@@ -96,3 +99,39 @@ class ExportMobileAppSetupForUserTest(TestCase):
         self.assertIn("storage-blacklisted.json", created_files)
         self.assertIn("storage-passwords.json", created_files)
         self.assertIn("workflows.json", created_files)
+        # one page per paginated resource, whatever the order in which they were fetched
+        self.assertEqual(len(created_files), len(set(created_files)))
+
+    @override_settings(MOBILE_APP_EXPORT_MAX_WORKERS=1)
+    @mock.patch("boto3.client")
+    def test_export_in_process(self, mock_s3_client):
+        mock_s3_client.return_value = mock.MagicMock()
+
+        export_mobile_app_setup_for_user(
+            user_id=self.user.id,
+            project_id=self.project.id,
+            password="supersecret",
+            task=self.task,
+            _immediate=True,
+        )
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, SUCCESS, self.task.result)
+        zip_name = self.task.result["data"].replace("file:export-files/", "")
+        created_files = _get_files_in_zipfile(os.path.join("/tmp", zip_name.replace(".zip", "")), zip_name)
+        self.assertIn("app.json", created_files)
+        self.assertIn("orgunittypes.json", created_files)
+        self.assertIn("orgunits-1.json", created_files)
+        self.assertNotIn("entities-1.json", created_files)
+
+
+class InProcessIasoClientTest(TestCase):
+    fixtures = ["user.yaml"]
+
+    def test_get(self):
+        client = InProcessIasoClient(server_url="https://iaso.example.com")
+        app_info = client.get("/api/apps/current/?app_id=com.fixtures.app")
+        self.assertEqual(app_info["name"], "Fixtures")
+
+        with self.assertRaises(requests.HTTPError):
+            client.get("/api/apps/current/?app_id=not.an.app")
@@ -0,0 +1,96 @@
+import datetime
+
+from django.test import override_settings
+from django.utils import timezone
+
+from beanstalk_worker.services import TestTaskService
+from iaso import models as m
+from iaso.models import QUEUED, RUNNING
+from iaso.test import TestCase
+
+
+class TaskServiceTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = m.Account.objects.create(name="Account")
+
+    def create_task(self, name, status=QUEUED):
+        return m.Task.objects.create(account=self.account, name=name, status=status)
+
+    def test_claim_next_in_creation_order(self):
+        first = self.create_task("org_unit_bulk_update")
+        second = self.create_task("export_org_units")
+        task_service = TestTaskService()
+
+        claimed = task_service.claim_next()
+        self.assertEqual(claimed, first)
+        self.assertEqual(claimed.status, RUNNING)
+        self.assertIsNotNone(claimed.started_at)
+        first.refresh_from_db()
+        self.assertEqual(first.status, RUNNING)
+
+        self.assertEqual(task_service.claim_next(), second)
+        self.assertIsNone(task_service.claim_next())
+
+    @override_settings(TASK_WORKER_PRIORITIES={"org_unit_bulk_update": 10, "import_gpkg_task": -1})
+    def test_claim_next_by_priority(self):
+        gpkg = self.create_task("import_gpkg_task")
+        export = self.create_task("export_org_units")
+        bulk_update = self.create_task("org_unit_bulk_update")
+        task_service = TestTaskService()
+
+        self.assertEqual(
+            [task_service.claim_next() for _ in range(3)],
+            [bulk_update, export, gpkg],
+        )
+
+    @override_settings(TASK_WORKER_CONCURRENCY_LIMITS={"import_gpkg_task": 1})
+    def test_claim_next_respects_concurrency_limits(self):
+        running_gpkg = self.create_task("import_gpkg_task", status=RUNNING)
+        queued_gpkg = self.create_task("import_gpkg_task")
+        export = self.create_task("export_org_units")
+        task_service = TestTaskService()
+
+        self.assertEqual(task_service.claim_next(), export)
+        self.assertIsNone(task_service.claim_next())
+
+        running_gpkg.status = m.SUCCESS
+        running_gpkg.save()
+        self.assertEqual(task_service.claim_next(), queued_gpkg)
+
+    @override_settings(TASK_WORKER_CONCURRENCY_LIMITS={"import_gpkg_task": 1}, TASK_WORKER_STALE_RUNNING_TIMEOUT=3600)
+    def test_claim_next_ignores_stale_running_tasks(self):
+        stale_gpkg = self.create_task("import_gpkg_task", status=RUNNING)
+        m.Task.objects.filter(id=stale_gpkg.id).update(started_at=timezone.now() - datetime.timedelta(hours=2))
+        queued_gpkg = self.create_task("import_gpkg_task")
+        task_service = TestTaskService()
+
+        # the stale task doesn't hold the slot, the new one does
+        self.assertEqual(task_service.claim_next(), queued_gpkg)
+        self.create_task("import_gpkg_task")
+        self.assertIsNone(task_service.claim_next())
+
+    @override_settings(TASK_WORKER_CONCURRENCY_LIMITS={"import_gpkg_task": 1}, TASK_WORKER_STALE_RUNNING_TIMEOUT=3600)
+    def test_claim_next_counts_long_running_tasks_reporting_progress(self):
+        long_gpkg = self.create_task("import_gpkg_task", status=RUNNING)
+        m.Task.objects.filter(id=long_gpkg.id).update(started_at=timezone.now() - datetime.timedelta(hours=2))
+        m.TaskLog.objects.create(task=long_gpkg, message="page 100/200")
+        self.create_task("import_gpkg_task")
+        task_service = TestTaskService()
+
+        # the task still reports its progress, it holds the slot
+        self.assertIsNone(task_service.claim_next())
+
+        m.TaskLog.objects.filter(task=long_gpkg).update(
+            created_at=timezone.now() - datetime.timedelta(hours=1, minutes=1)
+        )
+        self.assertIsNotNone(task_service.claim_next())
+
+    def test_claim_only_once(self):
+        task = self.create_task("org_unit_bulk_update")
+        other_worker_task = m.Task.objects.get(id=task.id)
+        task_service = TestTaskService()
+
+        self.assertTrue(task_service.claim(task))
+        self.assertFalse(task_service.claim(other_worker_task))
+        self.assertIsNone(task_service.claim_next())
@@ -1,3 +1,7 @@
+import os
+import tempfile
+import zipfile
+
 from io import StringIO
 from pathlib import Path
 
@@ -89,6 +93,20 @@ def read_parquet(f):
     return rows
 
 
+def read_partitioned_parquet_zip(path, column):
+    """Values of `column` in each partition of a zipped hive partitioned dataset, by partition directory"""
+    partitions = {}
+    with tempfile.TemporaryDirectory() as directory:
+        with zipfile.ZipFile(path) as zipf:
+            names = zipf.namelist()
+            zipf.extractall(directory)
+        with duckdb.connect() as con:
+            for name in names:
+                values = con.execute(f"SELECT \"{column}\" FROM read_parquet('{directory}/{name}')").fetchall()
+                partitions.setdefault(os.path.dirname(name), []).extend(value for (value,) in values)
+    return {partition: sorted(values) for partition, values in partitions.items()}
+
+
 def write_response_to_file(response, f):
     for chunk in response.streaming_content:
         f.write(chunk)
@@ -1,9 +1,11 @@
 """This module provides various utils and helpers for IASO"""
 
+from io import BytesIO
 from typing import Any, Dict, Iterable, List, Optional
 
 from bs4 import BeautifulSoup as Soup  # type: ignore
 from django.utils.text import slugify
+from lxml import etree  # type: ignore
 
 
 def get_flat_children_tree(current_path, el, flat_xml_dict, repeat_groups, allowed_paths, skipped_path):
@@ -72,6 +74,111 @@ def flat_parse_xml_soup(soup: Soup, repeat_groups: List[Any], allowed_paths: Opt
     return {"flat_json": flat_xml_dict, "skipped_paths": []}
 
 
+def peek_xml_form_version_id(content: bytes) -> Optional[str]:
+    """Return the `version` attribute of the root element, only parsing the beginning of the XML document."""
+    try:
+        for _event, element in etree.iterparse(BytesIO(content), events=("start",), encoding="utf-8", recover=True):
+            return element.get("version")
+    except etree.XMLSyntaxError:
+        pass
+    return None
+
+
+_XML_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _soup_string(chunk: str) -> str:
+    """Like BeautifulSoup, collapse a string made only of spaces to a single newline or space"""
+    if chunk.strip(_XML_SPACES):
+        return chunk
+    return "\n" if "\n" in chunk else " "
+
+
+class _XMLFrame:
+    """An open element while streaming the XML in `flat_parse_xml`"""
+
+    __slots__ = ("name", "path", "children_path", "target", "allowed_paths", "is_repeat", "has_children")
+
+    def __init__(self, name, path, children_path, target, allowed_paths, is_repeat=False):
+        self.name = name
+        self.path = path
+        self.children_path = children_path
+        self.target = target
+        self.allowed_paths = allowed_paths
+        self.is_repeat = is_repeat
+        self.has_children = False
+
+
+def flat_parse_xml(
+    content: bytes, repeat_groups: Iterable[str], allowed_paths: Optional[Iterable[str]]
+) -> Dict[str, Any]:
+    """
+    Same as `flat_parse_xml_soup`, but streaming the utf-8 encoded XML `content` with `lxml.etree.iterparse` instead of building a
+    BeautifulSoup tree, elements being discarded as soon as they are parsed.
+
+    :return: the same dict as `flat_parse_xml_soup`, with the form version id of the document in "version_id"
+    """
+    repeat_groups = set(repeat_groups)
+    flat_xml_dict: Dict[str, Any] = {}
+    document = _XMLFrame("[document]", "", "", flat_xml_dict, allowed_paths)
+    stack = [document]
+    # BeautifulSoup only gives a version when the root element is the only top level node
+    top_level_nodes = 0
+    root = None
+
+    # `content` is always utf-8, whatever the xml declaration says
+    events = etree.iterparse(BytesIO(content), events=("start", "end", "comment", "pi"), encoding="utf-8", recover=True)
+    try:
+        for event, element in events:
+            parent = stack[-1]
+            if event == "comment" or event == "pi":
+                if parent is document:
+                    top_level_nodes += 1
+            elif event == "start":
+                name = etree.QName(element).localname
+                parent.has_children = True
+                if parent is document:
+                    top_level_nodes += 1
+                    root = element
+                    path = ""
+                elif parent.name == "data":
+                    path = name
+                else:
+                    path = parent.children_path + "/" + name
+
+                if name in repeat_groups:
+                    if name not in parent.target:
+                        parent.target[name] = []
+                    child_dict: Dict[str, Any] = {}
+                    parent.target[name].append(child_dict)
+                    stack.append(_XMLFrame(name, path, parent.children_path, child_dict, None, is_repeat=True))
+                else:
+                    stack.append(_XMLFrame(name, path, path, parent.target, parent.allowed_paths))
+            else:
+                frame = stack.pop()
+                if not frame.is_repeat and not frame.has_children:
+                    # comments and processing instructions are not part of the text
+                    chunks = [element.text] + [child.tail for child in element]
+                    text = "".join(_soup_string(chunk) for chunk in chunks if chunk)
+                    if not frame.allowed_paths or frame.path in frame.allowed_paths:
+                        frame.target[frame.name] = text
+                if element is not root:
+                    element.clear(keep_tail=True)
+    except etree.XMLSyntaxError:
+        # nothing could be parsed, like BeautifulSoup we return an empty result
+        if root is None:
+            return {"flat_json": {}, "skipped_paths": [], "version_id": None}
+        raise
+
+    if events.root is not None and events.root.getroottree().docinfo.doctype:
+        top_level_nodes += 1
+    version_id = root.get("version") if root is not None and top_level_nodes == 1 else None
+    if version_id:
+        flat_xml_dict["_version"] = version_id
+
+    return {"flat_json": flat_xml_dict, "skipped_paths": [], "version_id": version_id}
+
+
 def slugify_underscore(filename):
     return slugify(filename).replace("-", "_")
 
@@ -131,6 +238,11 @@ def geojson_queryset(queryset, geometry_field, pk_field="id", fields=[]):
             }
         )
 
+    return geojson_feature_collection(features)
+
+
+def geojson_feature_collection(features):
+    """Wrap a list of GeoJSON features in a FeatureCollection, using the same CRS as `geojson_queryset`."""
     return {
         "type": "FeatureCollection",
         "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
@@ -138,6 +250,42 @@ def geojson_queryset(queryset, geometry_field, pk_field="id", fields=[]):
     }
 
 
+GEOJSON_BY_ID_CHUNK_SIZE = 5000
+
+
+def geojson_features_by_id(queryset, ids, geometry_field, chunk_size=GEOJSON_BY_ID_CHUNK_SIZE):
+    """
+    Serialize the `geometry_field` of the rows of `queryset` whose primary key is in `ids` to GeoJSON features,
+    indexed by primary key.
+
+    `ST_AsGeoJSON` is computed by PostGIS and the ids are fetched by chunks of `chunk_size`, so the number of
+    queries doesn't grow with the number of rows (as opposed to calling `geojson_queryset` once per row).
+    As with `geojson_queryset`, rows with a NULL geometry get a feature with a null geometry.
+
+    :param queryset: queryset to return data from, it must be filterable (i.e. not a union)
+    :param ids: iterable of primary keys to serialize
+    :param geometry_field: the field to be serialized to geojson
+
+    :return: a dict mapping each primary key to its GeoJSON Feature.
+    """
+    if sql_injection_geom_regex.match(geometry_field):
+        raise ValueError("invalid geom field name")
+
+    ids = list(ids)
+    features_by_id = {}
+    for start in range(0, len(ids), chunk_size):
+        rows = (
+            queryset.filter(pk__in=ids[start : start + chunk_size])
+            .order_by()
+            .extra(select={"geojson_queryset_result": f"ST_AsGeoJSON({geometry_field})::json"})
+            .values_list("pk", "geojson_queryset_result")
+        )
+        for pk, geometry in rows:
+            features_by_id[pk] = {"type": "Feature", "id": pk, "geometry": geometry, "properties": {}}
+
+    return features_by_id
+
+
 # Check if the request comes from mobile. Useful when logging modifications (audit)
 def is_mobile_request(request):
     # Get the User-Agent string from the request headers
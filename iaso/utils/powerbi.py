@@ -101,6 +101,7 @@ def monitor_task_and_raise_if_fail(dataset_config, task):
             time.sleep(expected_run_time)
         else:
             time.sleep(additional_timeout)
+        task.flush_progress()
         task.refresh_from_db()
         attempts += 1
     if task.status != SUCCESS:
@@ -193,21 +193,25 @@ def get_data_for_round(country_data, roundNumber):
 
 
 def calculate_country_status(country_data, scope, roundNumber):
+    return calculate_country_status_for_district_ids(country_data, {org_unit.id for org_unit in scope}, roundNumber)
+
+
+def calculate_country_status_for_district_ids(country_data, district_ids, roundNumber):
     if len(country_data.get("rounds", [])) == 0:
         # TODO put in an enum
         return LQASStatus.InScope
-    if len(scope) == 0:
+    if len(district_ids) == 0:
         return LQASStatus.InScope
     data_for_round = get_data_for_round(country_data, roundNumber)
     district_statuses = [
         determine_status_for_district(district_data)
         for district_data in data_for_round["data"].values()
-        if district_data["district"] in [org_unit.id for org_unit in scope]
+        if district_data["district"] in district_ids
     ]
     aggregated_statuses = reduce(reduce_to_country_status, district_statuses, {})
     if aggregated_statuses.get("total", 0) == 0:
         return LQASStatus.InScope
-    passing_ratio = round((aggregated_statuses["passed"] * 100) / len(scope))
+    passing_ratio = round((aggregated_statuses["passed"] * 100) / len(district_ids))
     if passing_ratio >= 80:
         return LQASStatus.Pass
     return LQASStatus.Fail
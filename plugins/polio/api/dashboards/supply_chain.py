@@ -14,7 +14,8 @@ from plugins.polio.models import (
     VaccineRequestForm,
     VaccineStock,
 )
-from plugins.polio.models.base import Campaign, Round, VaccineStockCalculator
+from plugins.polio.models.base import Campaign, Round
+from plugins.polio.models.vaccine_stock_ledger import get_vaccine_stock_totals
 from plugins.polio.permissions import (
     POLIO_VACCINE_SUPPLY_CHAIN_READ_ONLY_PERMISSION,
     POLIO_VACCINE_SUPPLY_CHAIN_READ_PERMISSION,
@@ -60,8 +61,8 @@ class VaccineRequestFormDashboardSerializer(serializers.ModelSerializer):
 
         # If the value is not in the cache, calculate it
         if cache_key not in self.context["stock_in_hand_cache"]:
-            vaccine_stock_calculator = VaccineStockCalculator(vaccine_stock)
-            self.context["stock_in_hand_cache"][cache_key] = vaccine_stock_calculator.get_total_of_usable_vials()
+            vaccine_stock_totals = get_vaccine_stock_totals(vaccine_stock)
+            self.context["stock_in_hand_cache"][cache_key] = vaccine_stock_totals.get_total_of_usable_vials()
 
         return self.context["stock_in_hand_cache"][cache_key]
 
@@ -144,7 +145,7 @@ class VaccineRequestFormDashboardViewSet(ModelViewSet):
     3 additional fields have been added:
     - obr_name: the campaign's OBR name, that may need to be displayed
     - country: the id of the vaccine request form's country
-    - stock_in_hand: the stock in hand calculated from VaccineStockCalculator
+    - stock_in_hand: the stock in hand, from the balance of the vaccine stock
     - get_form_a_reception_date: Form A reception (RRT) date
     - get_destruction_report_reception_date: Destruction Report Received by RRT date
     """
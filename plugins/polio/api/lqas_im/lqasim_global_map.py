@@ -1,16 +1,108 @@
+import datetime as dt
+import hashlib
+import time
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q
 from drf_spectacular.utils import extend_schema
 from rest_framework.response import Response
 
 from iaso.api.common import ReadOnlyOrHasPermission
 from iaso.models import OrgUnit
 from iaso.models.data_store import JsonDataStore
-from iaso.utils import geojson_queryset
-from plugins.polio.api.common import LQASStatus, RoundSelection, calculate_country_status, get_data_for_round
+from iaso.utils import geojson_feature_collection, geojson_queryset
+from plugins.polio.api.common import (
+    LQASStatus,
+    RoundSelection,
+    calculate_country_status_for_district_ids,
+    get_data_for_round,
+)
 from plugins.polio.api.lqas_im.base_viewset import LqasAfroViewset
-from plugins.polio.api.lqas_im.lqasim_zoom_in_map import get_latest_active_campaign_and_rounds
+from plugins.polio.models import Campaign, CampaignScope, Round, RoundScope
+from plugins.polio.models.base import CampaignType
 from plugins.polio.permissions import POLIO_CONFIG_PERMISSION, POLIO_PERMISSION
 
 
+# The datastores are refreshed by the OpenHexa pipeline, their version is part of the cache key so a refresh
+# invalidates the cached map. Saving a round invalidates it too, see `invalidate_global_map_cache`. The timeout bounds
+# the staleness for the other changes.
+GLOBAL_MAP_CACHE_TIMEOUT = 60 * 10
+GLOBAL_MAP_CACHE_GENERATION_KEY = "lqasim_global_map-generation"
+
+
+def invalidate_global_map_cache():
+    """Change the generation which is part of the cache keys of the global map, so the cached maps are not used."""
+    cache.set(GLOBAL_MAP_CACHE_GENERATION_KEY, time.time_ns(), None)
+
+
+def finished_rounds_filter(today):
+    # Filter by finished rounds and lqas dates ended. If no lqas end date, using end date +10 days (as in pipeline)
+    return Q(lqas_ended_at__lte=today) | (Q(lqas_ended_at__isnull=True) & Q(ended_at__lte=today - timedelta(days=10)))
+
+
+def get_latest_active_campaigns_and_rounds(country_ids, start_date_after, end_date_before):
+    """Set-based version of `get_latest_active_campaign_and_rounds`, for all the countries at once.
+
+    Returns a dict of country id -> (latest active campaign, its finished rounds ordered by descending number)
+    """
+    today = dt.date.today()
+    latest_rounds_qs = Round.objects.filter(
+        campaign__country_id__in=country_ids, campaign__campaign_types__name=CampaignType.POLIO
+    )
+    if start_date_after is not None:
+        latest_rounds_qs = latest_rounds_qs.filter(started_at__gte=start_date_after)
+    if end_date_before is not None:
+        latest_rounds_qs = latest_rounds_qs.filter(ended_at__lte=end_date_before)
+    latest_rounds_qs = (
+        latest_rounds_qs.filter(finished_rounds_filter(today))
+        .filter(campaign__deleted_at__isnull=True)
+        .exclude(campaign__is_test=True)
+        .order_by("campaign__country_id", "-started_at")
+        .distinct("campaign__country_id")
+    )
+    campaign_id_by_country_id = dict(latest_rounds_qs.values_list("campaign__country_id", "campaign_id"))
+
+    campaigns = Campaign.objects.filter(id__in=campaign_id_by_country_id.values()).in_bulk()
+    rounds_by_campaign_id = defaultdict(list)
+    finished_rounds = (
+        Round.objects.filter(campaign_id__in=campaigns.keys(), ended_at__lte=today)
+        .filter(finished_rounds_filter(today))
+        .order_by("campaign_id", "-number")
+    )
+    for finished_round in finished_rounds:
+        rounds_by_campaign_id[finished_round.campaign_id].append(finished_round)
+
+    return {
+        country_id: (campaigns[campaign_id], rounds_by_campaign_id[campaign_id])
+        for country_id, campaign_id in campaign_id_by_country_id.items()
+    }
+
+
+def get_scopes_district_ids(campaigns):
+    """District ids of the scopes of the campaigns, as in `Campaign.get_districts_for_round_number` and
+    `Campaign.get_all_districts`.
+
+    Returns a dict of (campaign id, round number) -> set of district ids for the campaigns with separate scopes per
+    round, and a dict of campaign id -> set of district ids for the others.
+    """
+    round_scopes = defaultdict(set)
+    campaign_scopes = defaultdict(set)
+    round_scopes_qs = RoundScope.objects.filter(
+        round__campaign__in=[c for c in campaigns if c.separate_scopes_per_round], group__org_units__isnull=False
+    ).values_list("round__campaign_id", "round__number", "group__org_units")
+    for campaign_id, round_number, org_unit_id in round_scopes_qs:
+        round_scopes[(campaign_id, round_number)].add(org_unit_id)
+    campaign_scopes_qs = CampaignScope.objects.filter(
+        campaign__in=[c for c in campaigns if not c.separate_scopes_per_round], group__org_units__isnull=False
+    ).values_list("campaign_id", "group__org_units")
+    for campaign_id, org_unit_id in campaign_scopes_qs:
+        campaign_scopes[campaign_id].add(org_unit_id)
+    return round_scopes, campaign_scopes
+
+
 @extend_schema(tags=["Polio - Lqas IM global map"])
 class LQASIMGlobalMapViewSet(LqasAfroViewset):
     http_method_names = ["get"]
@@ -25,34 +117,54 @@ class LQASIMGlobalMapViewSet(LqasAfroViewset):
         )
 
     def list(self, request):
-        results = []
-
         # Should be "lqas", "im_OHH", "im_HH"
+        category = self.request.GET.get("category", None)
         requested_round = self.request.GET.get("round", RoundSelection.Latest)
-        queryset = self.get_queryset()
-        data_stores = self.get_datastores()
-        for org_unit in queryset:
-            result = None
-            start_date_after, end_date_before = self.compute_reference_dates()
-            country_id = org_unit.id
-            try:
-                data_store = data_stores.get(slug__contains=str(country_id))
-            except JsonDataStore.DoesNotExist:
-                data_store = None
-            # Get shapes
-            shape_queryset = OrgUnit.objects.filter_for_user_and_app_id(
-                request.user, request.query_params.get("app_id", None)
-            ).filter(id=org_unit.id)
-            shapes = geojson_queryset(shape_queryset, geometry_field="simplified_geom")
-
-            (
-                latest_active_campaign,
-                latest_active_campaign_rounds,
-                round_numbers,
-            ) = get_latest_active_campaign_and_rounds(org_unit, start_date_after, end_date_before)
-
-            if latest_active_campaign is None:
+        start_date_after, end_date_before = self.compute_reference_dates()
+        countries = dict(self.get_queryset().values_list("id", "name"))
+        slugs = {country_id: f"{category}_{country_id}" for country_id in countries}
+
+        data_stores_version = JsonDataStore.objects.filter(slug__in=slugs.values()).aggregate(
+            count=Count("id"), updated_at=Max("updated_at")
+        )
+        campaigns_version = Campaign.objects.filter(country_id__in=countries.keys()).aggregate(
+            updated_at=Max("updated_at")
+        )
+        # the countries are the ones the user can see, so the cached results are only shared within the same scope
+        key_content = (
+            f"{category}:{requested_round}:{start_date_after}:{end_date_before}:{dt.date.today()}:{sorted(countries)}"
+            f":{data_stores_version['count']}:{data_stores_version['updated_at']}:{campaigns_version['updated_at']}"
+            f":{cache.get(GLOBAL_MAP_CACHE_GENERATION_KEY)}"
+        )
+        cache_key = f"lqasim_global_map-{hashlib.md5(key_content.encode()).hexdigest()}"
+
+        results = cache.get(cache_key)
+        if results is None:
+            results = self.compute_results(countries, slugs, requested_round, start_date_after, end_date_before)
+            cache.set(cache_key, results, GLOBAL_MAP_CACHE_TIMEOUT)
+        return Response({"results": results})
+
+    def compute_results(self, countries, slugs, requested_round, start_date_after, end_date_before):
+        results = []
+        latest_campaigns = get_latest_active_campaigns_and_rounds(countries.keys(), start_date_after, end_date_before)
+        if not latest_campaigns:
+            return results
+        data_stores = {
+            data_store.slug: data_store
+            for data_store in JsonDataStore.objects.filter(slug__in=[slugs[c] for c in latest_campaigns])
+        }
+        shapes = geojson_queryset(
+            self.get_queryset().filter(id__in=latest_campaigns.keys()), geometry_field="simplified_geom"
+        )
+        features = {feature["id"]: feature for feature in shapes["features"]}
+        round_scopes, campaign_scopes = get_scopes_district_ids([campaign for campaign, _ in latest_campaigns.values()])
+
+        for country_id, country_name in countries.items():
+            if country_id not in latest_campaigns:
                 continue
+            latest_active_campaign, latest_active_campaign_rounds = latest_campaigns[country_id]
+            data_store = data_stores.get(slugs[country_id])
+            shapes = geojson_feature_collection([features[country_id]])
 
             # Get data from json datastore
             data_for_country = data_store.content if data_store else None
@@ -64,26 +176,21 @@ class LQASIMGlobalMapViewSet(LqasAfroViewset):
             if stats:
                 round_number = requested_round
                 if round_number == RoundSelection.Latest:
-                    round_number = (
-                        latest_active_campaign_rounds.first().number
-                        if latest_active_campaign_rounds.count() > 0
-                        else None
-                    )
+                    round_number = latest_active_campaign_rounds[0].number if latest_active_campaign_rounds else None
                 elif round_number == RoundSelection.Penultimate:
                     round_number = (
-                        latest_active_campaign_rounds[1].number if latest_active_campaign_rounds.count() > 1 else None
+                        latest_active_campaign_rounds[1].number if len(latest_active_campaign_rounds) > 1 else None
                     )
                 else:
                     round_number = int(round_number)
-                    if round_number not in round_numbers:
+                    if round_number not in [r.number for r in latest_active_campaign_rounds]:
                         round_number = None
                 if round_number is None:
                     continue
                 if latest_active_campaign.separate_scopes_per_round:
-                    scope = latest_active_campaign.get_districts_for_round_number(round_number)
-
+                    scope = round_scopes[(latest_active_campaign.id, round_number)]
                 else:
-                    scope = latest_active_campaign.get_all_districts()
+                    scope = campaign_scopes[latest_active_campaign.id]
 
                 result = {
                     "id": int(country_id),
@@ -91,11 +198,11 @@ class LQASIMGlobalMapViewSet(LqasAfroViewset):
                         "campaign": latest_active_campaign.obr_name,
                         "campaign_id": str(latest_active_campaign.id),
                         **stats,
-                        "country_name": org_unit.name,
+                        "country_name": country_name,
                         "round_number": round_number,
                     },
                     "geo_json": shapes,
-                    "status": calculate_country_status(stats, scope, round_number),
+                    "status": calculate_country_status_for_district_ids(stats, scope, round_number),
                     "lqas_passed": get_data_for_round(stats, round_number).get("lqas_passed", None),
                     "lqas_failed": get_data_for_round(stats, round_number).get("lqas_failed", None),
                     "lqas_no_data": get_data_for_round(stats, round_number).get("lqas_no_data", None),
@@ -107,10 +214,10 @@ class LQASIMGlobalMapViewSet(LqasAfroViewset):
                     "data": {
                         "campaign": latest_active_campaign.obr_name,
                         "campaign_id": str(latest_active_campaign.id),
-                        "country_name": org_unit.name,
+                        "country_name": country_name,
                     },
                     "geo_json": shapes,
                     "status": LQASStatus.InScope,
                 }
             results.append(result)
-        return Response({"results": results})
+        return results
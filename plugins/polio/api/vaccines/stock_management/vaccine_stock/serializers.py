@@ -1,13 +1,13 @@
 from rest_framework import serializers
 
 from plugins.polio.models import VaccineStock
-from plugins.polio.models.base import VaccineStockCalculator
+from plugins.polio.models.vaccine_stock_ledger import get_vaccine_stock_totals
 
 
 class VaccineStockListSerializer(serializers.ListSerializer):
     @staticmethod
     def calculate_for_instance(instance):
-        instance.calculator = VaccineStockCalculator(instance)
+        instance.calculator = get_vaccine_stock_totals(instance)
 
     def to_representation(self, data):
         """
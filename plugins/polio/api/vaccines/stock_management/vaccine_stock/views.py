@@ -22,6 +22,7 @@ from plugins.polio.api.vaccines.stock_management.vaccine_stock.serializers impor
 )
 from plugins.polio.models import VaccineStock
 from plugins.polio.models.base import DOSES_PER_VIAL_CONFIG_SLUG, VaccineStockCalculator
+from plugins.polio.models.vaccine_stock_ledger import get_vaccine_stock_totals
 from plugins.polio.permissions import (
     POLIO_VACCINE_STOCK_MANAGEMENT_READ_ONLY_PERMISSION,
     POLIO_VACCINE_STOCK_MANAGEMENT_READ_PERMISSION,
@@ -84,7 +85,7 @@ class VaccineStockManagementViewSet(ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         if isinstance(instance, VaccineStock):
-            instance.calculator = VaccineStockCalculator(instance)
+            instance.calculator = get_vaccine_stock_totals(instance)
         else:
             return Response({"error": "VaccineStock not found"}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(instance)
@@ -125,7 +126,7 @@ class VaccineStockManagementViewSet(ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        calculator = VaccineStockCalculator(vaccine_stock)
+        calculator = get_vaccine_stock_totals(vaccine_stock)
 
         _, total_usable_doses = calculator.get_total_of_usable_vials()
         (
@@ -290,12 +291,7 @@ class VaccineStockManagementViewSet(ModelViewSet):
                 account=self.request.user.iaso_profile.account,
                 country__id__in=accessible_org_units_ids,
             )
-            .prefetch_related(
-                "destructionreport_set",
-                "incidentreport_set",
-                "outgoingstockmovement_set",
-                "earmarked_stocks",
-            )
+            .select_related("country", "balance")
             .distinct()
             .order_by("id")
         )
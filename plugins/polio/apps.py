@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PolioConfig(AppConfig):
     name = "plugins.polio"
+
+    def ready(self):
+        from . import signals  # noqa: F401
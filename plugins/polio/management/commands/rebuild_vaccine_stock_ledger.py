@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from plugins.polio.models import VaccineStock
+from plugins.polio.models.vaccine_stock_ledger import check_vaccine_stock_balance, rebuild_vaccine_stock_ledger
+
+
+class Command(BaseCommand):
+    help = """Rebuild the ledger and balances of the vaccine stocks from their documents
+
+    Run it once after deploying the ledger, the balances are then updated when the documents change.
+    With `--check`, nothing is written: the balances are compared to the totals of `VaccineStockCalculator` and the
+    command fails if any differs."""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stock-id", type=int, action="append", help="only this vaccine stock, can be repeated")
+        parser.add_argument("--check", action="store_true", help="only report the balances which are not consistent")
+
+    def handle(self, *args, stock_id=None, check=False, **options):
+        vaccine_stocks = VaccineStock.objects.select_related("country").order_by("id")
+        if stock_id:
+            vaccine_stocks = vaccine_stocks.filter(id__in=stock_id)
+
+        inconsistent_stocks = 0
+        for vaccine_stock in vaccine_stocks:
+            if not check:
+                rebuild_vaccine_stock_ledger(vaccine_stock)
+                continue
+            differences = check_vaccine_stock_balance(vaccine_stock)
+            if differences:
+                inconsistent_stocks += 1
+                details = ", ".join(
+                    f"{field}: {balance} instead of {expected}" for field, (balance, expected) in differences.items()
+                )
+                self.stdout.write(f"Vaccine stock {vaccine_stock.id} ({vaccine_stock}): {details}")
+
+        if inconsistent_stocks:
+            raise CommandError(f"{inconsistent_stocks} vaccine stock balances are not consistent, rebuild them")
+        self.stdout.write(f"{'Checked' if check else 'Rebuilt'} {vaccine_stocks.count()} vaccine stocks")
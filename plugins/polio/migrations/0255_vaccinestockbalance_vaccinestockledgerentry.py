@@ -0,0 +1,90 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:12
+
+import django.db.models.deletion
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("polio", "0254_remove_round_date_destruction_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VaccineStockBalance",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("vials_received", models.IntegerField(default=0)),
+                ("doses_received", models.IntegerField(default=0)),
+                ("vials_used", models.IntegerField(default=0)),
+                ("doses_used", models.IntegerField(default=0)),
+                ("usable_vials", models.IntegerField(default=0)),
+                ("usable_doses", models.IntegerField(default=0)),
+                ("unusable_vials", models.IntegerField(default=0)),
+                ("unusable_doses", models.IntegerField(default=0)),
+                ("vials_destroyed", models.IntegerField(default=0)),
+                ("doses_destroyed", models.IntegerField(default=0)),
+                ("earmarked_vials", models.IntegerField(default=0)),
+                ("earmarked_doses", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "vaccine_stock",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="balance", to="polio.vaccinestock"
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="VaccineStockLedgerEntry",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("vials_received", models.IntegerField(default=0)),
+                ("doses_received", models.IntegerField(default=0)),
+                ("vials_used", models.IntegerField(default=0)),
+                ("doses_used", models.IntegerField(default=0)),
+                ("usable_vials", models.IntegerField(default=0)),
+                ("usable_doses", models.IntegerField(default=0)),
+                ("unusable_vials", models.IntegerField(default=0)),
+                ("unusable_doses", models.IntegerField(default=0)),
+                ("vials_destroyed", models.IntegerField(default=0)),
+                ("doses_destroyed", models.IntegerField(default=0)),
+                ("earmarked_vials", models.IntegerField(default=0)),
+                ("earmarked_doses", models.IntegerField(default=0)),
+                (
+                    "document_type",
+                    models.CharField(
+                        choices=[
+                            ("arrival_report", "Arrival report"),
+                            ("outgoing_stock_movement", "Form A"),
+                            ("destruction_report", "Destruction report"),
+                            ("incident_report", "Incident report"),
+                            ("earmarked_stock", "Earmarked stock"),
+                        ],
+                        max_length=30,
+                    ),
+                ),
+                ("document_id", models.IntegerField()),
+                ("doses_per_vial", models.IntegerField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "vaccine_stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="polio.vaccinestock",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["document_type", "document_id"], name="polio_vacci_documen_cec990_idx")
+                ],
+                "unique_together": {("vaccine_stock", "document_type", "document_id")},
+            },
+        ),
+    ]
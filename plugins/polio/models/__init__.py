@@ -1,6 +1,7 @@
 from .base import *
 from .chronogram import Chronogram, ChronogramTask, ChronogramTemplateTask
 from .lqas_im import *
+from .vaccine_stock_ledger import VaccineStockBalance, VaccineStockLedgerEntry
 
 
 __all__ = [
@@ -13,4 +14,6 @@ __all__ = [
     "DestructionReport",
     "IncidentReport",
     "VaccinePreAlert",
+    "VaccineStockBalance",
+    "VaccineStockLedgerEntry",
 ]
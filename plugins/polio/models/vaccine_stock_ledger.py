@@ -0,0 +1,377 @@
+"""
+Ledger of the vaccine stock movements, with the running balance of each `VaccineStock`.
+
+Every document moving vials (arrival reports, Form A, destruction reports, incident reports and earmarks) has a
+`VaccineStockLedgerEntry` with what it adds to or removes from the totals of its stock, following the same rules as
+`VaccineStockCalculator`. When a document changes, its entry is recomputed and only the difference is applied to the
+`VaccineStockBalance` of the stock (see `plugins/polio/signals.py`), so the totals are read without going through all
+the documents of the stock.
+
+`VaccineStockCalculator` stays the reference: it computes the detailed lists of movements and the totals at a given
+date. `./manage.py rebuild_vaccine_stock_ledger` rebuilds the ledger from the documents, and compares the balances to
+the calculator with `--check`.
+"""
+
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from plugins.polio.models.base import (
+    DestructionReport,
+    EarmarkedStock,
+    IncidentReport,
+    OutgoingStockMovement,
+    VaccineArrivalReport,
+    VaccineRequestForm,
+    VaccineStock,
+    VaccineStockCalculator,
+)
+
+
+TOTAL_FIELDS = [
+    "vials_received",
+    "doses_received",
+    "vials_used",
+    "doses_used",
+    "usable_vials",
+    "usable_doses",
+    "unusable_vials",
+    "unusable_doses",
+    "vials_destroyed",
+    "doses_destroyed",
+    "earmarked_vials",
+    "earmarked_doses",
+]
+
+# Stock corrections of the incident reports, by effect on the usable and unusable stocks
+USABLE_REMOVING_CORRECTIONS = [
+    IncidentReport.StockCorrectionChoices.PHYSICAL_INVENTORY_REMOVE,
+    IncidentReport.StockCorrectionChoices.MISSING,
+    IncidentReport.StockCorrectionChoices.RETURN,
+    IncidentReport.StockCorrectionChoices.STEALING,
+    IncidentReport.StockCorrectionChoices.BROKEN,
+]
+UNUSABLE_MAKING_CORRECTIONS = [
+    IncidentReport.StockCorrectionChoices.VACCINE_EXPIRED,
+    IncidentReport.StockCorrectionChoices.VVM_REACHED_DISCARD_POINT,
+    IncidentReport.StockCorrectionChoices.UNREADABLE_LABEL,
+    IncidentReport.StockCorrectionChoices.MISSING_DROPPERS,
+]
+UNUSABLE_ADDING_CORRECTIONS = [
+    IncidentReport.StockCorrectionChoices.PHYSICAL_INVENTORY_ADD,
+    IncidentReport.StockCorrectionChoices.BROKEN,
+    *UNUSABLE_MAKING_CORRECTIONS,
+]
+
+
+class VaccineStockTotals(models.Model):
+    vials_received = models.IntegerField(default=0)
+    doses_received = models.IntegerField(default=0)
+    vials_used = models.IntegerField(default=0)
+    doses_used = models.IntegerField(default=0)
+    usable_vials = models.IntegerField(default=0)
+    usable_doses = models.IntegerField(default=0)
+    unusable_vials = models.IntegerField(default=0)
+    unusable_doses = models.IntegerField(default=0)
+    vials_destroyed = models.IntegerField(default=0)
+    doses_destroyed = models.IntegerField(default=0)
+    earmarked_vials = models.IntegerField(default=0)
+    earmarked_doses = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def get_totals(self):
+        return {field: getattr(self, field) for field in TOTAL_FIELDS}
+
+
+class VaccineStockLedgerEntry(VaccineStockTotals):
+    class DocumentType(models.TextChoices):
+        ARRIVAL_REPORT = "arrival_report", _("Arrival report")
+        OUTGOING_STOCK_MOVEMENT = "outgoing_stock_movement", _("Form A")
+        DESTRUCTION_REPORT = "destruction_report", _("Destruction report")
+        INCIDENT_REPORT = "incident_report", _("Incident report")
+        EARMARKED_STOCK = "earmarked_stock", _("Earmarked stock")
+
+    vaccine_stock = models.ForeignKey(VaccineStock, on_delete=models.CASCADE, related_name="ledger_entries")
+    document_type = models.CharField(max_length=30, choices=DocumentType.choices)
+    document_id = models.IntegerField()
+    doses_per_vial = models.IntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("vaccine_stock", "document_type", "document_id")
+        indexes = [
+            models.Index(fields=["document_type", "document_id"]),  # Used to find the entry of a changed document
+        ]
+
+    def __str__(self):
+        return f"{self.vaccine_stock} - {self.document_type} {self.document_id}"
+
+
+class VaccineStockBalance(VaccineStockTotals):
+    """Running totals of a `VaccineStock`, the sum of its ledger entries.
+
+    The getters return (vials, doses) like the ones of `VaccineStockCalculator`, so a balance can be used in place of
+    the calculator for the current totals.
+    """
+
+    vaccine_stock = models.OneToOneField(VaccineStock, on_delete=models.CASCADE, related_name="balance")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Balance of {self.vaccine_stock}"
+
+    def get_vials_received(self):
+        return self.vials_received, self.doses_received
+
+    def get_vials_used(self):
+        return self.vials_used, self.doses_used
+
+    def get_total_of_usable_vials(self):
+        return self.usable_vials, self.usable_doses
+
+    def get_total_of_unusable_vials(self):
+        return self.unusable_vials, self.unusable_doses
+
+    def get_vials_destroyed(self):
+        return self.vials_destroyed, self.doses_destroyed
+
+    def get_total_of_earmarked(self):
+        return self.earmarked_vials, self.earmarked_doses
+
+
+def get_vaccine_stock_totals(vaccine_stock: VaccineStock):
+    """Balance of the stock, or a calculator if the ledger of the stock was never built."""
+    try:
+        return vaccine_stock.balance
+    except VaccineStockBalance.DoesNotExist:
+        return VaccineStockCalculator(vaccine_stock)
+
+
+def _make_entry(document_type, document, vaccine_stock_id, **totals):
+    if not any(totals.values()):
+        return None
+    return VaccineStockLedgerEntry(
+        vaccine_stock_id=vaccine_stock_id,
+        document_type=document_type,
+        document_id=document.id,
+        doses_per_vial=document.doses_per_vial,
+        **totals,
+    )
+
+
+def _entry_for_arrival_report(report, vaccine_stock_id):
+    vials = report.vials_received or 0
+    doses = report.doses_received or 0
+    return _make_entry(
+        VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT,
+        report,
+        vaccine_stock_id,
+        vials_received=vials,
+        doses_received=doses,
+        usable_vials=vials,
+        usable_doses=doses,
+    )
+
+
+def _entry_for_outgoing_stock_movement(movement):
+    # `earmarked_vials` is annotated by `_outgoing_stock_movements`, the earmarked vials are not taken from the stock
+    vials_used_from_stock = movement.usable_vials_used - movement.earmarked_vials
+    return _make_entry(
+        VaccineStockLedgerEntry.DocumentType.OUTGOING_STOCK_MOVEMENT,
+        movement,
+        movement.vaccine_stock_id,
+        vials_used=movement.usable_vials_used,
+        doses_used=movement.usable_vials_used * movement.doses_per_vial,
+        usable_vials=-vials_used_from_stock,
+        usable_doses=-vials_used_from_stock * movement.doses_per_vial,
+        # empty vials become unusable
+        unusable_vials=movement.usable_vials_used,
+        unusable_doses=movement.usable_vials_used * movement.doses_per_vial,
+    )
+
+
+def _entry_for_destruction_report(report):
+    vials = report.unusable_vials_destroyed or 0
+    return _make_entry(
+        VaccineStockLedgerEntry.DocumentType.DESTRUCTION_REPORT,
+        report,
+        report.vaccine_stock_id,
+        vials_destroyed=vials,
+        doses_destroyed=vials * report.doses_per_vial,
+        unusable_vials=-vials,
+        unusable_doses=-vials * report.doses_per_vial,
+    )
+
+
+def _entry_for_incident_report(report):
+    usable_vials = 0
+    unusable_vials = 0
+    correction = report.stock_correction
+    if report.usable_vials > 0:
+        if correction == IncidentReport.StockCorrectionChoices.PHYSICAL_INVENTORY_ADD:
+            usable_vials += report.usable_vials
+        elif correction in USABLE_REMOVING_CORRECTIONS:
+            usable_vials -= report.usable_vials
+    if report.unusable_vials > 0:
+        if correction in UNUSABLE_MAKING_CORRECTIONS:
+            usable_vials -= report.unusable_vials
+        if correction in UNUSABLE_ADDING_CORRECTIONS:
+            unusable_vials += report.unusable_vials
+        elif correction == IncidentReport.StockCorrectionChoices.PHYSICAL_INVENTORY_REMOVE:
+            unusable_vials -= report.unusable_vials
+    return _make_entry(
+        VaccineStockLedgerEntry.DocumentType.INCIDENT_REPORT,
+        report,
+        report.vaccine_stock_id,
+        usable_vials=usable_vials,
+        usable_doses=usable_vials * report.doses_per_vial,
+        unusable_vials=unusable_vials,
+        unusable_doses=unusable_vials * report.doses_per_vial,
+    )
+
+
+def _entry_for_earmarked_stock(earmark):
+    vials, doses = earmark.vials_earmarked, earmark.doses_earmarked
+    if earmark.earmarked_stock_type == EarmarkedStock.EarmarkedStockChoices.USED:
+        totals = {"earmarked_vials": -vials, "earmarked_doses": -doses}
+        if earmark.form_a_id is None:  # otherwise the vials are accounted by the Form A
+            totals.update({"unusable_vials": vials, "unusable_doses": doses})
+    elif earmark.earmarked_stock_type == EarmarkedStock.EarmarkedStockChoices.RETURNED:
+        totals = {"earmarked_vials": -vials, "earmarked_doses": -doses, "usable_vials": vials, "usable_doses": doses}
+    else:
+        totals = {"earmarked_vials": vials, "earmarked_doses": doses, "usable_vials": -vials, "usable_doses": -doses}
+    return _make_entry(
+        VaccineStockLedgerEntry.DocumentType.EARMARKED_STOCK, earmark, earmark.vaccine_stock_id, **totals
+    )
+
+
+def _outgoing_stock_movements():
+    return OutgoingStockMovement.objects.annotate(earmarked_vials=Coalesce(Sum("earmarked_stocks__vials_earmarked"), 0))
+
+
+def _compute_entry(document_type, document_id):
+    document_types = VaccineStockLedgerEntry.DocumentType
+    if document_type == document_types.ARRIVAL_REPORT:
+        report = VaccineArrivalReport.objects.select_related("request_form__campaign").filter(id=document_id).first()
+        if report is None or report.request_form.deleted_at is not None:
+            return None
+        vaccine_stock_id = (
+            VaccineStock.objects.filter(
+                country_id=report.request_form.campaign.country_id, vaccine=report.request_form.vaccine_type
+            )
+            .values_list("id", flat=True)
+            .first()
+        )
+        return _entry_for_arrival_report(report, vaccine_stock_id) if vaccine_stock_id else None
+
+    documents, make_entry = {
+        document_types.OUTGOING_STOCK_MOVEMENT: (_outgoing_stock_movements(), _entry_for_outgoing_stock_movement),
+        document_types.DESTRUCTION_REPORT: (DestructionReport.objects.all(), _entry_for_destruction_report),
+        document_types.INCIDENT_REPORT: (IncidentReport.objects.all(), _entry_for_incident_report),
+        document_types.EARMARKED_STOCK: (EarmarkedStock.objects.all(), _entry_for_earmarked_stock),
+    }[document_type]
+    document = documents.filter(id=document_id).first()
+    return make_entry(document) if document else None
+
+
+def compute_vaccine_stock_ledger_entries(vaccine_stock: VaccineStock):
+    request_forms = VaccineRequestForm.objects.filter(
+        campaign__country=vaccine_stock.country, vaccine_type=vaccine_stock.vaccine
+    )
+    entries = [
+        _entry_for_arrival_report(report, vaccine_stock.id)
+        for report in VaccineArrivalReport.objects.filter(request_form__in=request_forms)
+    ]
+    entries += [
+        _entry_for_outgoing_stock_movement(movement)
+        for movement in _outgoing_stock_movements().filter(vaccine_stock=vaccine_stock)
+    ]
+    entries += map(_entry_for_destruction_report, DestructionReport.objects.filter(vaccine_stock=vaccine_stock))
+    entries += map(_entry_for_incident_report, IncidentReport.objects.filter(vaccine_stock=vaccine_stock))
+    entries += map(_entry_for_earmarked_stock, EarmarkedStock.objects.filter(vaccine_stock=vaccine_stock))
+    return [entry for entry in entries if entry is not None]
+
+
+def rebuild_vaccine_stock_ledger(vaccine_stock: VaccineStock):
+    """Recreate the ledger entries and the balance of the stock from its documents."""
+    with transaction.atomic():
+        entries = compute_vaccine_stock_ledger_entries(vaccine_stock)
+        VaccineStockLedgerEntry.objects.filter(vaccine_stock=vaccine_stock).delete()
+        VaccineStockLedgerEntry.objects.bulk_create(entries)
+        totals = Counter()
+        for entry in entries:
+            totals.update(entry.get_totals())
+        balance, _ = VaccineStockBalance.objects.update_or_create(
+            vaccine_stock=vaccine_stock, defaults={field: totals[field] for field in TOTAL_FIELDS}
+        )
+    return balance
+
+
+def _apply_to_balance(vaccine_stock_id, delta):
+    changes = {field: F(field) + value for field, value in delta.items() if value}
+    if not changes:
+        return
+    if not VaccineStockBalance.objects.filter(vaccine_stock_id=vaccine_stock_id).update(
+        updated_at=timezone.now(), **changes
+    ):
+        # first change since the ledger was introduced, the other documents of the stock are not in the ledger yet
+        vaccine_stock = VaccineStock.objects.filter(id=vaccine_stock_id).first()
+        if vaccine_stock is not None:  # not being deleted
+            rebuild_vaccine_stock_ledger(vaccine_stock)
+
+
+def sync_vaccine_stock_ledger(document_type, document_ids):
+    """Recompute the ledger entries of the documents and apply the difference to the balance of their stocks."""
+    for document_id in document_ids:
+        with transaction.atomic():
+            old_entries = list(
+                VaccineStockLedgerEntry.objects.select_for_update().filter(
+                    document_type=document_type, document_id=document_id
+                )
+            )
+            new_entry = _compute_entry(document_type, document_id)
+
+            deltas = {}
+            for old_entry in old_entries:
+                deltas.setdefault(old_entry.vaccine_stock_id, Counter()).subtract(old_entry.get_totals())
+                if new_entry is not None and old_entry.vaccine_stock_id == new_entry.vaccine_stock_id:
+                    new_entry.id = old_entry.id
+                else:
+                    old_entry.delete()
+            if new_entry is not None:
+                deltas.setdefault(new_entry.vaccine_stock_id, Counter()).update(new_entry.get_totals())
+                new_entry.save()
+
+            for vaccine_stock_id, delta in deltas.items():
+                _apply_to_balance(vaccine_stock_id, delta)
+
+
+def check_vaccine_stock_balance(vaccine_stock: VaccineStock):
+    """Compare the balance of the stock with the totals of `VaccineStockCalculator`.
+
+    Returns a dict of field -> (balance value, calculator value) for the fields which differ.
+    """
+    balance = VaccineStockBalance.objects.filter(vaccine_stock=vaccine_stock).first() or VaccineStockBalance()
+    calculator = VaccineStockCalculator(vaccine_stock)
+    expected = {}
+    # Same order as VaccineStockSerializer, the calculator reuses its lists between the totals
+    for getter, fields in [
+        ("get_vials_received", ("vials_received", "doses_received")),
+        ("get_vials_used", ("vials_used", "doses_used")),
+        ("get_total_of_usable_vials", ("usable_vials", "usable_doses")),
+        ("get_total_of_unusable_vials", ("unusable_vials", "unusable_doses")),
+        ("get_vials_destroyed", ("vials_destroyed", "doses_destroyed")),
+        ("get_total_of_earmarked", ("earmarked_vials", "earmarked_doses")),
+    ]:
+        expected.update(zip(fields, getattr(calculator, getter)()))
+    return {
+        field: (getattr(balance, field), expected[field])
+        for field in TOTAL_FIELDS
+        if getattr(balance, field) != expected[field]
+    }
@@ -0,0 +1,131 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from plugins.polio.api.lqas_im.lqasim_global_map import invalidate_global_map_cache
+from plugins.polio.models.base import (
+    Campaign,
+    DestructionReport,
+    EarmarkedStock,
+    IncidentReport,
+    OutgoingStockMovement,
+    Round,
+    VaccineArrivalReport,
+    VaccineRequestForm,
+    VaccineStock,
+)
+from plugins.polio.models.vaccine_stock_ledger import (
+    VaccineStockLedgerEntry,
+    rebuild_vaccine_stock_ledger,
+    sync_vaccine_stock_ledger,
+)
+
+
+LEDGER_DOCUMENT_TYPES = {
+    VaccineArrivalReport: VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT,
+    OutgoingStockMovement: VaccineStockLedgerEntry.DocumentType.OUTGOING_STOCK_MOVEMENT,
+    DestructionReport: VaccineStockLedgerEntry.DocumentType.DESTRUCTION_REPORT,
+    IncidentReport: VaccineStockLedgerEntry.DocumentType.INCIDENT_REPORT,
+    EarmarkedStock: VaccineStockLedgerEntry.DocumentType.EARMARKED_STOCK,
+}
+
+
+def is_vaccine_stock_deletion(origin):
+    # The documents of a deleted stock are deleted with its ledger entries and balance, which must not be rebuilt
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is VaccineStock
+
+
+@receiver(post_save, sender=VaccineArrivalReport)
+@receiver(post_save, sender=OutgoingStockMovement)
+@receiver(post_save, sender=DestructionReport)
+@receiver(post_save, sender=IncidentReport)
+@receiver(post_save, sender=EarmarkedStock)
+@receiver(post_delete, sender=VaccineArrivalReport)
+@receiver(post_delete, sender=OutgoingStockMovement)
+@receiver(post_delete, sender=DestructionReport)
+@receiver(post_delete, sender=IncidentReport)
+@receiver(post_delete, sender=EarmarkedStock)
+def sync_vaccine_stock_ledger_entry(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or is_vaccine_stock_deletion(origin):
+        return
+    sync_vaccine_stock_ledger(LEDGER_DOCUMENT_TYPES[sender], [instance.id])
+    if sender is EarmarkedStock:
+        # The vials taken from an earmark are not removed from the stock by the Form A
+        form_a_ids = {instance.form_a_id, getattr(instance, "_previous_form_a_id", None)} - {None}
+        sync_vaccine_stock_ledger(VaccineStockLedgerEntry.DocumentType.OUTGOING_STOCK_MOVEMENT, form_a_ids)
+
+
+@receiver(pre_save, sender=EarmarkedStock)
+def keep_previous_form_a(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_form_a_id = (
+            EarmarkedStock.objects.filter(pk=instance.pk).values_list("form_a_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=VaccineRequestForm)
+def sync_vaccine_request_form_arrival_reports(sender, instance, created, raw=False, **kwargs):
+    # Soft deleting the form or changing its vaccine moves its arrival reports out of or to another stock
+    if raw or created:
+        return
+    arrival_report_ids = instance.vaccinearrivalreport_set.values_list("id", flat=True)
+    sync_vaccine_stock_ledger(VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT, list(arrival_report_ids))
+
+
+@receiver(pre_save, sender=VaccineStock)
+def keep_previous_country_and_vaccine(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_country_and_vaccine = (
+            VaccineStock.objects.filter(pk=instance.pk).values_list("country_id", "vaccine").first()
+        )
+
+
+@receiver(post_save, sender=VaccineStock)
+def build_new_vaccine_stock_ledger(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous_country_and_vaccine = getattr(instance, "_previous_country_and_vaccine", None)
+    if created:
+        # The arrival reports of the country and vaccine can exist before the stock
+        rebuild_vaccine_stock_ledger(instance)
+    elif previous_country_and_vaccine not in (None, (instance.country_id, instance.vaccine)):
+        # The arrival reports of the previous country and vaccine leave the stock, the ones of the new ones join it
+        arrival_report_ids = set(
+            VaccineStockLedgerEntry.objects.filter(
+                vaccine_stock=instance, document_type=VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT
+            ).values_list("document_id", flat=True)
+        )
+        arrival_report_ids.update(
+            VaccineArrivalReport.objects.filter(
+                request_form__campaign__country_id=instance.country_id, request_form__vaccine_type=instance.vaccine
+            ).values_list("id", flat=True)
+        )
+        sync_vaccine_stock_ledger(VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT, arrival_report_ids)
+
+
+@receiver(pre_save, sender=Campaign)
+def keep_previous_campaign_country(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._previous_country_id = (
+            Campaign.objects.filter(pk=instance.pk).values_list("country_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Campaign)
+def sync_campaign_arrival_reports(sender, instance, created, raw=False, **kwargs):
+    # The arrival reports of the campaign go to the stock of its country
+    if raw or created or getattr(instance, "_previous_country_id", instance.country_id) == instance.country_id:
+        return
+    arrival_report_ids = VaccineArrivalReport.objects.filter(request_form__campaign=instance).values_list(
+        "id", flat=True
+    )
+    sync_vaccine_stock_ledger(VaccineStockLedgerEntry.DocumentType.ARRIVAL_REPORT, list(arrival_report_ids))
+
+
+@receiver(post_save, sender=Round)
+@receiver(post_delete, sender=Round)
+def invalidate_lqasim_global_map(sender, instance, raw=False, **kwargs):
+    # The global map depends on the dates and numbers of the rounds
+    if not raw:
+        invalidate_global_map_cache()
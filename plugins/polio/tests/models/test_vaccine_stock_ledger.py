@@ -0,0 +1,121 @@
+import time_machine
+
+from django.core.management import CommandError, call_command
+
+from plugins.polio import models as pm
+from plugins.polio.models.vaccine_stock_ledger import check_vaccine_stock_balance
+from plugins.polio.tests.vaccine_stocks_setup_data import DT, VaccineStockManagementAPITestBase
+
+
+@time_machine.travel(DT, tick=False)
+class VaccineStockLedgerTestCase(VaccineStockManagementAPITestBase):
+    def assertBalancesAreConsistent(self):
+        for vaccine_stock in pm.VaccineStock.objects.all():
+            self.assertEqual(check_vaccine_stock_balance(vaccine_stock), {}, vaccine_stock)
+
+    def test_balance_is_built_from_the_documents(self):
+        balance = pm.VaccineStockBalance.objects.get(vaccine_stock=self.vaccine_stock)
+        self.assertEqual(balance.get_vials_received(), (20, 400))
+        self.assertEqual(balance.get_total_of_usable_vials(), (23, 460))
+        self.assertEqual(balance.get_total_of_unusable_vials(), (27, 540))
+        self.assertEqual(balance.get_vials_destroyed(), (3, 60))
+        self.assertBalancesAreConsistent()
+
+    def test_balance_follows_the_document_changes(self):
+        earmark = pm.EarmarkedStock.objects.create(
+            vaccine_stock=self.vaccine_stock,
+            campaign=self.campaign,
+            vials_earmarked=5,
+            doses_earmarked=100,
+            doses_per_vial=20,
+        )
+        self.vaccine_stock.balance.refresh_from_db()
+        self.assertEqual(self.vaccine_stock.balance.get_total_of_usable_vials(), (18, 360))
+        self.assertEqual(self.vaccine_stock.balance.get_total_of_earmarked(), (5, 100))
+        self.assertBalancesAreConsistent()
+
+        # the vials of the Form A taken from the earmark are given back to the usable stock
+        pm.EarmarkedStock.objects.create(
+            vaccine_stock=self.vaccine_stock,
+            campaign=self.campaign,
+            earmarked_stock_type=pm.EarmarkedStock.EarmarkedStockChoices.USED,
+            form_a=self.outgoing_stock_movement,
+            vials_earmarked=2,
+            doses_earmarked=40,
+            doses_per_vial=20,
+        )
+        self.vaccine_stock.balance.refresh_from_db()
+        self.assertEqual(self.vaccine_stock.balance.get_total_of_usable_vials(), (20, 400))
+        self.assertEqual(self.vaccine_stock.balance.get_total_of_earmarked(), (3, 60))
+        self.assertBalancesAreConsistent()
+
+        earmark.vials_earmarked = 1
+        earmark.doses_earmarked = 20
+        earmark.save()
+        self.outgoing_stock_movement.delete()
+        pm.IncidentReport.objects.filter(vaccine_stock=self.vaccine_stock).first().delete()
+        self.assertBalancesAreConsistent()
+
+        self.vaccine_request_form.delete()  # soft delete, the arrival report is not counted anymore
+        self.vaccine_stock.balance.refresh_from_db()
+        self.assertEqual(self.vaccine_stock.balance.get_vials_received(), (0, 0))
+        self.assertBalancesAreConsistent()
+
+    def test_arrival_reports_follow_the_country_and_vaccine_changes(self):
+        def vials_received(vaccine_stock):
+            return pm.VaccineStockBalance.objects.get(vaccine_stock=vaccine_stock).get_vials_received()
+
+        self.campaign.country = self.country_2
+        self.campaign.save()
+        self.assertEqual(vials_received(self.vaccine_stock), (0, 0))
+        self.assertEqual(vials_received(self.vaccine_stock_2), (20, 400))
+        self.assertBalancesAreConsistent()
+
+        self.vaccine_stock_2.vaccine = pm.VACCINES[1][0]
+        self.vaccine_stock_2.save()
+        self.assertEqual(vials_received(self.vaccine_stock_2), (0, 0))
+        self.assertBalancesAreConsistent()
+
+        self.vaccine_stock_2.vaccine = pm.VACCINES[0][0]
+        self.vaccine_stock_2.save()
+        self.assertEqual(vials_received(self.vaccine_stock_2), (20, 400))
+        self.assertBalancesAreConsistent()
+
+    def test_stock_with_an_earmarked_form_a_can_be_deleted(self):
+        pm.EarmarkedStock.objects.create(
+            vaccine_stock=self.vaccine_stock,
+            campaign=self.campaign,
+            earmarked_stock_type=pm.EarmarkedStock.EarmarkedStockChoices.USED,
+            form_a=self.outgoing_stock_movement,
+            vials_earmarked=2,
+            doses_earmarked=40,
+            doses_per_vial=20,
+        )
+        vaccine_stock_id = self.vaccine_stock.id
+
+        self.vaccine_stock.delete()
+
+        self.assertFalse(pm.VaccineStockLedgerEntry.objects.filter(vaccine_stock_id=vaccine_stock_id).exists())
+        self.assertFalse(pm.VaccineStockBalance.objects.filter(vaccine_stock_id=vaccine_stock_id).exists())
+        self.assertBalancesAreConsistent()
+
+    def test_rebuild_command(self):
+        pm.VaccineStockBalance.objects.filter(vaccine_stock=self.vaccine_stock).update(usable_vials=0)
+
+        with self.assertRaises(CommandError):
+            call_command("rebuild_vaccine_stock_ledger", "--check")
+
+        call_command("rebuild_vaccine_stock_ledger", f"--stock-id={self.vaccine_stock.id}")
+        call_command("rebuild_vaccine_stock_ledger", "--check")
+        self.assertEqual(pm.VaccineStockBalance.objects.get(vaccine_stock=self.vaccine_stock).usable_vials, 23)
+
+    def test_list_is_answered_from_the_balances(self):
+        self.client.force_authenticate(user=self.user_ro_perms)
+        response = self.client.get("/api/polio/vaccine/vaccine_stock/")
+        stock = next(stock for stock in response.json()["results"] if stock["id"] == self.vaccine_stock.id)
+        self.assertEqual(stock["stock_of_usable_vials"], 23)
+
+        pm.VaccineStockBalance.objects.filter(vaccine_stock=self.vaccine_stock).update(usable_vials=1000)
+        response = self.client.get("/api/polio/vaccine/vaccine_stock/")
+        stock = next(stock for stock in response.json()["results"] if stock["id"] == self.vaccine_stock.id)
+        self.assertEqual(stock["stock_of_usable_vials"], 1000)
@@ -4,6 +4,9 @@ from datetime import date, datetime, timedelta
 
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
 from iaso.models.base import Account, Group
@@ -616,6 +619,77 @@ class PolioLqasAfroMapTestCase(APITestCase):
         results = content["results"]
         self.assertEqual(len(results), 0)
 
+    def test_lqas_global_number_of_queries_does_not_depend_on_countries(self):
+        c = APIClient()
+        c.force_authenticate(user=self.authorized_user)
+        with CaptureQueriesContext(connection) as queries_for_two_countries:
+            response = c.get("/api/polio/lqasmap/global/?category=lqas", accept="application/json")
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        country_org_unit_4 = OrgUnit.objects.create(
+            name="Country4",
+            validation_status=OrgUnit.VALIDATION_VALID,
+            org_unit_type=self.country,
+            version=self.source_version,
+            simplified_geom=MultiPolygon(Polygon.from_bbox((16, 16, 19, 19))),
+        )
+        campaign_4 = Campaign.objects.create(
+            obr_name="CAMPAIGN4", account=self.account, initial_org_unit=country_org_unit_4
+        )
+        campaign_4.campaign_types.add(self.polio_type)
+        Round.objects.create(
+            number=1, started_at=self.campaign1_round1_start, ended_at=self.campaign1_round1_end, campaign=campaign_4
+        )
+        JsonDataStore.objects.create(
+            content={"stats": {"CAMPAIGN4": {"rounds": []}}},
+            slug=f"lqas_{country_org_unit_4.id}",
+            account=self.account,
+        )
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries_for_three_countries:
+            response = c.get("/api/polio/lqasmap/global/?category=lqas", accept="application/json")
+        self.assertEqual(len(response.json()["results"]), 3)
+        self.assertEqual(len(queries_for_three_countries), len(queries_for_two_countries))
+
+    def test_lqas_global_is_cached_until_datastore_refresh(self):
+        c = APIClient()
+        c.force_authenticate(user=self.authorized_user)
+        url = "/api/polio/lqasmap/global/?category=lqas"
+        response = c.get(url, accept="application/json")
+        result = next(r for r in response.json()["results"] if r["id"] == self.country_org_unit_1.id)
+        self.assertEqual(result["status"], LQASStatus.Fail)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached_response = c.get(url, accept="application/json")
+        self.assertEqual(cached_response.json(), response.json())
+        self.assertFalse(any("polio_round" in query["sql"] for query in queries.captured_queries))
+
+        round_2 = self.country1_data_store_content["stats"][self.campaign_1.obr_name]["rounds"][1]
+        round_2["data"][self.district_org_unit_1.name]["total_child_fmd"] = 60
+        self.datastore_country1.content = self.country1_data_store_content
+        self.datastore_country1.save()
+
+        response = c.get(url, accept="application/json")
+        result = next(r for r in response.json()["results"] if r["id"] == self.country_org_unit_1.id)
+        self.assertEqual(result["status"], LQASStatus.Pass)
+
+    def test_lqas_global_cache_is_invalidated_by_round_changes(self):
+        c = APIClient()
+        c.force_authenticate(user=self.authorized_user)
+        url = "/api/polio/lqasmap/global/?category=lqas"
+        response = c.get(url, accept="application/json")
+        self.assertEqual(len(response.json()["results"]), 2)
+
+        # the round is not finished anymore, so the campaign of the first country is not active
+        Round.objects.filter(campaign=self.campaign_1).update(ended_at=None, lqas_ended_at=None)
+        self.campaign_1.rounds.first().save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = c.get(url, accept="application/json")
+        self.assertTrue(any("polio_round" in query["sql"] for query in queries.captured_queries))
+        self.assertNotIn(self.country_org_unit_1.id, [result["id"] for result in response.json()["results"]])
+
     def test_lqas_zoomin_anon_access(self):
         c = APIClient()
         response = c.get(
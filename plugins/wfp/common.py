@@ -18,20 +18,26 @@ Usage:
 import logging
 import traceback
 
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from functools import reduce
-from operator import or_
+from itertools import groupby
+from operator import itemgetter, or_
 
 import sentry_sdk
 
 from dateutil.relativedelta import relativedelta
+from django import db
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.db import transaction
 from django.db.models import Case, CharField, Count, DateField, F, FloatField, Func, IntegerField, Q, Sum, Value, When
 from django.db.models.fields.json import KeyTextTransform
 from django.db.models.functions import Cast, Coalesce, Concat, Extract, ExtractMonth, ExtractYear, Substr
+from django.utils import timezone
 
-from iaso.models import Entity, EntityType, TaskLog
+from iaso.models import Entity, EntityType, Task, TaskLog
 from iaso.models.base import Instance
 from plugins.wfp.models import Beneficiary, Dhis2SyncResults, Journey, MonthlyStatistics, ScreeningData, Step, Visit
 
@@ -745,16 +751,194 @@ class ETL:
         ).order_by("entity_id", "source_created_at", "created_at")
         return query_set, current_page
 
+    # ------------------------------------------------------------------
+    # Chunked run
+    # ------------------------------------------------------------------
+    def run_in_chunks(
+        self, program_type, updated_entity_ids, task_name, updated_since=None, chunk_size=5000, max_workers=None
+    ):
+        """Process the updated entities in chunks of consecutive entity ids.
+
+        Chunks are independent: each one reads its submissions and
+        upserts its beneficiaries in its own transaction, so they are
+        processed by a pool of ``max_workers`` threads (defaults to
+        ``WFP_ETL_MAX_WORKERS``), each with its own database connection.
+
+        Every chunk saved is recorded as a successful ``Task`` which is
+        the checkpoint of the chunk: when a run is retried after a
+        failure, the chunks already saved, and whose entities did not
+        change since, are skipped. The run fails when a chunk could not
+        be saved, so that the next run retries it.
+
+        Checkpoints are scoped to the run by ``updated_since``, the date
+        from which the updated entities were selected: a retry selects
+        them from the same date. Without it (first run or ``all_data``),
+        every chunk is processed again, e.g. after a fix of the ETL.
+        """
+        max_workers = max_workers or settings.WFP_ETL_MAX_WORKERS
+        account = self.get_account()
+        entity_ids = sorted(updated_entity_ids)
+        chunks = self._cut_chunks(entity_ids, account, task_name, updated_since, chunk_size)
+        logger.info(
+            f"Processing {len(entity_ids)} entities {program_type} across {len(chunks)} chunks for {account} "
+            f"with {max_workers} workers"
+        )
+
+        if max_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [
+                    executor.submit(self._run_chunk_in_thread, program_type, *chunk, account, task_name, updated_since)
+                    for chunk in chunks
+                ]
+                statuses = [future.result() for future in futures]
+            finally:
+                # on errors, don't start the chunks waiting in the queue
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            statuses = [self._run_chunk(program_type, *chunk, account, task_name, updated_since) for chunk in chunks]
+
+        errored_count = statuses.count("ERRORED")
+        if errored_count:
+            raise Exception(f"{errored_count} of {len(chunks)} chunks of {self.entity_type} could not be saved")
+        logger.info(f"{statuses.count('SKIPPED')} of {len(chunks)} chunks of {self.entity_type} already up to date")
+
+    def _cut_chunks(self, entity_ids, account, task_name, updated_since, chunk_size):
+        """Cut the sorted ``entity_ids`` into chunks of consecutive ids.
+
+        Each chunk takes the next ``chunk_size`` ids after the last id of
+        the previous chunk, or, when it has a checkpoint, the ids up to
+        the last id of its checkpoint: an entity updated since a failed
+        run only changes the chunk it falls in, not the following ones.
+
+        Returns a list of ``(after_id, entity_ids, checkpoint)``.
+        """
+        chunks = []
+        after_id = 0
+        start = 0
+        while start < len(entity_ids):
+            checkpoint = self._get_checkpoint(account, task_name, updated_since, after_id)
+            end = start + chunk_size
+            if checkpoint is not None:
+                end = max(bisect_right(entity_ids, checkpoint.params["last_id"]), start + 1)
+            chunk = entity_ids[start:end]
+            chunks.append((after_id, chunk, checkpoint))
+            after_id = chunk[-1]
+            start = end
+        return chunks
+
+    def _get_checkpoint(self, account, task_name, updated_since, after_id):
+        """The last chunk saved by this run from the entities after ``after_id``."""
+        if updated_since is None:
+            return None
+        return (
+            Task.objects.filter(
+                account=account,
+                name__startswith=f"{task_name} for {self.entity_type} on entities ",
+                status="SUCCESS",
+                params__after_id=after_id,
+                params__updated_since=str(updated_since),
+            )
+            .order_by("-started_at")
+            .first()
+        )
+
+    def _run_chunk_in_thread(self, program_type, after_id, entity_ids, checkpoint, account, task_name, updated_since):
+        try:
+            return self._run_chunk(program_type, after_id, entity_ids, checkpoint, account, task_name, updated_since)
+        finally:
+            # worker threads get their own database connection, don't leak it
+            db.connection.close()
+
+    def _run_chunk(self, program_type, after_id, entity_ids, checkpoint, account, task_name, updated_since=None):
+        """Process and save one chunk of entities, unless its checkpoint is
+        still valid. Returns the status of the chunk.
+        """
+        name = f"{task_name} for {self.entity_type} on entities {entity_ids[0]}-{entity_ids[-1]}"
+        if checkpoint is not None and not self._has_changed_since(entity_ids, checkpoint.started_at):
+            logger.info(f"Skipping {name}, saved by task {checkpoint.id}")
+            return "SKIPPED"
+
+        task = Task(
+            name=name,
+            account=account,
+            status="QUEUED",
+            started_at=timezone.now(),
+            params={
+                "after_id": after_id,
+                "last_id": entity_ids[-1],
+                "entities_count": len(entity_ids),
+                "updated_since": str(updated_since) if updated_since is not None else None,
+            },
+        )
+        submissions, _ = ETL._retrieve_submissions(self.entity_type, entity_ids, page_size=len(entity_ids))
+        existing_beneficiaries = {
+            beneficiary.entity_id: beneficiary
+            for beneficiary in Beneficiary.objects.filter(account=account, entity_id__in=entity_ids)
+        }
+
+        all_beneficiaries = []
+        all_journeys = []
+        all_visits = []
+        all_steps = []
+        current_entity_id = None
+        entity_count = 0
+        skipped_count = 0
+
+        for entity_id, entity_submissions in groupby(submissions, key=itemgetter("entity_id")):
+            current_entity_id = entity_id
+            entity_count += 1
+
+            result = self._process_entity(
+                program_type, entity_id, list(entity_submissions), account, existing_beneficiaries
+            )
+            if result is None:
+                skipped_count += 1
+                continue
+
+            beneficiary, journeys, visits, steps = result
+            all_beneficiaries.append(beneficiary)
+            all_journeys.extend(journeys)
+            all_visits.extend(visits)
+            all_steps.extend(steps)
+
+        logger.info(
+            f"Processed {entity_count} entities total ({skipped_count} skipped) for {program_type} in {name}. "
+            f"Saving: {len(all_beneficiaries)} beneficiaries, "
+            f"{len(all_journeys)} journeys, "
+            f"{len(all_visits)} visits, "
+            f"{len(all_steps)} steps \n"
+        )
+        self._save_all(
+            all_beneficiaries,
+            all_journeys,
+            all_visits,
+            all_steps,
+            account,
+            current_entity_id,
+            task,
+            entity_ids=entity_ids,
+        )
+        return task.status
+
+    def _has_changed_since(self, entity_ids, date):
+        """Whether an entity or a submission of the entities was updated since ``date``."""
+        return (
+            Instance.objects.filter(entity_id__in=entity_ids, updated_at__gte=date).exists()
+            or Entity.objects_include_deleted.filter(id__in=entity_ids, updated_at__gte=date).exists()
+        )
+
     # ------------------------------------------------------------------
     # Entity processing
     # ------------------------------------------------------------------
-    def _process_entity(self, program_type, entity_id, submissions, account, existing_entity_ids):
+    def _process_entity(self, program_type, entity_id, submissions, account, existing_beneficiaries):
         """Process all submissions for a single entity.
 
-        Returns ``(beneficiary_or_None, journeys, visits, steps)`` where
-        ``beneficiary_or_None`` is a **new** (unsaved) ``Beneficiary``
-        instance when the entity was not previously known, or ``None``
-        when the entity already had a record.
+        Returns ``(beneficiary, journeys, visits, steps)`` where
+        ``beneficiary`` is a **new** (unsaved) ``Beneficiary`` instance
+        when the entity is not in ``existing_beneficiaries`` (a dict of
+        entity id to ``Beneficiary``), or the existing one updated with
+        the latest values of the submissions.
 
         Returns ``None`` (single value) when the entity should be skipped
         entirely (invalid data, no journeys, etc.).
@@ -767,19 +951,12 @@ class ETL:
         if not self._is_valid_beneficiary(beneficiary_info):
             return None
 
-        is_new = entity_id not in existing_entity_ids
-        if is_new:
-            beneficiary = Beneficiary(
-                entity_id=entity_id,
-                gender=beneficiary_info["gender"],
-                birth_date=beneficiary_info["birth_date"],
-                account=account,
-                guidelines=guidelines,
-            )
-        else:
-            beneficiary = Beneficiary.objects.filter(entity_id=entity_id).first()
-            if beneficiary is None:
-                return None
+        beneficiary = existing_beneficiaries.get(entity_id)
+        if beneficiary is None:
+            beneficiary = Beneficiary(entity_id=entity_id, account=account)
+        beneficiary.gender = beneficiary_info["gender"]
+        beneficiary.birth_date = beneficiary_info["birth_date"]
+        beneficiary.guidelines = guidelines
 
         journey_groups = self._split_into_journeys(submissions)
         if not journey_groups:
@@ -818,8 +995,7 @@ class ETL:
         if all_journeys[0].nutrition_programme is None:
             return None
 
-        new_beneficiary = beneficiary if is_new else None
-        return new_beneficiary, all_journeys, all_visits, all_steps
+        return beneficiary, all_journeys, all_visits, all_steps
 
     # ------------------------------------------------------------------
     # Beneficiary info
@@ -1225,24 +1401,38 @@ class ETL:
     # ------------------------------------------------------------------
 
     @staticmethod
-    def _save_all(beneficiaries, journeys, visits, steps, account, last_entity_id, task):
+    def _save_all(beneficiaries, journeys, visits, steps, account, last_entity_id, task, entity_ids=None):
         """Bulk-save all ETL objects.
 
+        Beneficiaries are upserted: the ones already saved are updated
+        and their journeys (with their visits and steps) are replaced,
+        the new ones are created. The beneficiaries of ``entity_ids``
+        which are not in ``beneficiaries`` anymore (deleted entities,
+        invalid data) are deleted.
+
         Objects are saved in dependency order (Beneficiary -> Journey ->
         Visit -> Step) so that foreign-key IDs are available at each
         stage (PostgreSQL ``bulk_create`` sets PKs on the returned
         objects).
         """
         task.save()
+        existing_beneficiaries = [beneficiary for beneficiary in beneficiaries if beneficiary.pk is not None]
+        new_beneficiaries = [beneficiary for beneficiary in beneficiaries if beneficiary.pk is None]
         try:
             with transaction.atomic():
-                Beneficiary.objects.bulk_create(beneficiaries)
+                if entity_ids is not None:
+                    Beneficiary.objects.filter(account=account, entity_id__in=entity_ids).exclude(
+                        id__in=[beneficiary.pk for beneficiary in existing_beneficiaries]
+                    ).delete()
+                Journey.objects.filter(beneficiary__in=existing_beneficiaries).delete()
+                Beneficiary.objects.bulk_update(existing_beneficiaries, ["gender", "birth_date", "guidelines"])
+                Beneficiary.objects.bulk_create(new_beneficiaries)
                 Journey.objects.bulk_create(journeys)
                 Visit.objects.bulk_create(visits)
                 Step.objects.bulk_create(steps)
                 status = "SUCCESS"
                 logger.info(
-                    f"Saved: {len(beneficiaries)} beneficiaries, "
+                    f"Saved: {len(new_beneficiaries)} new and {len(existing_beneficiaries)} updated beneficiaries, "
                     f"{len(journeys)} journeys, "
                     f"{len(visits)} visits, "
                     f"{len(steps)} steps"
@@ -1259,6 +1449,7 @@ class ETL:
                 task=task,
                 message=f"{err} for {account} on beneficiary {last_entity_id}",
             )
+        task.ended_at = timezone.now()
         task.status = status
         task.save()
 
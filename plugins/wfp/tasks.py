@@ -91,8 +91,7 @@ def etl_ng(all_data=None):
     etl_u5 = ETL(entity_type_U5_code)
     account = etl_u5.get_account()
     updated_U5_beneficiaries = etl_u5.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=account, entity_id__in=updated_U5_beneficiaries).delete()
-    NG_Under5().run(updated_U5_beneficiaries, entity_type_U5_code, task_name)
+    NG_Under5().run(updated_U5_beneficiaries, entity_type_U5_code, task_name, last_success_task_date)
     logger.info(
         f"----------------------------- Aggregating journey for {account} per org unit, admission and period(month and year) -----------------------------"
     )
@@ -104,8 +103,7 @@ def etl_ng(all_data=None):
     etl_pbwg = ETL(entity_type_pbwg_code)
     pbwg_account = etl_pbwg.get_account()
     updated_pbwg_beneficiaries = etl_pbwg.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=pbwg_account, entity_id__in=updated_pbwg_beneficiaries).delete()
-    NG_PBWG().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name)
+    NG_PBWG().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name, last_success_task_date)
     logger.info(
         f"----------------------------- Aggregating PBWG journey for {pbwg_account} per org unit, admission and period(month and year) -----------------------------"
     )
@@ -188,9 +186,8 @@ def etl_ssd(all_data=None):
     etl_u5 = ETL(entity_type_u5_code)
     child_account = etl_u5.get_account()
     updated_beneficiaries = etl_u5.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=child_account, entity_id__in=updated_beneficiaries).delete()
 
-    Under5().run(updated_beneficiaries, entity_type_u5_code, task_name)
+    Under5().run(updated_beneficiaries, entity_type_u5_code, task_name, last_success_task_date)
 
     logger.info(f"Aggregating Children under 5 journey for {child_account} per org unit, admission and period")
     org_units = etl_u5.get_org_unit_and_period_with_updated_data(last_success_task_date)
@@ -202,8 +199,7 @@ def etl_ssd(all_data=None):
     etl_pbwg = ETL(entity_type_pbwg_code)
     pbwg_account = etl_pbwg.get_account()
     updated_pbwg_beneficiaries = etl_pbwg.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=pbwg_account, entity_id__in=updated_pbwg_beneficiaries).delete()
-    Pbwg().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name)
+    Pbwg().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name, last_success_task_date)
 
     logger.info(f"Aggregating PBWG journey for {pbwg_account} per org unit, admission and period")
     pbwg_org_units = etl_pbwg.get_org_unit_and_period_with_updated_data(last_success_task_date)
@@ -242,8 +238,7 @@ def etl_ethiopia(all_data=None):
     etl_u5 = ETL(entity_type_U5_code)
     child_account = etl_u5.get_account()
     updated_U5_beneficiaries = etl_u5.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=child_account, entity_id__in=updated_U5_beneficiaries).delete()
-    ET_Under5().run(updated_U5_beneficiaries, entity_type_U5_code, task_name)
+    ET_Under5().run(updated_U5_beneficiaries, entity_type_U5_code, task_name, last_success_task_date)
 
     logger.info(
         f"----------------------------- Aggregating Children under 5 journey for {child_account} per org unit, admission and period(month and year) -----------------------------"
@@ -256,8 +251,7 @@ def etl_ethiopia(all_data=None):
     etl_pbwg = ETL(entity_type_pbwg_code)
     pbwg_account = etl_pbwg.get_account()
     updated_pbwg_beneficiaries = etl_pbwg.get_updated_entity_ids(last_success_task_date)
-    Beneficiary.objects.filter(account=pbwg_account, entity_id__in=updated_pbwg_beneficiaries).delete()
-    Pbwg().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name)
+    Pbwg().run(updated_pbwg_beneficiaries, entity_type_pbwg_code, task_name, last_success_task_date)
 
     logger.info(
         f"----------------------------- Aggregating PBWG journey for {pbwg_account} per org unit, admission and period(month and year) -----------------------------"
@@ -514,3 +514,89 @@ class ETLTestCase(TestCase):
         self.assertEqual(len(created_PBWG_monthlyStatistics), 2)
         self.assertEqual(created_PBWG_monthlyStatistics[1].physiology_status, "Breastfeeding")
         self.assertEqual(created_PBWG_monthlyStatistics[1].period, "202508")
+
+    def test_save_all_upserts_beneficiaries(self):
+        beneficiary = Beneficiary.objects.create(
+            birth_date="2024-01-01", gender="Male", entity=self.entities[0], account=self.account
+        )
+        Journey.objects.create(beneficiary=beneficiary, programme_type="U5", instance_id=1)
+        Beneficiary.objects.create(
+            birth_date="2024-01-01", gender="Male", entity=self.entities[1], account=self.account
+        )
+        other_beneficiary = Beneficiary.objects.create(
+            birth_date="2024-01-01", gender="Male", entity=self.entities[2], account=self.account
+        )
+
+        beneficiary.gender = "Female"
+        new_beneficiary = Beneficiary(
+            birth_date="2025-01-01", gender="Male", entity=self.entities[3], account=self.account
+        )
+        journeys = [
+            Journey(beneficiary=beneficiary, programme_type="U5", instance_id=2),
+            Journey(beneficiary=new_beneficiary, programme_type="U5", instance_id=3),
+        ]
+        task = m.Task(name="etl", account=self.account, status="QUEUED")
+        entity_ids = [entity.id for entity in self.entities[:2]] + [self.entities[3].id]
+        ETL._save_all([beneficiary, new_beneficiary], journeys, [], [], self.account, None, task, entity_ids=entity_ids)
+
+        self.assertEqual(task.status, "SUCCESS")
+        # the beneficiary keeps its id, its journeys are replaced
+        beneficiary.refresh_from_db()
+        self.assertEqual(beneficiary.gender, "Female")
+        self.assertQuerySetEqual(beneficiary.journey_set.all(), [2], lambda journey: journey.instance_id)
+        self.assertEqual(Journey.objects.get(beneficiary__entity=self.entities[3]).instance_id, 3)
+        # the beneficiary of an entity of the chunk without valid data is removed, the others are untouched
+        self.assertFalse(Beneficiary.objects.filter(entity=self.entities[1]).exists())
+        self.assertTrue(Beneficiary.objects.filter(id=other_beneficiary.id).exists())
+
+    def test_run_in_chunks_skips_the_saved_chunks(self):
+        self.entity_type.code = "test_under5"
+        self.entity_type.save()
+        Beneficiary.objects.create(
+            birth_date="2024-01-01", gender="Male", entity=self.entities[0], account=self.account
+        )
+        entity_ids = [entity.id for entity in self.entities]
+        etl = ETL("test_under5")
+
+        etl.run_in_chunks("U5", entity_ids, "etl_test", "2025-01-01", chunk_size=3)
+        # no submissions: no beneficiary is kept, each of the 3 chunks is checkpointed
+        self.assertEqual(Beneficiary.objects.count(), 0)
+        tasks = m.Task.objects.filter(name__startswith="etl_test for test_under5")
+        self.assertEqual(tasks.filter(status="SUCCESS").count(), 3)
+
+        etl.run_in_chunks("U5", entity_ids, "etl_test", "2025-01-01", chunk_size=3)
+        self.assertEqual(tasks.count(), 3)
+
+        self.entities[4].save()
+        etl.run_in_chunks("U5", entity_ids, "etl_test", "2025-01-01", chunk_size=3)
+        self.assertEqual(tasks.count(), 4)
+        self.assertEqual(
+            tasks.order_by("-id").first().name,
+            f"etl_test for test_under5 on entities {self.entities[3].id}-{self.entities[5].id}",
+        )
+
+        # the checkpoints of another run, or of any run when all the data is processed again, are not used
+        etl.run_in_chunks("U5", entity_ids, "etl_test", "2025-02-01", chunk_size=3)
+        self.assertEqual(tasks.count(), 7)
+        etl.run_in_chunks("U5", entity_ids, "etl_test", chunk_size=3)
+        etl.run_in_chunks("U5", entity_ids, "etl_test", chunk_size=3)
+        self.assertEqual(tasks.count(), 13)
+
+    def test_run_in_chunks_keeps_the_saved_chunks_of_a_retry(self):
+        self.entity_type.code = "test_under5"
+        self.entity_type.save()
+        entity_ids = [entity.id for entity in self.entities]
+        etl = ETL("test_under5")
+
+        etl.run_in_chunks("U5", entity_ids[:1] + entity_ids[2:], "etl_test", "2025-01-01", chunk_size=3)
+        tasks = m.Task.objects.filter(name__startswith="etl_test for test_under5")
+        self.assertEqual(tasks.count(), 2)
+
+        # an entity updated before the retry only changes its own chunk, the next chunks are still saved
+        self.entities[1].save()
+        etl.run_in_chunks("U5", entity_ids, "etl_test", "2025-01-01", chunk_size=3)
+        self.assertEqual(tasks.count(), 3)
+        self.assertEqual(
+            tasks.order_by("-id").first().name,
+            f"etl_test for test_under5 on entities {self.entities[0].id}-{self.entities[3].id}",
+        )